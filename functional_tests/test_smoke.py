@@ -31,6 +31,12 @@ while output.get("is_finished", False) is False:
     
     time.sleep(0.5)
 
+# look up several ids at once; unknown ones are listed separately
+r = requests.get(BASE_URL+"/status", params={'ids': "{},not-an-id".format(id_)})
+
+if r.json()['unknown'] != ["not-an-id"] or id_ not in r.json()['jobs']:
+    print("ERROR: batch status returned {}".format(r.text))
+
 # check for the json exif data
 r = requests.get(BASE_URL+"/data/{}.json".format(id_))
 
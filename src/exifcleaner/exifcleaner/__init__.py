@@ -1,2 +1,3 @@
 
-
+from .wsgi import ExifCleanerService
+from .activation.wsgi import ActivationService
@@ -5,6 +5,7 @@ from . import manager
 from .. import util
 from ..user.manager import UserManager
 from ..user.errors import UserNotFound
+from ..common.dispatch import Dispatcher
 from webob import Request, Response
 import base64
 import re
@@ -44,35 +45,18 @@ class ActivationService:
             }
         }
         
-    def __call__(self, environ, start_response):
-        request = Request(environ)
-        
-        response = None
+        self.dispatcher = Dispatcher([self])
         
-        print(request.path)
+    def __call__(self, environ, start_response):
+        return self.dispatcher(environ, start_response)
         
+    def handle(self, request, method, params, environ, start_response):
+        """
+        Run the callable a request was routed to, and answer with its response.
+        """
         try:
-            for regexp, method_mapping in self.path_map.items():
-                match = re.match(regexp, request.path)
-                
-                if match:
-                    print(match.groupdict())
-                    
-                    for http_method, method in method_mapping.items():
-                        print("METHOD: ", http_method)
-                        print("CALLABLE: ", method)
-                        print("REQ METHOD: ", request.method)
-                        if http_method == request.method:
-                            response = method(request, **match.groupdict())
-                            return response(environ, start_response)
-                    else:
-                        if request.method not in ["GET", "HEAD"]:
-                            raise util.web.BadRequest("Method not supported", code=405)
-                        else:
-                            raise util.web.BadRequest()
-            else:
-                raise util.web.NotFound()
-            
+            response = method(request, **params)
+            return response(environ, start_response)
         except manager.errors.ActivationNotFound:
             r = util.web.NotFound()
             return r(environ, start_response)
@@ -0,0 +1,3 @@
+"""
+Administrative views of the running system.
+"""
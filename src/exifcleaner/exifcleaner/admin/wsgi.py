@@ -0,0 +1,100 @@
+"""
+WSGI Application providing a REST(ish) API for administrators.
+"""
+
+from ..common.wsgi import BaseService
+from .. import util
+from ..metrics import JobMetrics
+from ..routing import default_routes, Router
+from ..scheduling import FairQueue
+from ..sharding import ShardRing
+from webob import Response
+import redis
+import re
+
+class AdminService(BaseService):
+    """
+    RESTish API for keeping an eye on the system. All functions require an
+    admin user.
+    
+    /admin/stats - GET, rolling job timings. Pass ?window=N for the last N 
+                   seconds (default 900).
+    /admin/tenants - GET, jobs waiting and the oldest one's wait per tenant, 
+                     for each queue, and recent job counts and average waits.
+                     Takes ?window=N too. Counts are added up over all the
+                     shards.
+    
+    redis_url - url of the redis server, or a list of urls when jobs are 
+                spread over several (as for ExifCleanerService). The first 
+                one has the users and metrics.
+    """
+    
+    def __init__(self, redis_url="redis://127.0.0.1:6379", queue_names=None):
+        if isinstance(redis_url, str):
+            shard_urls = [redis_url]
+        else:
+            shard_urls = list(redis_url)
+        
+        BaseService.__init__(self, redis_url=shard_urls[0])
+        
+        self.redis = redis.StrictRedis.from_url(shard_urls[0])
+        self.shards = ShardRing(shard_urls)
+        self.metrics = JobMetrics(self.redis)
+        
+        if queue_names is None:
+            queue_names = Router(default_routes("exifcleaner")).queues
+        
+        # one per queue name per shard
+        self.queues = [FairQueue(name, connection=connection) for connection in self.shards.connections for name in queue_names]
+        
+        self.path_map = {
+            re.compile("/admin/stats/?$"): {
+                "GET": self.stats
+            },
+            re.compile("/admin/tenants/?$"): {
+                "GET": self.tenants
+            }
+        }
+        
+    def window(self, request):
+        try:
+            return int(request.GET.get("window", 900))
+        except ValueError:
+            raise util.web.BadRequest("Bad window")
+    
+    def stats(self, request):
+        self.authorize(request, admin=True)
+        
+        window = self.window(request)
+        
+        response = Response()
+        response.json_body = self.metrics.summary(window=window)
+        
+        return response
+    
+    def tenants(self, request):
+        self.authorize(request, admin=True)
+        
+        window = self.window(request)
+        
+        queues = {}
+        
+        for queue in self.queues:
+            tenants = queues.setdefault(queue.name, {})
+            
+            for tenant, stats in queue.tenant_stats().items():
+                if tenant in tenants:
+                    tenants[tenant] = {
+                        'depth': tenants[tenant]['depth'] + stats['depth'],
+                        'wait': max(tenants[tenant]['wait'], stats['wait'])
+                    }
+                else:
+                    tenants[tenant] = stats
+        
+        response = Response()
+        response.json_body = {
+            'waiting': queues,
+            'recent': self.metrics.tenants(window=window)
+        }
+        
+        return response
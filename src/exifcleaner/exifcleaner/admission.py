@@ -0,0 +1,155 @@
+"""
+Admission control for new uploads.
+
+When workers fall behind, accepting more uploads only makes every job wait
+longer. The AdmissionController looks at how many jobs are queued and how
+long the oldest one has been waiting, and turns new uploads away with a
+Retry-After header once either goes over its limit.
+
+The queue numbers are cached for a short while, so a busy web process
+doesn't ask redis about them on every request.
+"""
+
+import datetime
+import math
+import time
+from rq.utils import utcparse
+from . import util
+
+class AdmissionController:
+    """
+    redis - a StrictRedis connection.
+    queues - list of rq.Queue objects to watch. They can be on different redis
+             servers (see exifcleaner.sharding); each is asked about its own.
+    max_depth - integer, most jobs that can be waiting across all queues.
+                None for no limit.
+    max_age - number, most seconds the oldest waiting job can have been
+              queued for. None for no limit.
+    refresh - number, seconds to cache the queue numbers for.
+    max_retry - integer, the largest Retry-After to hand out, in seconds.
+    code - integer, HTTP status to refuse uploads with (503 or 429).
+    """
+    def __init__(self, redis, queues, max_depth=None, max_age=None, refresh=0.5, max_retry=300, code=503):
+        self.redis = redis
+        self.queues = queues
+        self.max_depth = max_depth
+        self.max_age = max_age
+        self.refresh = refresh
+        self.max_retry = max_retry
+        self.code = code
+
+        self._checked = None
+        self._depth = 0
+        self._age = 0.0
+
+    @property
+    def enabled(self):
+        return self.max_depth is not None or self.max_age is not None
+
+    def _measure(self):
+        """
+        Internal function. Ask redis for the total depth of the queues, and the
+        age of the oldest job at the front of any of them.
+        """
+        depth = 0
+        age = 0.0
+
+        for connection, queues in self._by_connection():
+            with connection.pipeline() as pipe:
+                for queue in queues:
+                    pipe.llen(queue.key)
+                    pipe.lindex(queue.key, 0)
+                results = pipe.execute()
+
+            depth += sum(results[0::2])
+            heads = [id_ for id_ in results[1::2] if id_ is not None]
+
+            if not heads:
+                continue
+
+            with connection.pipeline() as pipe:
+                for id_ in heads:
+                    if isinstance(id_, bytes):
+                        id_ = id_.decode("utf-8")
+                    pipe.hget("rq:job:{}".format(id_), "enqueued_at")
+                enqueued = pipe.execute()
+
+            now = datetime.datetime.utcnow()
+
+            for value in enqueued:
+                if value is None:
+                    continue
+
+                if isinstance(value, bytes):
+                    value = value.decode("utf-8")
+
+                age = max(age, (now - utcparse(value)).total_seconds())
+
+        return depth, age
+
+    def _by_connection(self):
+        """
+        Internal function. Group the queues by the redis connection they use,
+        in order. Queues without one use self.redis.
+        """
+        groups = []
+
+        for queue in self.queues:
+            connection = getattr(queue, "connection", None) or self.redis
+
+            for existing, queues in groups:
+                if existing is connection:
+                    queues.append(queue)
+                    break
+            else:
+                groups.append((connection, [queue]))
+
+        return groups
+
+    def snapshot(self):
+        """
+        Return a tuple of (depth, age of oldest job), refreshing the cached
+        values if they are older than self.refresh seconds.
+        """
+        now = time.monotonic()
+
+        if self._checked is None or now - self._checked >= self.refresh:
+            self._depth, self._age = self._measure()
+            self._checked = now
+
+        return self._depth, self._age
+
+    def retry_after(self, depth, age):
+        """
+        Estimate how many seconds it will take for the queues to get back under
+        their limits.
+
+        The age of the oldest job is roughly how long it takes to get through
+        `depth` jobs, which gives the time per job.
+        """
+        wait = 1.0
+
+        if self.max_age is not None and age > self.max_age:
+            wait = max(wait, age - self.max_age)
+
+        # uploads are refused at max_depth, so there is room again once the
+        # queues are one below it
+        if self.max_depth is not None and depth >= self.max_depth and depth:
+            wait = max(wait, (depth - self.max_depth + 1) * (age / depth))
+
+        return int(min(math.ceil(wait), self.max_retry))
+
+    def check(self):
+        """
+        Raise util.web.TooBusy if new uploads should be turned away.
+        """
+        if not self.enabled:
+            return
+
+        depth, age = self.snapshot()
+
+        too_deep = self.max_depth is not None and depth >= self.max_depth
+        too_old = self.max_age is not None and age > self.max_age
+
+        if too_deep or too_old:
+            raise util.web.TooBusy(self.retry_after(depth, age), code=self.code)
@@ -0,0 +1,267 @@
+"""
+WSGI app serving the files made for each upload under /data.
+
+Files are sent with the server's wsgi.file_wrapper where there is one, so
+e.g. gunicorn can use sendfile(). Downloads can be resumed: single byte
+ranges are supported, and clients can revalidate with If-None-Match. The
+ETags of finished jobs are worked out by the worker when it writes the
+files (see jobs.process), so they are strong and cost one HGET here.
+
+Behind nginx or Apache the bytes can be sent by the proxy instead. With
+sendfile="x-accel-redirect", responses only carry an X-Accel-Redirect header
+pointing at accel_prefix, which nginx maps onto data_dir:
+
+    location /protected-data/ {
+        internal;
+        alias /srv/exifcleaner/tmp/;
+    }
+
+sendfile="x-sendfile" does the same for Apache's mod_xsendfile, with the
+file's full path.
+"""
+
+import email.utils
+import json
+import mimetypes
+import os
+import re
+from webob import Request, Response
+from . import errors
+from . import storage
+from . import util
+from .results import ResultStore
+
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+class ArtifactService:
+    """
+    data_dir - string, where the files live.
+    layout - the storage layout the files were written with, to find them.
+    shards - sharding.ShardRing of the redis servers holding the status
+             records, for ETags. None to only use weak ETags.
+    space - space.SpaceManager, told about each download so recently used
+            files are evicted last. None to skip.
+    prefix - the path the app is mounted at.
+    sendfile - None to send files from Python, or "x-accel-redirect" or
+               "x-sendfile" to have the proxy in front send them.
+    accel_prefix - internal location nginx serves data_dir from, for
+                   "x-accel-redirect".
+    block_size - integer, bytes read at a time when sending from Python.
+    """
+    def __init__(self, data_dir, layout, shards=None, space=None, prefix="/data", sendfile=None, accel_prefix="/protected-data", block_size=65536):
+        if sendfile not in (None, "x-accel-redirect", "x-sendfile"):
+            raise errors.ExifCleanerConfigError("sendfile must be None, 'x-accel-redirect' or 'x-sendfile'")
+
+        self.data_dir = os.path.abspath(data_dir)
+        self.layout = layout
+        self.shards = shards
+        self.space = space
+        self.prefix = prefix
+        self.sendfile = sendfile
+        self.accel_prefix = accel_prefix.rstrip("/")
+        self.block_size = block_size
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+
+        try:
+            if request.method not in ("GET", "HEAD"):
+                raise util.web.BadRequest("Method not supported", code=405)
+
+            return self.serve(request, environ, start_response)
+        except util.web.BadRequest as e:
+            return e(environ, start_response)
+
+    def relative_path(self, path_info):
+        """
+        Return the path of the file a request is for, relative to data_dir.
+        Raises NotFound for anything that isn't an upload's file.
+        """
+        if not path_info.startswith(self.prefix + "/"):
+            raise util.web.NotFound()
+
+        relative = self.layout.resolve(path_info[len(self.prefix):]).lstrip("/")
+
+        if any(part in ("", ".", "..") or part.startswith(".") for part in relative.split("/")):
+            raise util.web.NotFound()
+
+        return relative
+
+    def etag(self, name, stat):
+        """
+        Return the ETag for a file: the strong one saved when its job
+        finished, or a weak one from its size and modification time for
+        files that are still being worked on (or if there are no records).
+        """
+        id_ = storage.id_from_name(name)
+
+        if self.shards is not None:
+            connection = self.shards.connection_for(id_)
+            etags = connection.hget(ResultStore(connection).key(id_), "etags")
+
+            if etags:
+                etag = json.loads(etags.decode("utf-8")).get(name)
+
+                if etag:
+                    return etag
+
+        return 'W/"{:x}-{:x}"'.format(stat.st_size, stat.st_mtime_ns)
+
+    @staticmethod
+    def matches(header, etag):
+        """
+        Return True if an If-None-Match header matches etag (by the weak
+        comparison, as RFC 7232 says to for If-None-Match).
+        """
+        if header.strip() == "*":
+            return True
+
+        bare = etag[2:] if etag.startswith("W/") else etag
+
+        for candidate in header.split(","):
+            candidate = candidate.strip()
+
+            if candidate.startswith("W/"):
+                candidate = candidate[2:]
+
+            if candidate == bare:
+                return True
+
+        return False
+
+    @staticmethod
+    def byte_range(header, size):
+        """
+        Parse a Range header for a file of size bytes. Returns a (start, end)
+        tuple, end exclusive; None to send the whole file (no header, or one
+        that isn't a single byte range); or False if the range can't be
+        satisfied.
+        """
+        match = RANGE.match(header.strip()) if header else None
+
+        if match is None:
+            return None
+
+        first, last = match.groups()
+
+        if not first and not last:
+            return None
+
+        if not first:
+            # the last n bytes
+            length = int(last)
+
+            if length == 0:
+                return False
+
+            return max(0, size - length), size
+
+        start = int(first)
+        end = int(last) + 1 if last else size
+
+        if start >= size or end <= start:
+            return False
+
+        return start, min(end, size)
+
+    def serve(self, request, environ, start_response):
+        relative = self.relative_path(request.path_info)
+        path = os.path.join(self.data_dir, relative)
+        name = os.path.basename(relative)
+
+        # opened before anything else, so a file the sweeper removes in the
+        # meantime is either sent whole or not found
+        try:
+            fp = open(path, "rb")
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            raise util.web.NotFound()
+
+        try:
+            stat = os.fstat(fp.fileno())
+            etag = self.etag(name, stat)
+
+            if self.space is not None:
+                self.space.touch(storage.id_from_name(name))
+
+            headers = [
+                ("Content-Type", mimetypes.guess_type(name)[0] or "application/octet-stream"),
+                ("ETag", etag),
+                ("Last-Modified", email.utils.formatdate(stat.st_mtime, usegmt=True)),
+                ("Accept-Ranges", "bytes")
+            ]
+
+            if_none_match = request.headers.get("If-None-Match")
+
+            if if_none_match and self.matches(if_none_match, etag):
+                fp.close()
+                start_response("304 Not Modified", [header for header in headers if header[0] != "Content-Type"])
+                return []
+
+            if self.sendfile == "x-accel-redirect":
+                fp.close()
+                start_response("200 OK", headers + [("X-Accel-Redirect", "{}/{}".format(self.accel_prefix, relative))])
+                return []
+
+            if self.sendfile == "x-sendfile":
+                fp.close()
+                start_response("200 OK", headers + [("X-Sendfile", path)])
+                return []
+
+            size = stat.st_size
+            span = self.byte_range(request.headers.get("Range"), size)
+
+            # a range is only for the version of the file the client has
+            if_range = request.headers.get("If-Range")
+
+            if span and if_range and (if_range != etag or etag.startswith("W/")):
+                span = None
+
+            if span is False:
+                fp.close()
+                response = Response("Range Not Satisfiable", status=416)
+                response.headers["Content-Range"] = "bytes */{}".format(size)
+                return response(environ, start_response)
+
+            if span is None:
+                status = "200 OK"
+                start, end = 0, size
+            else:
+                status = "206 Partial Content"
+                start, end = span
+                headers.append(("Content-Range", "bytes {}-{}/{}".format(start, end - 1, size)))
+
+            headers.append(("Content-Length", str(end - start)))
+            start_response(status, headers)
+
+            if request.method == "HEAD":
+                fp.close()
+                return []
+
+            wrapper = environ.get("wsgi.file_wrapper")
+
+            if span is None and wrapper is not None:
+                return wrapper(fp, self.block_size)
+
+            return self._read(fp, start, end)
+        except BaseException:
+            fp.close()
+            raise
+
+    def _read(self, fp, start, end):
+        """
+        Internal method. Generator of the bytes of fp from start to end.
+        """
+        try:
+            fp.seek(start)
+            remaining = end - start
+
+            while remaining > 0:
+                block = fp.read(min(self.block_size, remaining))
+
+                if not block:
+                    break
+
+                remaining -= len(block)
+                yield block
+        finally:
+            fp.close()
@@ -0,0 +1,354 @@
+"""
+Queue-driven worker autoscaler.
+
+Watches the job queues and starts or stops `rq worker` processes to match
+the load, between a minimum and maximum count. Decisions are made by a
+ScalingPolicy, which only acts once a condition has held for several samples
+in a row and waits out a cooldown after each change, so it doesn't flap.
+
+    $ python -m exifcleaner.autoscale --min 1 --max 8 exifcleaner-fast
+
+When jobs are spread over several redis servers, give the others with
+--shard-urls. The queues on all of them are added up, and workers are
+started on each in turn, so every shard has some (--min has to be at least
+the number of servers):
+
+    $ python -m exifcleaner.autoscale --redis-url redis://a:6379/0 --shard-urls redis://b:6379/0 --min 2 --max 8 exifcleaner-fast
+
+Pass --simulate to run the policy against a simulated load instead of real
+queues and workers, to see how it behaves:
+
+    $ python -m exifcleaner.autoscale --simulate --min 1 --max 8 exifcleaner
+"""
+
+import argparse
+import collections
+import os
+import signal
+import subprocess
+import sys
+import time
+from rq import Queue, Worker
+from . import errors
+from .admission import AdmissionController
+from .sharding import ShardRing
+
+# One observation of the system.
+#
+# time - seconds, any monotonic clock.
+# depth - jobs waiting.
+# latency - seconds the oldest waiting job has been queued.
+# cpu - load average divided by the number of cores; 1.0 is fully busy.
+# busy - number of workers currently running a job.
+Sample = collections.namedtuple("Sample", ["time", "depth", "latency", "cpu", "busy"])
+
+class ScalingPolicy:
+    """
+    Decides how many workers there should be.
+
+    min_workers, max_workers - integers, bounds on the number of workers.
+    up_depth - scale up when there are more than this many waiting jobs per
+               worker...
+    up_latency - ...or the oldest job has waited longer than this many seconds.
+    down_depth - scale down when there are fewer than this many waiting jobs
+                 per worker...
+    down_latency - ...and the oldest job has waited less than this...
+    down_busy - ...and the workers that would be left would be less than this
+                fraction busy. Stops a queue that is being kept empty from
+                looking idle.
+    max_cpu - never scale up while cpu is above this; more workers would just
+              fight over the same cores.
+    up_after, down_after - integers, number of samples in a row a condition
+                           has to hold before acting on it. Scaling down
+                           should be slower than scaling up.
+    cooldown - seconds to wait after a change before making another.
+    step - workers to add or remove at a time.
+    """
+    def __init__(self, min_workers=1, max_workers=4, up_depth=5, up_latency=10.0,
+                 down_depth=1, down_latency=2.0, down_busy=0.7, max_cpu=0.9, up_after=2,
+                 down_after=6, cooldown=30.0, step=1):
+        if min_workers < 0 or max_workers < min_workers:
+            raise errors.ExifCleanerConfigError("Need 0 <= min_workers <= max_workers")
+
+        if down_depth >= up_depth or down_latency >= up_latency:
+            raise errors.ExifCleanerConfigError("Scale down thresholds must be below the scale up thresholds")
+
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.up_depth = up_depth
+        self.up_latency = up_latency
+        self.down_depth = down_depth
+        self.down_latency = down_latency
+        self.down_busy = down_busy
+        self.max_cpu = max_cpu
+        self.up_after = up_after
+        self.down_after = down_after
+        self.cooldown = cooldown
+        self.step = step
+
+        self._ups = 0
+        self._downs = 0
+        self._changed = None
+
+    def decide(self, sample, current):
+        """
+        Return the number of workers there should be, given a Sample and the
+        current number of workers.
+        """
+        bounded = min(max(current, self.min_workers), self.max_workers)
+
+        if bounded != current:
+            self._changed = sample.time
+            return bounded
+
+        per_worker = sample.depth / max(current, 1)
+
+        wants_up = per_worker > self.up_depth or sample.latency > self.up_latency
+        remaining = current - self.step
+        wants_down = (per_worker < self.down_depth and 
+                      sample.latency < self.down_latency and
+                      (remaining <= 0 or sample.busy / remaining < self.down_busy))
+
+        if wants_up and sample.cpu <= self.max_cpu:
+            self._ups += 1
+        else:
+            self._ups = 0
+
+        if wants_down:
+            self._downs += 1
+        else:
+            self._downs = 0
+
+        if self._changed is not None and sample.time - self._changed < self.cooldown:
+            return current
+
+        desired = current
+
+        if self._ups >= self.up_after:
+            desired = min(current + self.step, self.max_workers)
+        elif self._downs >= self.down_after:
+            desired = max(current - self.step, self.min_workers)
+
+        if desired != current:
+            self._changed = sample.time
+            self._ups = 0
+            self._downs = 0
+
+        return desired
+
+def shard_list(redis_url, shard_urls):
+    """
+    The main redis url followed by the other shards, without repeats.
+    """
+    return [redis_url] + [url for url in shard_urls if url != redis_url]
+
+class WorkerPool:
+    """
+    Starts and stops `rq worker` processes for a set of queues.
+
+    shard_urls - other redis servers jobs are spread over. Each worker
+                 listens to one server; new ones go to whichever has the
+                 fewest.
+    """
+    def __init__(self, queues, redis_url, command=("rq", "worker"), shard_urls=()):
+        self.queues = queues
+        self.redis_url = redis_url
+        self.urls = shard_list(redis_url, shard_urls)
+        self.command = list(command)
+        self.processes = []
+
+        # pid: url the worker was started with
+        self._urls = {}
+
+    def reap(self):
+        """
+        Forget about workers that have exited.
+        """
+        for process in self.processes:
+            if process.poll() is not None:
+                self._urls.pop(process.pid, None)
+
+        self.processes = [p for p in self.processes if p.poll() is None]
+
+    def __len__(self):
+        self.reap()
+        return len(self.processes)
+
+    def next_url(self):
+        """
+        The url of the server with the fewest workers, earliest first.
+        """
+        counts = collections.Counter(self._urls.values())
+
+        return min(self.urls, key=lambda url: counts[url])
+
+    def resize(self, count):
+        self.reap()
+
+        while len(self.processes) < count:
+            url = self.next_url()
+            args = self.command + ["--url", url] + self.queues
+            print("Starting worker: {}".format(" ".join(args)))
+            process = subprocess.Popen(args)
+            self.processes.append(process)
+            self._urls[process.pid] = url
+
+        while len(self.processes) > count:
+            # newest first; SIGTERM lets rq finish the current job
+            process = self.processes.pop()
+            self._urls.pop(process.pid, None)
+            print("Stopping worker {}".format(process.pid))
+            process.send_signal(signal.SIGTERM)
+
+    def stop(self):
+        self.resize(0)
+
+class Supervisor:
+    """
+    Samples the queues every `interval` seconds and resizes the pool.
+
+    shard_urls - other redis servers jobs are spread over. Depth, latency
+                 and busy workers are taken over all of them.
+    """
+    def __init__(self, policy, pool, redis_url, interval=5.0, shard_urls=()):
+        self.policy = policy
+        self.pool = pool
+        self.interval = interval
+
+        self.shards = ShardRing(shard_list(redis_url, shard_urls))
+        self.redis = self.shards.connection(redis_url)
+
+        queues = [Queue(name, connection=connection) for connection in self.shards.connections for name in pool.queues]
+
+        # refresh=0; the supervisor does its own pacing
+        self.monitor = AdmissionController(self.redis, queues, refresh=0)
+
+    def sample(self):
+        depth, latency = self.monitor.snapshot()
+        cpu = os.getloadavg()[0] / (os.cpu_count() or 1)
+
+        busy = 0
+
+        for connection in self.shards.connections:
+            for worker in Worker.all(connection=connection):
+                if set(worker.queue_names()) & set(self.pool.queues) and worker.get_state() == "busy":
+                    busy += 1
+
+        return Sample(time.monotonic(), depth, latency, cpu, busy)
+
+    def run(self):
+        target = None
+
+        try:
+            while True:
+                sample = self.sample()
+                current = len(self.pool)
+
+                # workers that exited by themselves (e.g. SandboxWorker, to
+                # get rid of stuck threads) are replaced
+                if target is not None and current < target:
+                    print("Replacing {} worker(s) that exited".format(target - current))
+                    self.pool.resize(target)
+                    current = target
+
+                desired = self.policy.decide(sample, current)
+
+                if desired != current:
+                    print("depth={} latency={:.1f}s cpu={:.2f}: {} -> {} workers".format(sample.depth, sample.latency, sample.cpu, current, desired))
+                    self.pool.resize(desired)
+
+                target = desired
+
+                time.sleep(self.interval)
+        finally:
+            self.pool.stop()
+
+class Simulation:
+    """
+    A simple model of a queue and its workers, for trying out a policy
+    without any real load.
+
+    arrivals - callable, takes the time in seconds and returns how many jobs
+               arrive per second at that point.
+    service_time - seconds it takes one worker to finish one job.
+    cores - number of cores; each worker keeps one busy while it has work.
+    """
+    def __init__(self, policy, arrivals, service_time=0.5, cores=4, interval=5.0):
+        self.policy = policy
+        self.arrivals = arrivals
+        self.service_time = service_time
+        self.cores = cores
+        self.interval = interval
+
+    def run(self, duration):
+        """
+        Run for `duration` simulated seconds. Returns a list of
+        (Sample, number of workers) tuples, one per interval.
+        """
+        workers = self.policy.min_workers
+        depth = 0.0
+        history = []
+        now = 0.0
+
+        while now < duration:
+            depth += self.arrivals(now) * self.interval
+
+            # workers beyond the number of cores don't add any capacity
+            capacity = min(workers, self.cores) * self.interval / self.service_time
+            done = min(depth, capacity)
+            depth -= done
+
+            busy = done * self.service_time / self.interval
+            cpu = busy / self.cores
+
+            # with FIFO, the oldest job has waited about as long as it takes
+            # to get through everything in front of it
+            latency = depth * self.service_time / max(workers, 1)
+
+            sample = Sample(now, int(depth), latency, cpu, busy)
+            workers = self.policy.decide(sample, workers)
+
+            history.append((sample, workers))
+            now += self.interval
+
+        return history
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Start and stop rq workers to match the queue length.")
+    parser.add_argument("queues", nargs="+")
+    parser.add_argument("--redis-url", default="redis://localhost:6379/0")
+    parser.add_argument("--shard-urls", nargs="*", default=[], help="other redis servers jobs are spread over")
+    parser.add_argument("--min", type=int, default=1, dest="min_workers")
+    parser.add_argument("--max", type=int, default=4, dest="max_workers")
+    parser.add_argument("--interval", type=float, default=5.0)
+    parser.add_argument("--cooldown", type=float, default=30.0)
+    parser.add_argument("--simulate", action="store_true", help="run against a simulated load spike instead of real queues")
+    parser.add_argument("--worker-class", help="passed to rq worker -w; e.g. exifcleaner.worker.SandboxWorker to reuse sandbox processes between jobs")
+    parser.add_argument("--queue-class", default="exifcleaner.scheduling.FairQueue", help="passed to rq worker --queue-class")
+
+    args = parser.parse_args(argv)
+
+    # a shard without a worker would never get its jobs done
+    if not args.simulate and args.min_workers < len(shard_list(args.redis_url, args.shard_urls)):
+        parser.error("--min must be at least the number of redis servers")
+
+    policy = ScalingPolicy(min_workers=args.min_workers, max_workers=args.max_workers, cooldown=args.cooldown)
+
+    if args.simulate:
+        # quiet, then a five minute spike, then quiet again
+        spike = lambda t: 20 if 300 <= t < 600 else 1
+        simulation = Simulation(policy, spike, interval=args.interval)
+
+        for sample, workers in simulation.run(1200):
+            print("t={:>6.0f}s depth={:>5} latency={:>7.1f}s cpu={:.2f} workers={}".format(sample.time, sample.depth, sample.latency, sample.cpu, workers))
+    else:
+        command = [os.path.join(os.path.dirname(sys.executable), "rq"), "worker", "--queue-class", args.queue_class]
+        
+        if args.worker_class:
+            command += ["-w", args.worker_class]
+        
+        pool = WorkerPool(args.queues, args.redis_url, command=command, shard_urls=args.shard_urls)
+        Supervisor(policy, pool, args.redis_url, interval=args.interval, shard_urls=args.shard_urls).run()
+
+if __name__ == "__main__":
+    main()
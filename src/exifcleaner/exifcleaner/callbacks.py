@@ -0,0 +1,227 @@
+"""
+Completion callbacks.
+
+Instead of polling /status/<id>, a client can pass a callback url when it
+uploads. When the job finishes (or fails), the result is POSTed there as
+json:
+
+    {"id": "...", "status": "finished", "result": {...}}
+    {"id": "...", "status": "failed", "error": {...}}
+
+Deliveries are jobs on their own queue (<queue_name>-callbacks), so a slow
+or broken client never holds up a cleaning worker. A delivery that fails is
+retried later through rq-scheduler, waiting longer each time, and given up
+on once the backoff list runs out.
+
+    $ rq worker exifcleaner-callbacks
+    $ rqscheduler
+
+Callbacks only go to public addresses: the host is resolved, and urls that
+lead to loopback, link-local, private or otherwise reserved addresses are
+refused, both when the upload comes in and again on delivery (the name
+could point somewhere else by then). On delivery, the addresses that were
+checked are the ones connected to, so the name can't be switched to another
+address in between (DNS rebinding). Redirects aren't followed, and proxies
+from the environment aren't used. Networks that should be reachable anyway
+(a local test server, say) can be listed in allow.
+"""
+
+import datetime
+import functools
+import http.client
+import ipaddress
+import json
+import socket
+import urllib.error
+import urllib.parse
+import urllib.request
+from rq import Queue, get_current_job
+from rq.connections import get_current_connection
+from rq_scheduler import Scheduler
+from . import errors
+
+# seconds to wait before each retry
+BACKOFF = [5, 30, 120, 600]
+
+# seconds to wait for the client to answer
+TIMEOUT = 10
+
+def allowed(address, allow=()):
+    """
+    Return True if callbacks can be sent to address (a string): a public
+    address, or one in the allow networks.
+    """
+    address = ipaddress.ip_address(address.split("%")[0])
+
+    if any(address in ipaddress.ip_network(network) for network in allow):
+        return True
+
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+
+    return address.is_global and not address.is_multicast
+
+def resolve(url, allow=()):
+    """
+    Resolve the host in url. Returns the list of addresses it stands for,
+    or raises ExifCleanerInputError if it isn't an http(s) url, doesn't
+    resolve, or any of its addresses isn't allowed (see allowed).
+    """
+    try:
+        parts = urllib.parse.urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+    except ValueError:
+        raise errors.ExifCleanerInputError("Bad callback url")
+
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise errors.ExifCleanerInputError("Callback must be an http or https url")
+
+    return lookup(parts.hostname, port, allow)
+
+def lookup(host, port, allow=()):
+    """
+    Resolve host. Returns the list of addresses it stands for, or raises
+    ExifCleanerInputError if it doesn't resolve or any of its addresses
+    isn't allowed.
+    """
+    try:
+        addresses = sorted({info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)})
+    except (socket.gaierror, UnicodeError):
+        raise errors.ExifCleanerInputError("Can't resolve callback host {}".format(host))
+
+    for address in addresses:
+        if not allowed(address, allow):
+            raise errors.ExifCleanerInputError("Callback host {} is not a public address".format(host))
+
+    return addresses
+
+def valid(url, allow=()):
+    """
+    Return True if url is something callbacks can be sent to.
+    """
+    try:
+        resolve(url, allow)
+    except errors.ExifCleanerInputError:
+        return False
+
+    return True
+
+def queue_name(base):
+    """
+    Return the name of the delivery queue for a base queue name.
+    """
+    return "{}-callbacks".format(base)
+
+class NoRedirects(urllib.request.HTTPRedirectHandler):
+    """
+    Turns redirects into errors, so a callback can't be bounced to an
+    address resolve wouldn't allow.
+    """
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+class Checked:
+    """
+    Mixin for http.client connections. The host is looked up when the
+    connection is made, and only the addresses lookup allows are connected
+    to; the Host header and the https certificate check still use the name.
+    """
+    def __init__(self, *args, allow=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.allow = allow
+        self._create_connection = self.connect_checked
+
+    def connect_checked(self, address, timeout, source_address=None):
+        host, port = address
+        error = None
+
+        for checked in lookup(host, port, self.allow):
+            try:
+                return socket.create_connection((checked, port), timeout, source_address)
+            except OSError as e:
+                error = e
+
+        raise error
+
+class CheckedHTTPConnection(Checked, http.client.HTTPConnection):
+    pass
+
+class CheckedHTTPSConnection(Checked, http.client.HTTPSConnection):
+    pass
+
+class CheckedHTTPHandler(urllib.request.HTTPHandler):
+    def __init__(self, allow=()):
+        super().__init__()
+        self.allow = allow
+
+    def http_open(self, req):
+        return self.do_open(functools.partial(CheckedHTTPConnection, allow=self.allow), req)
+
+class CheckedHTTPSHandler(urllib.request.HTTPSHandler):
+    def __init__(self, allow=()):
+        super().__init__()
+        self.allow = allow
+
+    def https_open(self, req):
+        return self.do_open(functools.partial(CheckedHTTPSConnection, allow=self.allow), req, context=self._context)
+
+def opener(allow=()):
+    """
+    Return an opener that only connects to allowed addresses, doesn't
+    follow redirects and ignores proxy settings.
+    """
+    return urllib.request.build_opener(urllib.request.ProxyHandler({}), NoRedirects, CheckedHTTPHandler(allow), CheckedHTTPSHandler(allow))
+
+def post(url, payload, timeout=TIMEOUT, allow=()):
+    """
+    POST payload to url as json. Raises urllib.error.URLError (or HTTPError,
+    for responses other than 2xx, redirects included) or OSError if it
+    couldn't be delivered, and ExifCleanerInputError if url isn't allowed
+    (see resolve).
+    """
+    # checks the url before anything is sent; the connection checks the 
+    # addresses it actually uses again
+    resolve(url, allow)
+
+    request = urllib.request.Request(url, data=json.dumps(payload).encode("utf-8"), method="POST")
+    request.add_header("Content-Type", "application/json")
+    request.add_header("User-Agent", "exifcleaner")
+
+    with opener(allow).open(request, timeout=timeout) as response:
+        return response.status
+
+def deliver(url, payload, attempt=1, backoff=BACKOFF, timeout=TIMEOUT, allow=()):
+    """
+    Job to POST payload to url. allow is passed on to post.
+
+    If that fails, another attempt is scheduled on the same queue after
+    backoff[attempt - 1] seconds. Once there are no more, raises
+    ExifCleanerTooManyRetries, so the delivery ends up with the failed jobs.
+    Urls that aren't allowed fail straight away, without retries.
+
+    Returns True if it was delivered, False if a retry was scheduled.
+    """
+    try:
+        post(url, payload, timeout, allow)
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        if attempt > len(backoff):
+            raise errors.ExifCleanerTooManyRetries("Gave up on callback to {} after {} attempts: {}".format(url, attempt, e))
+
+        delay = backoff[attempt - 1]
+
+        print("Callback to {} failed ({}); retrying in {}s".format(url, e, delay))
+
+        scheduler = Scheduler(queue_name=get_current_job().origin, connection=get_current_connection())
+        scheduler.enqueue_in(datetime.timedelta(seconds=delay), deliver, url, payload, attempt + 1, backoff, timeout, allow)
+
+        return False
+
+    return True
+
+def notify(callback, payload, connection):
+    """
+    Queue up a delivery. callback is a dictionary of {'url': ...,
+    'queue': name of the delivery queue, 'allow': networks to allow on top
+    of public addresses (optional)}.
+    """
+    Queue(callback['queue'], connection=connection).enqueue(deliver, callback['url'], payload, allow=tuple(callback.get('allow', ())), result_ttl=0)
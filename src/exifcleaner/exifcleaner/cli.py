@@ -0,0 +1,261 @@
+"""
+Clean images on local disk, without the web service, redis or RQ.
+
+Meant for back catalogues: give it directories (searched recursively),
+single files, or "-" to read a list of paths from stdin, and every image is
+cleaned the same way a job would clean it, with its thumbnail and json next
+to it. The work is spread over a pool of processes, one per available core
+unless --processes says otherwise.
+
+By default images are changed in place. With --output, each image is copied
+into a mirror of its directory tree under that directory first, and the
+originals are left alone. Each directory given is mirrored under its own
+name (so ~/Pictures/2009 goes to ./clean/2009), and files given by name or
+on stdin under their full path; two sources that would end up in the same
+place are refused.
+
+    $ exifcleaner --output ./clean ~/Pictures/2009 ~/Pictures/2010
+    $ find /archive -name "*.jpg" -mtime -7 | exifcleaner -
+"""
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from . import errors
+from .image import ExifImage
+
+EXTENSIONS = (".jpg", ".jpeg")
+
+def cpu_count():
+    """
+    Number of cores this process is allowed to run on.
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def extensions(values):
+    """
+    Turn a list of extensions from the command line ("jpg", ".JPEG") into a
+    tuple for wanted(). Returns EXTENSIONS if values is empty.
+    """
+    if not values:
+        return EXTENSIONS
+
+    return tuple(value.lower() if value.startswith(".") else "." + value.lower() for value in values)
+
+def wanted(name, extensions=EXTENSIONS):
+    """
+    Return True if a file name looks like an image to clean. Thumbnails
+    written by an earlier run are skipped.
+    """
+    base, suffix = os.path.splitext(name)
+
+    return suffix.lower() in extensions and not base.endswith(".thumb") and not name.startswith(".")
+
+def walk(root, extensions=EXTENSIONS):
+    """
+    Generator of (path, path relative to root) for every image under the
+    directory root. Directories are read with os.scandir as they are reached,
+    so work can start before the whole tree has been listed.
+    """
+    pending = [root]
+
+    while pending:
+        directory = pending.pop()
+
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not entry.name.startswith("."):
+                            pending.append(entry.path)
+                    elif entry.is_file() and wanted(entry.name, extensions):
+                        yield entry.path, os.path.relpath(entry.path, root)
+        except OSError as e:
+            print("Skipping {}: {}".format(directory, e), file=sys.stderr)
+
+def discover(sources, extensions=EXTENSIONS, stdin=None):
+    """
+    Generator of (path, relative path) for each of sources, which may be
+    directories, files, or "-" for a list of paths, one per line, on stdin.
+
+    Relative paths are where the image goes under --output: the images in a
+    directory are under the directory's name, and files given by name (used
+    whatever their extension) are under their full path.
+    """
+    for source in sources:
+        if source == "-":
+            for line in (stdin or sys.stdin):
+                path = line.rstrip("\n")
+
+                if path:
+                    yield path, mirrored(path)
+        elif os.path.isdir(source):
+            prefix = root_name(source)
+
+            for path, relative in walk(source, extensions):
+                yield path, os.path.join(prefix, relative)
+        else:
+            yield source, mirrored(source)
+
+def root_name(directory):
+    """
+    Name a directory's images are mirrored under.
+    """
+    return os.path.basename(os.path.normpath(os.path.abspath(directory)))
+
+def mirrored(path):
+    """
+    Relative path a file given by name is mirrored to: its full path.
+    """
+    return os.path.abspath(path).lstrip(os.sep)
+
+def check_sources(sources):
+    """
+    Raise ExifCleanerConfigError if two of the directories in sources would
+    be mirrored under the same name.
+    """
+    seen = {}
+
+    for source in sources:
+        if source != "-" and os.path.isdir(source):
+            name = root_name(source)
+
+            if name in seen:
+                raise errors.ExifCleanerConfigError("{} and {} would both be mirrored to {}".format(seen[name], source, name))
+
+            seen[name] = source
+
+def unique(found, clashes):
+    """
+    Generator passing on the (path, relative path) tuples from found, except
+    ones whose relative path was already taken by an earlier file; those are
+    added to the list clashes instead, so nothing is cleaned on top of
+    another file's results.
+    """
+    taken = {}
+
+    for path, relative in found:
+        key = os.path.normcase(os.path.normpath(relative))
+
+        if key in taken:
+            clashes.append((path, "would be written over the results for {}".format(taken[key])))
+            continue
+
+        taken[key] = path
+
+        yield path, relative
+
+def strip(path):
+    """
+    Clean the image at path, writing its thumbnail and json next to it.
+
+    Each image is small work for a single process, so the stages run one
+    after another rather than through a pipeline.Pipeline, which would start
+    a thread pool per file.
+    """
+    exif = ExifImage(path)
+    exif.read()
+    exif.thumb()
+    exif.dump()
+    exif.clean()
+
+def clean_one(task):
+    """
+    Pool function. task is (path, relative path, output directory or None).
+
+    Returns a tuple of (path, bytes processed, error message or None), path
+    being the original, even when a copy under output is what was cleaned.
+    """
+    path, relative, output = task
+
+    try:
+        target = path
+
+        if output:
+            target = os.path.join(output, relative)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(path, target)
+
+        size = os.path.getsize(target)
+
+        strip(target)
+    except Exception as e:
+        return path, 0, "{}: {}".format(type(e).__name__, e)
+
+    return path, size, None
+
+def run(sources, output=None, processes=None, extensions=EXTENSIONS, chunksize=8, stdin=None, verbose=False):
+    """
+    Clean every image found in sources (see discover) using a pool of
+    processes.
+
+    With output, raises ExifCleanerConfigError if two directories would be
+    mirrored to the same place (see check_sources), and files whose results
+    would land on another file's are not cleaned, but counted as failed.
+
+    Returns a dictionary of {'files', 'failed', 'bytes', 'seconds'}.
+    """
+    found = discover(sources, extensions, stdin)
+    clashes = []
+
+    if output:
+        check_sources(sources)
+        found = unique(found, clashes)
+
+    tasks = ((path, relative, output) for path, relative in found)
+
+    stats = {'files': 0, 'failed': 0, 'bytes': 0}
+    start = time.perf_counter()
+
+    with multiprocessing.Pool(processes or cpu_count()) as pool:
+        for path, size, error in pool.imap_unordered(clean_one, tasks, chunksize):
+            if error:
+                stats['failed'] += 1
+                print("Failed {}: {}".format(path, error), file=sys.stderr)
+                continue
+
+            stats['files'] += 1
+            stats['bytes'] += size
+
+            if verbose:
+                print(path)
+
+    for path, error in clashes:
+        stats['failed'] += 1
+        print("Failed {}: {}".format(path, error), file=sys.stderr)
+
+    stats['seconds'] = time.perf_counter() - start
+
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Remove the exif data from images on disk.")
+    parser.add_argument("sources", nargs="+", help="directories, files, or - to read paths from stdin")
+    parser.add_argument("--output", "-o", help="write cleaned copies into a mirror tree under this directory, instead of changing the images in place; each directory goes under its own name, and each file under its full path")
+    parser.add_argument("--processes", "-j", type=int, default=None, help="number of worker processes (default: one per available core)")
+    parser.add_argument("--ext", action="append", default=None, help="file extension to look for in directories, may be repeated (default: .jpg, .jpeg)")
+    parser.add_argument("--verbose", "-v", action="store_true", help="print each file as it is cleaned")
+
+    args = parser.parse_args(argv)
+
+    try:
+        stats = run(args.sources, args.output, args.processes, extensions(args.ext), verbose=args.verbose)
+    except errors.ExifCleanerConfigError as e:
+        parser.error(str(e))
+
+    seconds = max(stats['seconds'], 1e-6)
+
+    print("Cleaned {} files ({:.1f} MB) in {:.2f}s: {:.1f} files/s, {:.1f} MB/s, {} failed".format(
+        stats['files'], stats['bytes'] / 1048576, stats['seconds'],
+        stats['files'] / seconds, stats['bytes'] / 1048576 / seconds, stats['failed']))
+
+    return 1 if stats['failed'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
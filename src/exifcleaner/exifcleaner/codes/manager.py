@@ -154,9 +154,9 @@ class CodeManager(BaseManager):
         """
         Remove an existing code.
         """
-        key = Code.prefix(code)
+        key = Code.prefix(id)
         
-        if not self.exists(code):
+        if not self.redis.exists(key):
             raise errors.CodeNotFound()
         
         with self.redis.pipeline() as pipe:
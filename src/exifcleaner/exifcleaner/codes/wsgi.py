@@ -3,8 +3,13 @@ WSGI Applications providing a REST(ish) API to the CodeManager.
 """
 
 from .. import common
+from .. import util
+from ..common import wsgi
+from ..user.errors import UserNotFound
 from . import manager
 from . import errors
+from webob import Response
+import re
 
 class CodeService(common.wsgi.BaseService):
     """
@@ -32,25 +37,40 @@ class CodeService(common.wsgi.BaseService):
             }
         }
         
+    def handle(self, request, method, params, environ, start_response):
+        """
+        Run the callable a request was routed to, and answer with its response.
+        """
+        try:
+            response = method(request, **params)
+            return response(environ, start_response)
+        except errors.CodeNotFound:
+            r = util.web.NotFound()
+            return r(environ, start_response)
+        except util.web.BadRequest as r:
+            return r(environ, start_response)
+        
     def use(self, request, id):
         user = self.authorize(request, activated=False)
         
         try:
-            self.manager.use(code, user.username)
+            self.codes.use(id, user.username)
             response = Response()
             response.json_body = True
             return response
         except UserNotFound:
             raise util.web.JSONError(1102)
-        except manager.errors.UserMismatch:
+        except errors.UserMismatch:
             raise util.web.JSONError(1101)
+        except errors.CodeAlreadyUsed:
+            raise util.web.JSONError(1103)
         
     def listing(self, request):
         self.authorize(request, admin=True)
         
-        nav = util.pagination.nav(request, self.manager.count())
+        nav = util.pagination.nav(request, self.codes.count())
         
-        data = self.manager.codes(start=nav['start'], stop=nav['end'])
+        data = self.codes.codes(start=nav['start'], stop=nav['end'])
         
         del nav['start']
         del nav['end']
@@ -60,7 +80,7 @@ class CodeService(common.wsgi.BaseService):
         base_url = util.web.request_uri(request.environ)
         
         output = {
-            'activations': [],
+            'codes': [],
             'pagination': nav
         }
         
@@ -83,7 +103,7 @@ class CodeService(common.wsgi.BaseService):
             raise util.web.JSONError(1001)
         
         try:
-            code = self.manager.new(username)
+            code = self.codes.new(username)
         except UserNotFound:
             raise util.web.JSONError(1002)
         
@@ -95,7 +115,7 @@ class CodeService(common.wsgi.BaseService):
     def delete(self, request, id):
         user = self.authorize(request, admin=True)
         
-        self.manager.delete(id)
+        self.codes.delete(id)
         
         response = Response()
         
@@ -108,7 +128,7 @@ class CodeService(common.wsgi.BaseService):
         
         response = Response()
         
-        code = self.manager.get(id)
+        code = self.codes.get(id)
         
         response.json_body = code.to_json()
         
@@ -0,0 +1,90 @@
+"""
+Microbenchmark for request routing: times looking up a few typical requests
+in the tree the services in the root wsgi.py are compiled into (see
+common.dispatch), against trying every path_map expression in turn the way
+the services used to. Handlers aren't called, so redis needn't be running.
+
+    $ python -m exifcleaner.common.benchmark --data-dir ./tmp
+"""
+
+import argparse
+import re
+import time
+from .dispatch import Dispatcher
+
+def linear(services, path, method):
+    """
+    Route a request by trying every expression of every service in turn, the
+    way the services used to. Only used to compare with the tree.
+    """
+    for service in services:
+        for regexp, methods in service.path_map.items():
+            match = re.match(regexp, path)
+
+            if match:
+                for http_method, handler in methods.items():
+                    if http_method == method:
+                        return handler, match.groupdict()
+
+                return None
+
+    return None
+
+def main(argv=None):
+    from ..wsgi import ExifCleanerService
+    from ..activation.wsgi import ActivationService
+    from ..admin.wsgi import AdminService
+    from ..codes.wsgi import CodeService
+    from ..user.wsgi import UserService
+
+    parser = argparse.ArgumentParser(description="Time routing requests through the compiled tree against trying each path expression in turn.")
+    parser.add_argument("--data-dir", default="./tmp", help="data directory for the cleaning service (default: ./tmp)")
+    parser.add_argument("--number", "-n", type=int, default=100000, help="number of times to route each path")
+
+    args = parser.parse_args(argv)
+
+    services = [
+        ExifCleanerService(data_dir=args.data_dir),
+        ActivationService(),
+        CodeService(),
+        UserService(),
+        AdminService()
+    ]
+
+    tree = Dispatcher(services).tree
+
+    requests = [
+        ("POST", "/clean"),
+        ("GET", "/status/Kq3vR8xY"),
+        ("GET", "/events/Kq3vR8xY"),
+        ("PUT", "/cancel"),
+        ("GET", "/activate/Kq3vR8xY"),
+        ("POST", "/users/"),
+        ("GET", "/admin/tenants"),
+        ("GET", "/data/1500000000/Kq3vR8xY.jpg")
+    ]
+
+    print("{:<36} {:>12} {:>12}".format("request", "tree (us)", "linear (us)"))
+
+    for method, path in requests:
+        start = time.perf_counter()
+
+        for _ in range(args.number):
+            methods, params, app = tree.lookup(path)
+
+            if methods is not None:
+                methods.get(method)
+
+        compiled = time.perf_counter() - start
+
+        start = time.perf_counter()
+
+        for _ in range(args.number):
+            linear(services, path, method)
+
+        scanned = time.perf_counter() - start
+
+        print("{:<36} {:>12.3f} {:>12.3f}".format("{} {}".format(method, path), compiled / args.number * 1e6, scanned / args.number * 1e6))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""
+Request routing shared by the WSGI services.
+
+Each service describes its urls with a path_map (see common.wsgi.BaseService):
+regular expressions matched against the path, each with a dictionary of HTTP
+method -> callable. Rather than trying every expression in turn on every
+request, a Dispatcher compiles the path maps of one or more services into a
+tree of path segments when it is built, with a method table at each node that
+ends a route. A request is then routed with one dictionary lookup per segment
+of its path, plus one for its method.
+
+Only a small part of the regular expression syntax is understood by the tree,
+which covers every path map in this package:
+
+    /activations/?$               literal segments, optional trailing slash
+    /activation/(?P<code>[^/]+)$  a whole segment as a keyword argument
+
+Anything else is still matched with re.match, in the order given, when
+nothing in the tree matches.
+
+Several services can be mounted under one app, with plain WSGI apps for
+whole subtrees and a default app for everything else:
+
+    app = Dispatcher([cleaner, activation, codes, users, admin],
+                     mounts={"/data/": data}, default=static)
+
+Services are asked to run their callables through their handle() method, so
+each keeps its own error handling.
+
+common.benchmark times the tree against trying each expression in turn.
+"""
+
+import re
+from webob import Request
+from .. import errors
+from .. import util
+
+LITERAL = re.compile(r"^[\w~-]+$")
+SEGMENT = re.compile(r"/(?:\(\?P<(\w+)>\[\^/\]\+\)|([^/]*))")
+
+class _Node:
+    """
+    One path segment in a PathTree.
+    """
+    __slots__ = ('literals', 'parameter', 'methods', 'mount')
+
+    def __init__(self):
+        # segment -> _Node
+        self.literals = {}
+        # (keyword name, _Node) for a segment taken as an argument
+        self.parameter = None
+        # HTTP method -> (service, callable), if a route ends here
+        self.methods = None
+        # WSGI app for everything below this node
+        self.mount = None
+
+def segments(pattern):
+    """
+    Split a path_map expression into a list of segments for a PathTree, and
+    whether a trailing slash is allowed. Each segment is either a string to
+    match exactly or a 1-tuple holding the name of a keyword argument.
+
+    Returns None if the expression uses anything else.
+    """
+    pattern = getattr(pattern, "pattern", pattern)
+
+    if pattern.startswith("^"):
+        pattern = pattern[1:]
+
+    if not pattern.startswith("/") or not pattern.endswith("$"):
+        return None
+
+    pattern = pattern[:-1]
+    slash = pattern.endswith("/?")
+
+    if slash:
+        pattern = pattern[:-2]
+
+    parts = []
+    position = 0
+
+    while position < len(pattern):
+        segment = SEGMENT.match(pattern, position)
+
+        if segment is None:
+            return None
+
+        name, literal = segment.groups()
+
+        if name:
+            parts.append((name,))
+        elif LITERAL.match(literal):
+            parts.append(literal)
+        else:
+            return None
+
+        position = segment.end()
+
+    return parts, slash
+
+class PathTree:
+    """
+    Prefix tree of path segments, built from path maps.
+    """
+    def __init__(self):
+        self.root = _Node()
+        # (regular expression, method table) for the routes the tree can't hold
+        self.fallback = []
+
+    def _node(self, parts):
+        """
+        Internal method. Return the node for a list of segments, adding
+        nodes as needed.
+        """
+        node = self.root
+
+        for part in parts:
+            if isinstance(part, tuple):
+                if node.parameter is None:
+                    node.parameter = (part[0], _Node())
+                elif node.parameter[0] != part[0]:
+                    raise errors.ExifCleanerConfigError("Routes disagree on the name of a path segment: {} and {}".format(node.parameter[0], part[0]))
+
+                node = node.parameter[1]
+            else:
+                node = node.literals.setdefault(part, _Node())
+
+        return node
+
+    @staticmethod
+    def _merge(node, pattern, methods):
+        """
+        Internal method. Add a method table to a node. A method can only be
+        routed to one callable for each path.
+        """
+        if node.methods is None:
+            node.methods = {}
+
+        for method in methods:
+            if method in node.methods:
+                raise errors.ExifCleanerConfigError("{} {} is routed twice".format(method, getattr(pattern, "pattern", pattern)))
+
+        node.methods.update(methods)
+
+    def add(self, pattern, methods, service):
+        """
+        Route the paths matching the expression pattern to service, for the
+        methods in methods, a dictionary of HTTP method -> callable.
+        """
+        methods = dict((method, (service, handler)) for method, handler in methods.items())
+        compiled = segments(pattern)
+
+        if compiled is None:
+            self.fallback.append((re.compile(pattern), methods))
+            return
+
+        parts, slash = compiled
+        node = self._node(parts)
+        self._merge(node, pattern, methods)
+
+        if slash:
+            self._merge(self._node(parts + [""]), pattern, methods)
+
+    def add_service(self, service):
+        """
+        Route everything in a service's path_map to it.
+        """
+        for pattern, methods in service.path_map.items():
+            self.add(pattern, methods, service)
+
+    def mount(self, prefix, app):
+        """
+        Send every path starting with prefix ("/data/", say) that no route
+        matches to the WSGI app app.
+        """
+        if not prefix.startswith("/") or not prefix.endswith("/") or prefix == "/":
+            raise errors.ExifCleanerConfigError("Mount points must start and end with /: {}".format(prefix))
+
+        self._node(prefix[1:-1].split("/")).mount = app
+
+    def _find(self, node, parts, index, params):
+        """
+        Internal method. Return the node at the end of the route matching
+        parts[index:] below node, filling in params. Literal segments are
+        tried before keyword arguments.
+        """
+        if index == len(parts):
+            return node if node.methods is not None else None
+
+        part = parts[index]
+        child = node.literals.get(part)
+
+        if child is not None:
+            found = self._find(child, parts, index + 1, params)
+
+            if found is not None:
+                return found
+
+        if node.parameter is not None and part:
+            name, child = node.parameter
+            found = self._find(child, parts, index + 1, params)
+
+            if found is not None:
+                params[name] = part
+                return found
+
+        return None
+
+    def _mounted(self, parts):
+        """
+        Internal method. Return the app mounted deepest above parts, or None.
+        """
+        node = self.root
+        app = None
+
+        for part in parts[:-1]:
+            node = node.literals.get(part)
+
+            if node is None:
+                break
+
+            if node.mount is not None:
+                app = node.mount
+
+        return app
+
+    def lookup(self, path):
+        """
+        Find the route for path.
+
+        Returns a tuple of (method table, keyword arguments, None) if a route
+        matches, or else (None, None, app) with the app mounted over path, if
+        there is one.
+        """
+        parts = path[1:].split("/")
+        params = {}
+        node = self._find(self.root, parts, 0, params)
+
+        if node is not None:
+            return node.methods, params, None
+
+        for regexp, methods in self.fallback:
+            match = regexp.match(path)
+
+            if match:
+                return methods, match.groupdict(), None
+
+        return None, None, self._mounted(parts)
+
+class Dispatcher:
+    """
+    WSGI app routing requests to the services it was built with.
+
+    services - list of services, each with a path_map and a
+               handle(request, method, params, environ, start_response)
+               method.
+    mounts - dictionary of path prefix -> WSGI app, for paths below the
+             prefix that none of the services want.
+    default - WSGI app for every other path. None to answer 404.
+    """
+    def __init__(self, services=(), mounts=None, default=None):
+        self.tree = PathTree()
+        self.default = default
+
+        for service in services:
+            self.tree.add_service(service)
+
+        for prefix, app in (mounts or {}).items():
+            self.tree.mount(prefix, app)
+
+    def __call__(self, environ, start_response):
+        methods, params, app = self.tree.lookup(environ.get('PATH_INFO') or "/")
+
+        if methods is None:
+            app = app or self.default
+
+            if app is None:
+                return util.web.NotFound()(environ, start_response)
+
+            return app(environ, start_response)
+
+        method = environ['REQUEST_METHOD']
+        target = methods.get(method)
+
+        if target is None and method == "HEAD":
+            # webob leaves the body out of responses to HEAD
+            target = methods.get("GET")
+
+        if target is None:
+            return util.web.BadRequest("Method not supported", code=405)(environ, start_response)
+
+        service, handler = target
+
+        return service.handle(Request(environ), handler, params, environ, start_response)
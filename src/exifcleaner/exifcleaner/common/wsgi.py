@@ -1,5 +1,9 @@
 from exifcleaner import util
 from exifcleaner.user.manager import UserManager
+from exifcleaner.user.errors import UserNotFound
+from webob import Request, Response
+from .dispatch import Dispatcher
+import base64
 
 class BaseService:
     """
@@ -17,38 +21,33 @@ class BaseService:
     Callables take a Request object, and any keyword data extracted
     from the request URI. They are expected to return a Response 
     object, or raise a BadRequest exception.
+    
+    The path_map is compiled into a tree of path segments on the first
+    request (see common.dispatch), which only understands simple expressions;
+    anything else is still matched with re.match.
     """
     def __init__(self, redis_url="redis://127.0.0.1:6379"):
         self.redis_url = redis_url
         self.users = UserManager(redis_url=redis_url)
         self.path_map = {}
+        self.dispatcher = None
         
         
     def __call__(self, environ, start_response):
-        request = Request(environ)
+        # path_map is filled in by derived classes, so it is compiled on the
+        # first request rather than in __init__
+        if self.dispatcher is None:
+            self.dispatcher = Dispatcher([self])
         
-        response = None
+        return self.dispatcher(environ, start_response)
         
+    def handle(self, request, method, params, environ, start_response):
+        """
+        Run the callable a request was routed to, and answer with its response.
+        """
         try:
-            for regexp, method_mapping in self.path_map.items():
-                match = re.match(regexp, request.path)
-                
-                if match:
-                    for http_method, method in method_mapping.items():
-                        if http_method == request.method:
-                            response = method(request, **match.groupdict())
-                            return response(environ, start_response)
-                    else:
-                        if request.method not in ["GET", "HEAD"]:
-                            raise util.web.BadRequest("Method not supported", code=405)
-                        else:
-                            raise util.web.BadRequest()
-            else:
-                raise util.web.NotFound()
-            
-        except manager.errors.ActivationNotFound:
-            r = util.web.NotFound()
-            return r(environ, start_response)
+            response = method(request, **params)
+            return response(environ, start_response)
         except util.web.BadRequest as r:
             return r(environ, start_response)
         
@@ -28,12 +28,29 @@ class ExifCleanerInputError(ExifCleanerError):
     Generic class for any input errors
     """
     
+class ExifCleanerSandboxError(ExifCleanerError):
+    """
+    Raised when work in a sandbox process fails in a way that can't be 
+    reported as an ordinary exception (e.g. the process died).
+    """
+    
+class ExifCleanerLimitExceeded(ExifCleanerSandboxError):
+    """
+    Raised when work in a sandbox process goes over a resource limit.
+    
+    limit - string, "memory" or "cpu".
+    """
+    def __init__(self, limit, msg=None):
+        self.limit = limit
+        ExifCleanerSandboxError.__init__(self, msg or "Went over the {} limit".format(limit))
+    
 # Mapping of error codes to example human-readable strings
 codes = {
     1001: "Adding activation: Username must be provided",
     1002: "Adding activation: User not found",
     1101: "Activating: User mismatch",
     1102: "Activating: User not found",
+    1103: "Activating: Code already used",
     1201: "Bad page number",
     1202: "Bad per-page value"
 }
@@ -0,0 +1,158 @@
+"""
+Job status notifications over redis pub/sub.
+
+Workers publish a small message on the exif:events channel whenever a job
+starts, finishes or fails (see jobs.process), always on the main redis
+server, even when jobs are sharded. Each web process keeps one subscriber
+connection, on a background thread, and hands the messages out to the
+requests waiting on those ids: long-polls of /status/<id>?wait=<seconds>,
+and server-sent event streams from /events/<id>.
+
+Messages are json:
+
+    {"id": "...", "status": "finished"}
+
+They only say that something changed; the waiting request looks the status
+up again, so a message that arrives late or twice does no harm.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+
+CHANNEL = "exif:events"
+
+def publish(connection, id_, status):
+    """
+    Tell anyone waiting on id_ that its job is now in the given status.
+    """
+    connection.publish(CHANNEL, json.dumps({'id': id_, 'status': status}))
+
+class EventHub:
+    """
+    Fans messages from a single pub/sub connection out to every request in
+    this process that is waiting for them.
+
+    redis - a StrictRedis connection to the main server. The subscriber
+            connection is made from its connection pool.
+    retry - number, seconds to wait before subscribing again if the
+            connection to redis is lost.
+    """
+    def __init__(self, redis, retry=1.0):
+        self.redis = redis
+        self.retry = retry
+
+        self._lock = threading.Lock()
+        self._waiting = {}
+        self._thread = None
+        self._pid = None
+        self._ready = threading.Event()
+
+    def _listen(self):
+        """
+        Internal method. Runs on the background thread, forever.
+        """
+        while True:
+            try:
+                pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CHANNEL)
+                self._ready.set()
+
+                for message in pubsub.listen():
+                    self._dispatch(message['data'])
+            except Exception as e:
+                print("Lost the event subscription ({}); subscribing again".format(e))
+
+                # anything could have happened in the meantime
+                self._wake_all()
+
+                time.sleep(self.retry)
+
+    def _dispatch(self, data):
+        """
+        Internal method. Hand one message to whoever is waiting on its id.
+        """
+        try:
+            event = json.loads(data)
+            id_ = event['id']
+        except (ValueError, TypeError, KeyError):
+            return
+
+        with self._lock:
+            waiting = list(self._waiting.get(id_, ()))
+
+        for inbox in waiting:
+            inbox.put(event)
+
+    def _wake_all(self):
+        """
+        Internal method. Wake every waiting request, so they look for
+        themselves.
+        """
+        with self._lock:
+            waiting = [(id_, inbox) for id_, inboxes in self._waiting.items() for inbox in inboxes]
+
+        for id_, inbox in waiting:
+            inbox.put({'id': id_, 'status': None})
+
+    def _start(self):
+        """
+        Internal method. Start the subscriber thread, if this process doesn't
+        have one yet. Web servers that fork after the app is loaded need one
+        in each child, so the thread is only started when first needed.
+        """
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+
+            self._ready = threading.Event()
+            self._thread = threading.Thread(target=self._listen, name="exifcleaner-events")
+            self._thread.daemon = True
+            self._thread.start()
+            self._pid = os.getpid()
+
+        # messages published before the subscription is made are lost, so
+        # give it a moment
+        self._ready.wait(self.retry)
+
+    def subscribe(self, id_):
+        """
+        Start collecting messages for id_. Returns a queue.Queue the messages
+        are put on; pass it to unsubscribe() when done.
+
+        Subscribe before looking at the job's status, so a change that
+        happens in between isn't missed.
+        """
+        self._start()
+
+        inbox = queue.Queue()
+
+        with self._lock:
+            self._waiting.setdefault(id_, []).append(inbox)
+
+        return inbox
+
+    def unsubscribe(self, id_, inbox):
+        with self._lock:
+            inboxes = self._waiting.get(id_, [])
+
+            if inbox in inboxes:
+                inboxes.remove(inbox)
+
+            if not inboxes:
+                self._waiting.pop(id_, None)
+
+    def wait(self, inbox, timeout):
+        """
+        Return the next message from inbox, or None if there wasn't one
+        within timeout seconds.
+        """
+        try:
+            return inbox.get(timeout=max(0, timeout))
+        except queue.Empty:
+            return None
@@ -0,0 +1,179 @@
+"""
+Time-bucketed expiry of uploaded images.
+
+Instead of scheduling one cleanup job per image, ids are dropped into coarse
+buckets (one redis SET per bucket_size seconds), and the buckets themselves
+are indexed in a sorted set scored by the time the bucket expires. A single
+sweeper process periodically removes everything in the buckets that are due.
+
+Run the sweeper with:
+
+    $ python -m exifcleaner.expiry --data-dir ./tmp
+"""
+
+import argparse
+import math
+import time
+import redis
+from . import storage
+from . import results
+from .space import SpaceManager
+
+class ExpiryIndex:
+    """
+    Tracks which ids expire when.
+
+    redis - a StrictRedis connection.
+    bucket_size - integer, number of seconds covered by each bucket.
+    """
+    index = "exif:expiry"
+
+    def __init__(self, redis, bucket_size=60):
+        self.redis = redis
+        self.bucket_size = bucket_size
+
+    def bucket_for(self, when):
+        """
+        Return the bucket for the given unix timestamp. Buckets are named after
+        the time they end, so nothing is removed before its time is up.
+        """
+        return int(math.ceil(when / self.bucket_size) * self.bucket_size)
+
+    def key(self, bucket):
+        return "{}:{}".format(self.index, bucket)
+
+    def add(self, id_, when, pipe=None):
+        """
+        Mark id_ for removal at unix timestamp `when`.
+
+        Pass in a pipeline to batch this with other commands; it will not be
+        executed here.
+        """
+        bucket = self.bucket_for(when)
+        key = self.key(bucket)
+
+        if pipe is None:
+            with self.redis.pipeline() as pipe:
+                self.add(id_, when, pipe=pipe)
+                pipe.execute()
+        else:
+            pipe.sadd(key, id_)
+            # keep the bucket around a little longer than it is needed, so
+            # a stopped sweeper doesn't leak keys forever.
+            pipe.expireat(key, bucket + (self.bucket_size * 60))
+            # raw ZADD; the argument order of zadd() differs between
+            # redis-py releases.
+            pipe.execute_command("ZADD", self.index, bucket, bucket)
+
+        return bucket
+
+    def remove(self, id_, when):
+        """
+        Stop id_ from being removed at unix timestamp `when`, e.g. because its
+        files have already been removed. `when` must be the time it was
+        added with.
+        """
+        self.redis.srem(self.key(self.bucket_for(when)), id_)
+
+    def due(self, now=None):
+        """
+        Return a list of buckets that have expired, oldest first.
+        """
+        if now is None:
+            now = time.time()
+
+        return [int(b) for b in self.redis.zrangebyscore(self.index, 0, now)]
+
+    def members(self, bucket):
+        """
+        Return the ids in the given bucket.
+        """
+        output = []
+
+        for id_ in self.redis.smembers(self.key(bucket)):
+            if isinstance(id_, bytes):
+                id_ = id_.decode("utf-8")
+            output.append(id_)
+
+        return output
+
+    def sweep(self, remove, now=None, keys=None):
+        """
+        Call remove(bucket, ids) for every expired bucket, then drop the bucket
+        from redis.
+
+        keys - optional callable, takes a list of ids and returns any other
+               redis keys to delete along with the bucket.
+
+        Returns the number of ids removed.
+        """
+        count = 0
+
+        for bucket in self.due(now):
+            ids = self.members(bucket)
+
+            remove(bucket, ids)
+
+            with self.redis.pipeline() as pipe:
+                pipe.delete(self.key(bucket))
+                if keys is not None:
+                    for key in keys(ids):
+                        pipe.delete(key)
+                pipe.zrem(self.index, str(bucket))
+                pipe.execute()
+
+            count += len(ids)
+
+        return count
+
+def sweeper(data_dir, redis_url="redis://localhost:6379/0", interval=30, bucket_size=60, layout="windowed", window=600, fallback=False, queues=(), ttl=600, compact_every=300, shard_urls=()):
+    """
+    Run forever, removing expired images every `interval` seconds.
+    
+    Every `compact_every` seconds, RQ's job records for the given queues that
+    are older than `ttl` are removed too (see results.compact), from redis_url
+    and any other redis servers jobs are spread over (shard_urls).
+    """
+    conn = redis.StrictRedis.from_url(redis_url)
+    job_servers = [conn] + [redis.StrictRedis.from_url(url) for url in shard_urls if url != redis_url]
+    index = ExpiryIndex(conn, bucket_size=bucket_size)
+    files = storage.make_layout(layout, data_dir, conn, window=window, fallback=fallback)
+    space = SpaceManager(conn)
+
+    def remove(bucket, ids):
+        print("Sweeping bucket {} ({} ids)".format(bucket, len(ids)))
+        files.expire(bucket, ids)
+        space.forget(ids)
+
+    compacted = 0
+    
+    while True:
+        index.sweep(remove, keys=files.keys)
+        
+        if queues and time.time() - compacted >= compact_every:
+            for server in job_servers:
+                print("Removed {} old job records".format(results.compact(server, queues, ttl)))
+            compacted = time.time()
+        
+        time.sleep(interval)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Remove expired images.")
+    parser.add_argument("--data-dir", default="./tmp")
+    parser.add_argument("--redis-url", default="redis://localhost:6379/0")
+    parser.add_argument("--interval", type=int, default=30)
+    parser.add_argument("--bucket-size", type=int, default=60)
+    parser.add_argument("--layout", choices=["flat", "windowed", "sharded"], default="windowed")
+    parser.add_argument("--window", type=int, default=600)
+    parser.add_argument("--fallback", action="store_true", help="sharded layout: also remove files left in the flat layout")
+    parser.add_argument("--queues", nargs="*", default=["exifcleaner-fast", "exifcleaner-bulk"], help="queues whose old job records are removed")
+    parser.add_argument("--ttl", type=int, default=600, help="age in seconds of job records to remove")
+    parser.add_argument("--compact-every", type=int, default=300)
+    parser.add_argument("--shard-urls", nargs="*", default=[], help="other redis servers jobs are spread over")
+
+    args = parser.parse_args(argv)
+
+    sweeper(args.data_dir, args.redis_url, args.interval, args.bucket_size, args.layout, args.window, args.fallback, args.queues, args.ttl, args.compact_every, args.shard_urls)
+
+if __name__ == "__main__":
+    main()
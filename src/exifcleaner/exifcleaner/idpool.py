@@ -0,0 +1,128 @@
+"""
+Pool of image ids reserved ahead of time.
+
+Every upload needs a fresh id, reserved in redis so it is never handed out
+twice. Reserving one takes a round trip (SET NX EX), and another for each
+collision. With a pool, a separate filler process reserves ids in batches and
+keeps them in a redis list, and /clean takes one with a single LPOP. If the
+pool runs dry (the filler is down, say), the service goes back to reserving
+ids one at a time.
+
+Ids are reserved when they go into the pool, for the same id_lifespan as
+ExifCleanerService uses, so an id waiting in the pool can't be minted again.
+
+Run the filler with:
+
+    $ python -m exifcleaner.idpool
+"""
+
+import argparse
+import time
+import redis
+import englids
+
+KEY = "exif:ids"
+# one year, like ExifCleanerService's id_lifespan
+LIFESPAN = 31536000
+
+def reservation_key(id_):
+    """
+    Key marking id_ as used.
+    """
+    return "exif:{}".format(id_)
+
+def reserve(connection, id_, lifespan=LIFESPAN):
+    """
+    Reserve id_ for lifespan seconds. Returns True if it was free, in a
+    single round trip.
+    """
+    return bool(connection.set(reservation_key(id_), 1, nx=True, ex=lifespan))
+
+class IdPool:
+    """
+    redis - a StrictRedis connection to the main server.
+    generator - callable returning a new random id.
+    size - integer, number of ids to keep in the pool.
+    lifespan - integer, seconds ids stay reserved.
+    key - name of the redis list holding the pool.
+    """
+    def __init__(self, redis, generator=None, size=1000, lifespan=LIFESPAN, key=KEY):
+        self.redis = redis
+        self.generator = generator or englids.Englids()
+        self.size = size
+        self.lifespan = lifespan
+        self.key = key
+
+    def take(self):
+        """
+        Return an id from the pool, already reserved, or None if the pool is
+        empty.
+        """
+        id_ = self.redis.lpop(self.key)
+
+        return id_.decode('utf-8') if id_ is not None else None
+
+    def __len__(self):
+        return self.redis.llen(self.key)
+
+    def fill(self, batch=100):
+        """
+        Reserve ids until the pool holds size of them, batch at a time (one
+        round trip to reserve each batch, one to add it to the pool).
+
+        Returns the number of ids added.
+        """
+        added = 0
+        wanted = self.size - len(self)
+
+        while wanted > 0:
+            ids = [self.generator() for _ in range(min(batch, wanted))]
+
+            with self.redis.pipeline(transaction=False) as pipe:
+                for id_ in ids:
+                    pipe.set(reservation_key(id_), 1, nx=True, ex=self.lifespan)
+
+                reserved = [id_ for id_, ok in zip(ids, pipe.execute()) if ok]
+
+            if reserved:
+                self.redis.rpush(self.key, *reserved)
+
+            added += len(reserved)
+            wanted -= len(reserved)
+
+            if not reserved:
+                # every id in the batch was taken; the generator has run out
+                break
+
+        return added
+
+def filler(redis_url, size=1000, interval=1.0, lifespan=LIFESPAN, key=KEY):
+    """
+    Keep the pool topped up, forever.
+    """
+    pool = IdPool(redis.StrictRedis.from_url(redis_url), size=size, lifespan=lifespan, key=key)
+
+    while True:
+        try:
+            added = pool.fill()
+
+            if added:
+                print("Added {} ids to the pool".format(added))
+        except redis.exceptions.ConnectionError as e:
+            print("Can't reach redis ({}); trying again".format(e))
+
+        time.sleep(interval)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep a pool of reserved image ids topped up.")
+    parser.add_argument("--redis-url", default="redis://localhost:6379/0")
+    parser.add_argument("--size", type=int, default=1000, help="number of ids to keep in the pool")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between top ups")
+    parser.add_argument("--lifespan", type=int, default=LIFESPAN, help="seconds ids stay reserved; should match the service's id_lifespan")
+
+    args = parser.parse_args(argv)
+
+    filler(args.redis_url, args.size, args.interval, args.lifespan)
+
+if __name__ == "__main__":
+    main()
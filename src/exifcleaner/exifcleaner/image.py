@@ -7,6 +7,7 @@ import piexif
 import tempfile
 import shutil
 import os
+import hashlib
 from . import errors
 from . import util
 
@@ -15,8 +16,9 @@ class ExifImage:
     Wrapper for some common exif tag manipulations
     """
     
-    def __init__(self, path):
+    def __init__(self, path, digest=None):
         self.path = path
+        self.digest = digest
         self._exif = {}
         
     @property
@@ -37,7 +39,7 @@ class ExifImage:
         Create a JSON file containing the exif data (minus the thumbnail)
         """
         exif = self.exif.copy()
-        del exif['thumbnail']
+        exif.pop('thumbnail', None)
         
         path = self._json_path()
         
@@ -95,7 +97,8 @@ class ExifImage:
         Extract the thumbnail from the exif data. Returns False if there is none,
         the new path name if successfully extracted.
         """
-        if "thumbnail" in self.exif:
+        # piexif always has a "thumbnail" key, None when there isn't one
+        if self.exif.get("thumbnail"):
             with open(self._thumb_path(), "wb") as fp:
                 fp.write(self.exif['thumbnail'])
                 
@@ -131,18 +134,20 @@ class ExifImage:
         """
         Remove the exif tags from the image, but preserve
         the original orientation flag.
+        
+        Only the file on disk is changed; self.exif still holds the original
+        tags after this is called.
         """
         if self.rotated:
             # preserve initial rotation
             old_rotation = self.orientation
         
             piexif.remove(self.path)
-        
-            self.read(force=True)
-        
-            self._exif['0th'][274] = old_rotation
             
-            self.save()
+            # build the new tags from scratch instead of re-reading the file,
+            # so the parsed exif data can still be used by thumb() and dump()
+            # while this runs.
+            piexif.insert(piexif.dump({'0th': {274: old_rotation}}), self.path)
         else:
             piexif.remove(self.path)
 
@@ -151,9 +156,11 @@ def tempexif(source, id_, dest):
     Factory - saves the bytes in fp into a temporary location, copies 
     it to the final destination.
     
-    Returns an ExifImage object.
+    Returns an ExifImage object, with a sha256 hex digest of the file's
+    contents in its digest attribute.
     """
     path = os.path.join(dest, "{}.jpg".format(id_))
+    digest = hashlib.sha256()
     
     with tempfile.NamedTemporaryFile() as fp:
         # check the first two bytes
@@ -162,6 +169,7 @@ def tempexif(source, id_, dest):
             raise errors.ExifCleanerNotAJPEG()
         
         fp.write(magic_number)
+        digest.update(magic_number)
         
         while True:
             data = source.read(8192)
@@ -169,10 +177,11 @@ def tempexif(source, id_, dest):
                 break
             
             fp.write(data)
+            digest.update(data)
         
         shutil.copyfile(fp.name, path)
         
         fp.close()
     
             
-    return ExifImage(path)
\ No newline at end of file
+    return ExifImage(path, digest.hexdigest())
\ No newline at end of file
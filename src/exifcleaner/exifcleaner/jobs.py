@@ -3,64 +3,236 @@ Job functions.
 """
 
 from .image import ExifImage
+from .pipeline import Pipeline, Stage
 import os
 from rq import Queue, get_current_job
 from rq.connections import get_current_connection
-from rq_scheduler import Scheduler
 from . import errors
 from . import util
+from . import storage
+from .space import SpaceManager
+from .metrics import JobMetrics
+from .results import ResultStore
+from .quarantine import Quarantine
+from . import sandbox
+from . import callbacks
+from . import events
 import datetime
+import json
+import time
+import redis
 
-def cleanup(id_, data_dir):
+# connections to the main redis server of sharded setups, by url
+_controls = {}
+
+def control_connection(control_url=None):
+    """
+    Return a connection to the redis server that keeps the things that aren't
+    tied to one job: space, metrics and quarantine. That is the job's own 
+    server unless control_url says otherwise (see exifcleaner.sharding).
+    """
+    if control_url is None:
+        return get_current_connection()
+    
+    if control_url not in _controls:
+        _controls[control_url] = redis.StrictRedis.from_url(control_url)
+    
+    return _controls[control_url]
+
+def cancelled_key(id_):
+    """
+    Key set by the web service when a job is cancelled while it may be
+    running, so it doesn't publish anything for files that are gone.
+    """
+    return "exif:cancelled:{}".format(id_)
+
+def run_stages(path):
     """
-    Remove files.
+    Strip the exif data from the image at path, saving the thumbnail and json.
+    Returns the stage timings.
     
-    id_ - the job to clean up after
-    data_dir - where files live
+    The exif data is parsed once; writing the thumbnail, writing the json
+    and rewriting the image then run concurrently.
     """
-    print("Deleting for {}".format(id_))
+    exif = ExifImage(path)
     
-    img = os.path.join(data_dir, "{}.jpg".format(id_))
-    thumb = os.path.join(data_dir, "{}.thumb.jpg".format(id_))
-    json = os.path.join(data_dir, "{}.json".format(id_))
+    pipeline = Pipeline([
+        Stage("parse", exif.read),
+        Stage("thumb", exif.thumb, requires=["parse"]),
+        Stage("dump", exif.dump, requires=["parse"]),
+        Stage("clean", exif.clean, requires=["parse"])
+    ])
     
-    for path in [img, thumb, json]:
-        if os.path.exists(path):
-            print("Removing {}".format(path))
-            os.remove(path)
-        else:
-            print("File {} doesn't exist".format(path))
+    pipeline.run()
     
+    return pipeline.timings
 
-def process(id_, data_dir, clean_in=10):
+def process(id_, data_dir, expires_at, window=None, sharded=False, digest=None, limits=None, control_url=None, callback=None):
     """
     Job to remove the exif data from an uploaded image.
     
     The exif data is saved as a json file.
     
     If the image had an exif thumbnail, it is saved as a separate file.
+    
+    If limits is given, the work is done by run_stages in a sandbox.Sandbox,
+    e.g. {'memory': 268435456, 'cpu': 30}.
+    
+    The files are removed by the expiry sweeper some time after expires_at
+    (a unix timestamp); they were registered with it when uploaded.
+    
+    Timestamps, stage timings and sizes are saved in job.meta, and added to 
+    the rolling totals in metrics.JobMetrics. The timings and sizes also go
+    in the status record, which outlives the job.
+    
+    The job's status record (results.ResultStore, on the job's own redis
+    server) is updated when it starts, and when it finishes or fails, with 
+    the result or the error. The result is also returned. Space, metrics 
+    and quarantine go to the server at control_url, if given.
+    
+    If callback is given, the result (or the error) is also sent to the 
+    client; see callbacks.notify.
+    
+    If processing fails or times out, the error is saved in job.meta, 
+    counted against digest (the sha256 of the upload) in 
+    quarantine.Quarantine, and re-raised. Missing files aren't counted.
+    
+    Anyone waiting on the job is told when it starts, finishes or fails; 
+    see events.EventHub.
+    
+    If the job is cancelled while it runs (see cancelled_key), nothing is 
+    sent, any files it wrote are removed, and the status record is left 
+    saying "canceled".
     """
-    path = os.path.join(data_dir, "{}.jpg".format(id_))
+    job = get_current_job()
+    started_at = time.time()
+    store = ResultStore(get_current_connection())
+    
+    # a windowed upload goes when its whole window does
+    if window is not None:
+        removed_by = datetime.datetime.fromtimestamp(window)
+    else:
+        removed_by = datetime.datetime.fromtimestamp(expires_at)
+    
+    store.save(id_, {'status': 'started', 'started_at': started_at}, removed_by.timestamp())
+    events.publish(control_connection(control_url), id_, 'started')
+    
+    path = os.path.join(storage.directory_for(data_dir, window, id_, sharded), "{}.jpg".format(id_))
+    bytes_in = os.path.getsize(path)
     exif = ExifImage(path)
     
-    exif.thumb()
-    exif.dump()
-    exif.clean()
+    try:
+        if limits:
+            timings = sandbox.get_sandbox(**limits).run(run_stages, path)
+        else:
+            timings = run_stages(path)
+    except Exception as e:
+        # the files were removed from under it; not the image's fault
+        if get_current_connection().exists(cancelled_key(id_)):
+            # in case starting overwrote the web service's "canceled"
+            store.save(id_, {'status': 'canceled'}, removed_by.timestamp())
+            raise
+        
+        # includes RQ's JobTimeoutException
+        error = {
+            'type': type(e).__name__,
+            'message': str(e)
+        }
+        
+        if isinstance(e, errors.ExifCleanerLimitExceeded):
+            error['limit'] = e.limit
+        
+        job.meta['error'] = error
+        job.save_meta()
+        
+        store.save(id_, {
+            'status': 'failed',
+            'finished_at': time.time(),
+            'error_type': error['type'],
+            'error_message': error['message'],
+            'error_limit': error.get('limit')
+        }, removed_by.timestamp())
+        
+        JobMetrics(control_connection(control_url)).record_failure(job.meta)
+        
+        # files that expired or were removed from under the job say nothing
+        # about the upload itself
+        if digest is not None and not isinstance(e, FileNotFoundError):
+            Quarantine(control_connection(control_url)).failed(digest, "{}: {}".format(error['type'], error['message']))
+        
+        events.publish(control_connection(control_url), id_, 'failed')
+        
+        if callback is not None:
+            callbacks.notify(callback, {'id': id_, 'status': 'failed', 'error': error}, get_current_connection())
+        raise
     
-    job = get_current_job()
+    for stage, seconds in sorted(timings.items()):
+        print("Stage {}: {:.4f}s".format(stage, seconds))
+    
+    if get_current_connection().exists(cancelled_key(id_)):
+        print("Cancelled while processing; removing the files again")
+        storage.remove_files([id_], os.path.dirname(path))
+        store.save(id_, {'status': 'canceled'}, removed_by.timestamp())
+        return None
+    
+    # account for the new files, and let them be evicted from now on
+    directory = os.path.dirname(path)
+    nbytes = 0
+    etags = {}
     
-    # schedule the cleanup task
-    now = datetime.datetime.now()
-    scheduler = Scheduler(queue_name=job.origin, connection=get_current_connection())
-    scheduler.enqueue_in(datetime.timedelta(minutes=clean_in), cleanup, id_, data_dir)
+    for name in storage.artifact_names(id_):
+        try:
+            nbytes += os.path.getsize(os.path.join(directory, name))
+            # the files don't change from here on, so /data can hand out
+            # strong ETags without reading them again
+            etags[name] = storage.file_etag(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
     
-    removed_by = now+datetime.timedelta(minutes=clean_in)
+    SpaceManager(control_connection(control_url)).track(id_, nbytes, evictable=True)
+    
+    # keep track of where the time went
+    meta = {
+        'enqueued_at': job.meta.get('enqueued_at', started_at),
+        'started_at': started_at,
+        'finished_at': time.time(),
+        'timings': timings,
+        'bytes_in': bytes_in,
+        'bytes_out': nbytes,
+        'deadline': job.meta.get('deadline'),
+        'tenant': job.meta.get('tenant')
+    }
+    
+    job.meta.update(meta)
+    job.save_meta()
+    
+    JobMetrics(control_connection(control_url)).record(meta)
+    
+    print("Queued for {:.4f}s, processed in {:.4f}s".format(started_at - meta['enqueued_at'], meta['finished_at'] - started_at))
+    
+    if meta['deadline'] is not None and meta['finished_at'] > meta['deadline']:
+        print("Missed deadline by {:.4f}s".format(meta['finished_at'] - meta['deadline']))
     
-    print("Added at: {}".format(now.isoformat()))
     print("Removed by: {}".format(removed_by.isoformat()))
     
-    return {
-        'thumb': exif.thumb_name,
+    result = {
+        # images without an exif thumbnail don't get one
+        'thumb': exif.thumb_name if exif.thumb_name in etags else None,
         'json': exif.json_name,
-        'removed_around': removed_by.isoformat()
+        'removed_around': removed_by.isoformat(),
+        'finished_at': meta['finished_at']
     }
+    
+    # kept until the files go; the job itself is not kept once it finishes
+    store.save(id_, dict(result, 
+                         status='finished', 
+                         etags=json.dumps(etags), 
+                         timings=json.dumps(timings), 
+                         bytes_in=bytes_in, 
+                         bytes_out=nbytes), removed_by.timestamp())
+    events.publish(control_connection(control_url), id_, 'finished')
+    
+    if callback is not None:
+        callbacks.notify(callback, {'id': id_, 'status': 'finished', 'result': result}, get_current_connection())
+    
+    return result
@@ -0,0 +1,179 @@
+"""
+Rolling aggregates of job timings.
+
+Every finished job adds its numbers to a redis hash for the current minute.
+Old minutes expire on their own, so reading the last N minutes gives a
+rolling view of where time is going.
+"""
+
+import time
+
+# stages timed by jobs.process
+STAGES = ["parse", "thumb", "dump", "clean", "total"]
+
+class JobMetrics:
+    """
+    redis - a StrictRedis connection.
+    bucket_size - integer, seconds covered by each hash.
+    keep - integer, seconds to keep each hash around.
+    """
+    prefix = "exif:metrics"
+
+    def __init__(self, redis, bucket_size=60, keep=3600):
+        self.redis = redis
+        self.bucket_size = bucket_size
+        self.keep = keep
+
+    def key(self, bucket):
+        return "{}:{}".format(self.prefix, bucket)
+
+    def tenants_key(self, bucket):
+        return "{}:tenants:{}".format(self.prefix, bucket)
+
+    def bucket_for(self, when):
+        return int(when // self.bucket_size * self.bucket_size)
+
+    def record(self, meta, now=None):
+        """
+        Add the numbers from a job's meta dictionary (see jobs.process) to the
+        current bucket.
+        
+        Jobs with a deadline (a unix timestamp in meta['deadline']) are counted,
+        along with the ones that finished after it.
+
+        Jobs with a tenant (meta['tenant']) are also counted per tenant, along
+        with the time they were queued for.
+        """
+        if now is None:
+            now = time.time()
+
+        key = self.key(self.bucket_for(now))
+        tenants_key = self.tenants_key(self.bucket_for(now))
+
+        with self.redis.pipeline() as pipe:
+            pipe.hincrby(key, "count", 1)
+            pipe.hincrbyfloat(key, "queue_wait", meta['started_at'] - meta['enqueued_at'])
+
+            for stage, seconds in meta['timings'].items():
+                pipe.hincrbyfloat(key, stage, seconds)
+
+            pipe.hincrby(key, "bytes_in", meta['bytes_in'])
+            pipe.hincrby(key, "bytes_out", meta['bytes_out'])
+
+            if meta.get('deadline') is not None:
+                pipe.hincrby(key, "deadline_jobs", 1)
+
+                if meta['finished_at'] > meta['deadline']:
+                    pipe.hincrby(key, "deadline_misses", 1)
+
+            if meta.get('tenant') is not None:
+                pipe.hincrby(tenants_key, "{}:count".format(meta['tenant']), 1)
+                pipe.hincrbyfloat(tenants_key, "{}:queue_wait".format(meta['tenant']), meta['started_at'] - meta['enqueued_at'])
+                pipe.expire(tenants_key, self.keep)
+
+            pipe.expire(key, self.keep)
+            pipe.execute()
+
+    def record_failure(self, meta, now=None):
+        """
+        Count a job that failed. Its timings aren't added to the totals, but
+        if it had a deadline (meta['deadline']), it has missed it.
+        """
+        if meta.get('deadline') is None:
+            return
+
+        if now is None:
+            now = time.time()
+
+        key = self.key(self.bucket_for(now))
+
+        with self.redis.pipeline() as pipe:
+            pipe.hincrby(key, "deadline_jobs", 1)
+            pipe.hincrby(key, "deadline_misses", 1)
+            pipe.expire(key, self.keep)
+            pipe.execute()
+
+    def buckets(self, window, now=None):
+        """
+        Return the buckets covering the last `window` seconds.
+        """
+        if now is None:
+            now = time.time()
+
+        newest = self.bucket_for(now)
+
+        return range(newest - window + self.bucket_size, newest + 1, self.bucket_size)
+
+    def tenants(self, window=900, now=None):
+        """
+        Return a dictionary of tenant: {'count': jobs finished, 'queue_wait':
+        average seconds queued} for the last `window` seconds.
+        """
+        with self.redis.pipeline() as pipe:
+            for bucket in self.buckets(window, now):
+                pipe.hgetall(self.tenants_key(bucket))
+            results = pipe.execute()
+
+        totals = {}
+
+        for data in results:
+            for field, value in data.items():
+                if isinstance(field, bytes):
+                    field = field.decode("utf-8")
+
+                tenant, name = field.rsplit(":", 1)
+                totals.setdefault(tenant, {'count': 0, 'queue_wait': 0.0})
+                totals[tenant][name] += float(value)
+
+        output = {}
+
+        for tenant, total in totals.items():
+            count = int(total['count'])
+
+            output[tenant] = {
+                'count': count,
+                'queue_wait': total['queue_wait'] / count if count else 0.0
+            }
+
+        return output
+
+    def summary(self, window=900, now=None):
+        """
+        Return totals and per-job averages for the last `window` seconds,
+        and how many jobs with a deadline missed it.
+
+        Times are in seconds, sizes in bytes.
+        """
+        with self.redis.pipeline() as pipe:
+            for bucket in self.buckets(window, now):
+                pipe.hgetall(self.key(bucket))
+            results = pipe.execute()
+
+        totals = {}
+
+        for data in results:
+            for field, value in data.items():
+                if isinstance(field, bytes):
+                    field = field.decode("utf-8")
+                totals[field] = totals.get(field, 0) + float(value)
+
+        count = int(totals.pop("count", 0))
+        deadline_jobs = int(totals.pop("deadline_jobs", 0))
+        deadline_misses = int(totals.pop("deadline_misses", 0))
+
+        output = {
+            'window': window,
+            'count': count,
+            'totals': totals,
+            'averages': {},
+            'deadlines': {
+                'jobs': deadline_jobs,
+                'missed': deadline_misses
+            }
+        }
+
+        if count:
+            for field, value in totals.items():
+                output['averages'][field] = value / count
+
+        return output
@@ -0,0 +1,76 @@
+"""
+Move an existing flat data_dir into the sharded layout.
+
+The web service and sweeper should be running with layout="sharded" and
+fallback=True while this runs, so files are found whether or not they have
+been moved yet. Files are moved with os.rename, so each one appears in its
+new place atomically. Files younger than --min-age are skipped, since a
+worker may still be writing next to them; run the tool again to pick them up.
+
+Once a run reports nothing left to move, turn fallback off.
+
+    $ python -m exifcleaner.migrate --data-dir ./tmp
+"""
+
+import argparse
+import os
+import time
+from . import storage
+
+def migrate(data_dir, min_age=60, dry_run=False):
+    """
+    Move every file directly in data_dir that is old enough into the sharded
+    tree. Directories and dotfiles are left alone.
+
+    Returns a tuple of (number of files moved, number of files skipped
+    because they were too new).
+    """
+    moved = 0
+    skipped = 0
+    made = set()
+    now = time.time()
+
+    with os.scandir(data_dir) as entries:
+        for entry in entries:
+            if entry.name.startswith(".") or not entry.is_file(follow_symlinks=False):
+                continue
+
+            if now - entry.stat(follow_symlinks=False).st_mtime < min_age:
+                skipped += 1
+                continue
+
+            shard = storage.shard_name(storage.id_from_name(entry.name))
+
+            if dry_run:
+                print("{} -> {}".format(entry.name, os.path.join(shard, entry.name)))
+                moved += 1
+                continue
+
+            if shard not in made:
+                os.makedirs(os.path.join(data_dir, shard), exist_ok=True)
+                made.add(shard)
+
+            try:
+                os.rename(entry.path, os.path.join(data_dir, shard, entry.name))
+            except FileNotFoundError:
+                # removed by the sweeper in the meantime
+                continue
+
+            moved += 1
+
+    return moved, skipped
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move a flat data directory into the sharded layout.")
+    parser.add_argument("--data-dir", default="./tmp")
+    parser.add_argument("--min-age", type=int, default=60, help="seconds since a file was last modified before it is moved")
+    parser.add_argument("--dry-run", action="store_true")
+
+    args = parser.parse_args(argv)
+
+    moved, skipped = migrate(args.data_dir, args.min_age, args.dry_run)
+
+    print("Moved {} files, {} left in place".format(moved, skipped))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+A tiny stage graph runner.
+
+A pipeline is a list of named stages. Each stage can depend on other stages;
+stages whose dependencies are satisfied are run concurrently on a thread pool.
+This suits the image processing jobs, where most of the time is spent waiting
+on file I/O rather than holding the GIL.
+
+Threads can't be killed, so a stage that is still running when its pipeline
+fails or times out carries on in the background. abandoned() counts those;
+long-lived processes that run many pipelines should check it and restart
+once it gets too high (exifcleaner.worker.SandboxWorker does), or run them
+somewhere that can be killed, like a sandbox.Sandbox.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import time
+from . import errors
+
+# futures of stages that were left running by a failed Pipeline.run
+_abandoned = set()
+
+def abandoned():
+    """
+    Return the number of stages left running by failed pipelines that still
+    haven't finished.
+    """
+    for future in list(_abandoned):
+        if future.done():
+            _abandoned.discard(future)
+
+    return len(_abandoned)
+
+class Stage:
+    """
+    A single unit of work in a Pipeline.
+
+    name - string, unique name of the stage.
+    func - callable, takes no arguments. Its return value is kept as the
+           result of the stage.
+    requires - list of stage names that must finish before this one starts.
+    """
+    def __init__(self, name, func, requires=()):
+        self.name = name
+        self.func = func
+        self.requires = tuple(requires)
+
+    def __repr__(self):
+        return "<Stage {}>".format(self.name)
+
+class Pipeline:
+    """
+    Runs a set of Stage objects, respecting their dependencies.
+
+    After run() is called, self.results maps stage names to return values,
+    and self.timings maps stage names to the number of seconds each stage
+    took. The total wall time is stored under the 'total' key.
+    """
+    def __init__(self, stages, max_workers=4):
+        self.stages = {}
+
+        for stage in stages:
+            if stage.name in self.stages:
+                raise errors.ExifCleanerConfigError("Duplicate stage '{}'".format(stage.name))
+            self.stages[stage.name] = stage
+
+        for stage in stages:
+            for name in stage.requires:
+                if name not in self.stages:
+                    raise errors.ExifCleanerConfigError("Stage '{}' requires unknown stage '{}'".format(stage.name, name))
+
+        self.max_workers = max_workers
+        self.results = {}
+        self.timings = {}
+
+    def _timed(self, stage):
+        """
+        Internal function, runs a stage and records how long it took.
+        """
+        start = time.perf_counter()
+
+        try:
+            return stage.func()
+        finally:
+            self.timings[stage.name] = time.perf_counter() - start
+
+    def run(self):
+        """
+        Run all of the stages. Returns self.results.
+
+        If a stage raises an exception, stages that have not started yet are
+        abandoned and the exception is re-raised straight away. So is any
+        exception raised in the calling thread while it waits, such as RQ's
+        job timeout. Stages that are still running are left to finish in the
+        background rather than waited for, since one that hangs would
+        otherwise hold the exception up for as long as it hangs; they are
+        counted by abandoned() until they do.
+        """
+        start = time.perf_counter()
+
+        pending = dict(self.stages)
+        running = {}
+        done = set()
+
+        pool = ThreadPoolExecutor(max_workers=self.max_workers)
+
+        try:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    if all(req in done for req in stage.requires):
+                        running[pool.submit(self._timed, stage)] = name
+                        del pending[name]
+
+                if not running:
+                    raise errors.ExifCleanerConfigError("Dependency cycle between stages: {}".format(", ".join(sorted(pending))))
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in finished:
+                    name = running.pop(future)
+
+                    # raises the stage's exception, if there was one
+                    self.results[name] = future.result()
+                    done.add(name)
+        except BaseException:
+            try:
+                for future in running:
+                    future.cancel()
+
+                pool.shutdown(wait=False)
+            except Exception:
+                pass
+
+            _abandoned.update(future for future in running if not future.done())
+
+            raise
+
+        pool.shutdown(wait=True)
+
+        self.timings['total'] = time.perf_counter() - start
+
+        return self.results
@@ -0,0 +1,84 @@
+"""
+Quarantine of files that keep breaking the workers.
+
+Some malformed JPEGs make piexif fail, or spin until the job times out. Every
+time that happens the failure is counted against a hash of the file's
+contents. Once a file has failed max_failures times it is quarantined, and
+uploads of the same file are turned away at /clean instead of tying up a
+worker again.
+
+Failure counts are forgotten after `window` seconds, and quarantined files
+are let back in after `ttl` seconds, in case the failures were down to
+something else (e.g. an overloaded worker).
+"""
+
+from . import util
+
+class Quarantine:
+    """
+    redis - a StrictRedis connection.
+    max_failures - integer, failures before a file is quarantined.
+    window - integer, seconds to remember failures for.
+    ttl - integer, seconds to keep a file quarantined for.
+    """
+    prefix = "exif:quarantine"
+
+    def __init__(self, redis, max_failures=3, window=86400, ttl=604800):
+        self.redis = redis
+        self.max_failures = max_failures
+        self.window = window
+        self.ttl = ttl
+
+    def failures_key(self, digest):
+        return "{}:failures:{}".format(self.prefix, digest)
+
+    def key(self, digest):
+        return "{}:file:{}".format(self.prefix, digest)
+
+    def failed(self, digest, reason):
+        """
+        Count a failure against a file. `reason` is a short string saying what
+        went wrong. Returns True if the file is now quarantined.
+        """
+        key = self.failures_key(digest)
+
+        with self.redis.pipeline() as pipe:
+            pipe.incr(key)
+            pipe.expire(key, self.window)
+            failures = pipe.execute()[0]
+
+        if failures < self.max_failures:
+            return False
+
+        print("Quarantining {} after {} failures: {}".format(digest, failures, reason))
+
+        with self.redis.pipeline() as pipe:
+            pipe.set(self.key(digest), reason, ex=self.ttl)
+            pipe.delete(key)
+            pipe.execute()
+
+        return True
+
+    def reason(self, digest):
+        """
+        Return why a file was quarantined, or None if it isn't.
+        """
+        reason = self.redis.get(self.key(digest))
+
+        if isinstance(reason, bytes):
+            reason = reason.decode("utf-8")
+
+        return reason
+
+    def release(self, digest):
+        """
+        Let a file back in, and forget its failures.
+        """
+        self.redis.delete(self.key(digest), self.failures_key(digest))
+
+    def check(self, digest):
+        """
+        Raise util.web.BadRequest (422) if the file is quarantined.
+        """
+        if self.reason(digest) is not None:
+            raise util.web.BadRequest("This file has failed to process too many times, and has been quarantined", code=422)
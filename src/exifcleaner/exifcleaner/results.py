@@ -0,0 +1,159 @@
+"""
+Compact storage of job status and results, and cleanup of old job records.
+
+RQ keeps a finished job's pickled return value in the job hash, and keeps
+the hash (and its registry entries) around long after the files it points
+to are gone. Instead, each job has a small hash with a fixed set of fields
+that expires along with the files: the web service creates it when the job
+is queued, and jobs.process fills in the status, timestamps, and the result
+or error as it goes. /status/<id> is answered from it with a single HGETALL.
+The job itself is enqueued with result_ttl=0 so RQ drops it as soon as it
+finishes; the route it took and its stage timings, which used to be read
+from job.meta, are kept in the record too.
+
+Failed jobs are still kept by RQ; compact() removes the ones that are older
+than the file TTL. The expiry sweeper calls it periodically.
+"""
+
+import datetime
+from rq.utils import utcparse
+
+try:
+    from rq.registry import FailedJobRegistry
+except ImportError:
+    # older versions of RQ keep failed jobs on a "failed" queue instead
+    FailedJobRegistry = None
+
+from rq.registry import FinishedJobRegistry, StartedJobRegistry
+
+# every field a record can have
+FIELDS = [
+    "status", "ttl", "timeout",
+    "enqueued_at", "started_at", "finished_at",
+    "thumb", "json", "removed_around",
+    "error_type", "error_message", "error_limit",
+    "etags", "route", "timings", "bytes_in", "bytes_out"
+]
+
+# the fields that make up a finished job's result
+RESULT_FIELDS = ["thumb", "json", "removed_around", "finished_at"]
+
+class ResultStore:
+    """
+    redis - a StrictRedis connection.
+    """
+    prefix = "exif:result"
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    def key(self, id_):
+        return "{}:{}".format(self.prefix, id_)
+
+    def save(self, id_, result, expire_at, pipe=None):
+        """
+        Save fields of the record for id_, e.g. a result or a new status.
+        Only the keys in FIELDS are kept, and fields already saved that
+        aren't given are left alone. The hash is removed at the unix 
+        timestamp `expire_at`.
+        """
+        data = {}
+
+        for field in FIELDS:
+            if result.get(field) is not None:
+                data[field] = result[field]
+
+        if not data:
+            return
+
+        if pipe is None:
+            with self.redis.pipeline() as pipe:
+                self.save(id_, result, expire_at, pipe=pipe)
+                pipe.execute()
+        else:
+            pipe.hset(self.key(id_), mapping=data)
+            pipe.expireat(self.key(id_), int(expire_at))
+
+    def get(self, id_):
+        """
+        Return the result for id_ as a dictionary, or None if there isn't one.
+        """
+        return self.decode(self.redis.hgetall(self.key(id_)))
+
+    @staticmethod
+    def decode(data):
+        """
+        Turn the raw HGETALL of a result into a dictionary of strings, or
+        None if it was empty. For callers that fetch results in a pipeline.
+        """
+        if not data:
+            return None
+
+        output = {}
+
+        for field, value in data.items():
+            if isinstance(field, bytes):
+                field = field.decode("utf-8")
+            if isinstance(value, bytes):
+                value = value.decode("utf-8")
+            output[field] = value
+
+        return output
+
+def _ended(value, now):
+    """
+    Internal function. Return the age in seconds of an RQ timestamp, or None
+    if there isn't one.
+    """
+    if not value:
+        return None
+
+    if isinstance(value, bytes):
+        value = value.decode("utf-8")
+
+    return (now - utcparse(value)).total_seconds()
+
+def compact(redis, queue_names, max_age):
+    """
+    Remove job records older than max_age seconds from RQ's finished and
+    failed registries for the given queues, along with the job hashes
+    themselves. Also drops expired entries from the started registries.
+
+    Returns the number of jobs removed.
+    """
+    now = datetime.datetime.utcnow()
+    removed = 0
+
+    for name in queue_names:
+        StartedJobRegistry(name, connection=redis).cleanup()
+
+        registries = [FinishedJobRegistry(name, connection=redis)]
+
+        if FailedJobRegistry is not None:
+            registries.append(FailedJobRegistry(name, connection=redis))
+
+        for registry in registries:
+            ids = registry.get_job_ids()
+
+            if not ids:
+                continue
+
+            with redis.pipeline() as pipe:
+                for id_ in ids:
+                    pipe.hget("rq:job:{}".format(id_), "ended_at")
+                ended = pipe.execute()
+
+            with redis.pipeline() as pipe:
+                for id_, value in zip(ids, ended):
+                    age = _ended(value, now)
+
+                    # no end time means the hash has already gone; just
+                    # drop the entry
+                    if age is None or age > max_age:
+                        pipe.delete("rq:job:{}".format(id_))
+                        pipe.zrem(registry.key, id_)
+                        removed += 1
+
+                pipe.execute()
+
+    return removed
@@ -0,0 +1,90 @@
+"""
+Routing of cleaning jobs to queues.
+
+Routes are checked in order, and the first one that matches an upload wins.
+Each route is a dictionary:
+
+    queue - string, required. Name of the RQ queue to use.
+    max_size - integer, optional. Only match uploads of at most this many bytes.
+    profile - string, optional. Only match uploads that asked for this profile.
+
+The last route should normally match everything. If nothing matches, the
+last route is used anyway.
+
+Example - small files go to a "fast" queue, so they never wait behind big
+ones, and everything else goes to "bulk":
+
+    [
+        {'queue': 'exifcleaner-fast', 'max_size': 2097152},
+        {'queue': 'exifcleaner-bulk'}
+    ]
+"""
+
+from . import errors
+
+def default_routes(queue_name):
+    """
+    Return the default routes for a queue name: uploads of up to 2MB go to
+    <queue_name>-fast, everything else to <queue_name>-bulk.
+    """
+    return [
+        {'queue': "{}-fast".format(queue_name), 'max_size': 2 * 1024 * 1024},
+        {'queue': "{}-bulk".format(queue_name)}
+    ]
+
+class Router:
+    """
+    Picks a queue for each upload.
+    """
+    def __init__(self, routes):
+        if not routes:
+            raise errors.ExifCleanerConfigError("At least one route is required")
+
+        for route in routes:
+            if 'queue' not in route:
+                raise errors.ExifCleanerConfigError("Route {} has no queue".format(route))
+
+        self.routes = routes
+
+    @property
+    def queues(self):
+        """
+        Names of every queue that can be routed to, in route order.
+        """
+        output = []
+
+        for route in self.routes:
+            if route['queue'] not in output:
+                output.append(route['queue'])
+
+        return output
+
+    def matches(self, route, size, profile=None):
+        if 'max_size' in route and size > route['max_size']:
+            return False
+
+        if 'profile' in route and profile != route['profile']:
+            return False
+
+        return True
+
+    def route(self, size, profile=None):
+        """
+        Return a dictionary describing where an upload of `size` bytes goes.
+        It is saved in the job's meta so routes can be tuned later:
+
+        {'queue': 'exifcleaner-fast', 'rule': 0, 'size': 1234, 'profile': None}
+        """
+        for index, route in enumerate(self.routes):
+            if self.matches(route, size, profile):
+                break
+        else:
+            index = len(self.routes) - 1
+            route = self.routes[index]
+
+        return {
+            'queue': route['queue'],
+            'rule': index,
+            'size': size,
+            'profile': profile
+        }
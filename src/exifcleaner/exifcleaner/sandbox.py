@@ -0,0 +1,222 @@
+"""
+Resource-limited child processes for untrusted work.
+
+A crafted image can make a parser allocate huge amounts of memory or loop for
+a long time. Run in a Sandbox, that work happens in a child process with
+RLIMIT_AS and RLIMIT_CPU set, so only the child goes down and the caller gets
+an ExifCleanerLimitExceeded exception instead.
+
+The child is kept and reused for later calls, so the cost of forking is only
+paid once every max_tasks calls, or after a call fails badly or leaves
+threads running. To make use of
+that across jobs, the RQ worker has to run jobs in its own process (e.g.
+`rq worker -w exifcleaner.worker.SandboxWorker`); the default worker forks a
+new process for each job, so each job gets a new child.
+"""
+
+import math
+import multiprocessing
+import os
+import resource
+import signal
+import threading
+from . import errors
+
+def _cpu_used():
+    """
+    Internal function. Seconds of CPU time this process has used.
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+
+    return usage.ru_utime + usage.ru_stime
+
+def _serve(conn, memory, cpu):
+    """
+    Internal function. Main loop of the child process: run each
+    (func, args, kwargs) received on conn, and send back a
+    (status, value, retire) tuple. retire is True if the child is exiting
+    after this call.
+    """
+    # don't run handlers inherited from the parent (e.g. RQ's warm shutdown)
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGALRM):
+        signal.signal(signum, signal.SIG_DFL)
+
+    if memory is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+
+    while True:
+        try:
+            func, args, kwargs = conn.recv()
+        except EOFError:
+            return
+
+        if cpu is not None:
+            # RLIMIT_CPU counts all of the time this process has used, so it
+            # is moved along before each task. Going over it sends SIGXCPU,
+            # which kills the process.
+            soft = int(math.ceil(_cpu_used() + cpu))
+            hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+
+            if hard != resource.RLIM_INFINITY:
+                soft = min(soft, hard)
+
+            resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+        try:
+            result = func(*args, **kwargs)
+        except MemoryError:
+            # the heap may be in a bad way; start over
+            conn.send(("memory", None, True))
+            return
+        except Exception as e:
+            error = e
+        else:
+            error = None
+
+        # threads the call left running (e.g. the stages of a failed
+        # pipeline.Pipeline) can't be stopped; start over once it's answered
+        retire = threading.active_count() > 1
+
+        if error is None:
+            conn.send(("ok", result, retire))
+        else:
+            try:
+                conn.send(("error", error, retire))
+            except Exception:
+                conn.send(("error", errors.ExifCleanerSandboxError(repr(error)), retire))
+
+        if retire:
+            return
+
+class Sandbox:
+    """
+    Runs functions in a child process with resource limits.
+
+    memory - integer, bytes of address space the child can use. None for no
+             limit. The interpreter and its imports count towards this, so
+             allow a couple of hundred MB on top of what the work needs.
+    cpu - integer, seconds of CPU time each call can use. None for no limit.
+    max_tasks - integer, calls to make before replacing the child.
+
+    Functions and their arguments and return values are sent between
+    processes, so they have to be picklable.
+    """
+    def __init__(self, memory=None, cpu=None, max_tasks=100):
+        self.memory = memory
+        self.cpu = cpu
+        self.max_tasks = max_tasks
+
+        self.process = None
+        self.conn = None
+        self.tasks = 0
+        self._pid = None
+
+    def start(self):
+        context = multiprocessing.get_context("fork")
+        self.conn, child = context.Pipe()
+
+        self.process = context.Process(target=_serve, args=(child, self.memory, self.cpu), daemon=True)
+        self.process.start()
+        child.close()
+
+        self.tasks = 0
+        self._pid = os.getpid()
+
+    def stop(self):
+        if self.process is None:
+            return
+
+        # a copy inherited from another process; the child isn't ours
+        if self._pid == os.getpid():
+            self.conn.close()
+            self.process.join(1)
+
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join()
+
+        self.process = None
+        self.conn = None
+
+    def kill(self):
+        """
+        Kill the child, from any thread, e.g. to stop a call in progress.
+        The call then fails with ExifCleanerSandboxError, and the next one
+        starts a new child.
+        """
+        process = self.process
+
+        if process is not None and self._pid == os.getpid() and process.pid:
+            try:
+                os.kill(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def _failed(self):
+        """
+        Internal function. The child went away mid-call; work out why.
+        """
+        self.process.join(1)
+        code = self.process.exitcode
+        self.stop()
+
+        if code == -signal.SIGXCPU:
+            return errors.ExifCleanerLimitExceeded("cpu")
+
+        return errors.ExifCleanerSandboxError("Sandbox process exited with code {}".format(code))
+
+    def run(self, func, *args, **kwargs):
+        """
+        Call func(*args, **kwargs) in the child and return the result.
+
+        Exceptions raised by func are raised here too. Raises
+        ExifCleanerLimitExceeded if a limit is hit, or ExifCleanerSandboxError
+        if the child dies some other way.
+        """
+        if self._pid != os.getpid() or self.process is None or not self.process.is_alive() or self.tasks >= self.max_tasks:
+            self.stop()
+            self.start()
+
+        self.tasks += 1
+
+        try:
+            self.conn.send((func, args, kwargs))
+            status, value, retire = self.conn.recv()
+        except (EOFError, ConnectionError):
+            raise self._failed()
+        except BaseException:
+            # e.g. the job timed out; don't leave the child running
+            self.stop()
+            raise
+
+        if retire:
+            # the next call starts a new child
+            self.stop()
+
+        if status == "memory":
+            raise errors.ExifCleanerLimitExceeded("memory")
+        elif status == "error":
+            raise value
+
+        return value
+
+# one sandbox per set of limits, kept for the life of the process
+_sandboxes = {}
+
+def get_sandbox(memory=None, cpu=None):
+    """
+    Return the shared Sandbox for the given limits, creating it if needed.
+    """
+    key = (memory, cpu)
+
+    if key not in _sandboxes:
+        _sandboxes[key] = Sandbox(memory, cpu)
+
+    return _sandboxes[key]
+
+def kill_all():
+    """
+    Kill the children of every shared Sandbox; see Sandbox.kill.
+    """
+    for sandbox in list(_sandboxes.values()):
+        sandbox.kill()
@@ -0,0 +1,430 @@
+"""
+Earliest-deadline-first and per-tenant fair scheduling of jobs.
+
+RQ queues are first in, first out, so a job that has to be done in 2 seconds
+waits behind a batch import that could wait for minutes. A DeadlineQueue
+also indexes jobs that have a deadline (an absolute unix timestamp in
+job.meta['deadline']) in a sorted set, and workers using it take the job
+with the earliest deadline across their queues first. Jobs without a
+deadline are taken in the usual FIFO order once no deadline jobs are
+waiting.
+
+Every job is still pushed onto the normal RQ list, so queue lengths,
+admission control and `rq info` see them as usual. Whoever removes a job id
+from the list owns the job; the sorted set only decides the order.
+
+A FairQueue also keeps a list of waiting jobs per tenant (see
+job.meta['tenant']), and once no deadline jobs are waiting, takes jobs from
+the tenants by deficit round robin, so one busy uploader can't starve the
+rest. Each job costs one unit per started MB of upload, up to max_units; each
+round a tenant gets its weight (default 1) in units to spend. Weights are
+kept in the exif:fair:weights hash.
+
+Workers have to be started with the queue class:
+
+    $ rq worker --queue-class exifcleaner.scheduling.FairQueue exifcleaner-fast
+"""
+
+import collections
+import datetime
+import math
+from rq import Queue
+from rq.exceptions import NoSuchJobError
+from rq.utils import utcparse
+
+class DeadlineQueue(Queue):
+    deadline_prefix = "exif:deadlines:"
+
+    @classmethod
+    def deadline_key_for(cls, name):
+        return "{}{}".format(cls.deadline_prefix, name)
+
+    @property
+    def deadline_key(self):
+        return self.deadline_key_for(self.name)
+
+    def enqueue_job(self, job, pipeline=None, at_front=False):
+        """
+        Enqueue the job as usual, and index its deadline if it has one.
+        """
+        deadline = job.meta.get('deadline')
+
+        if deadline is None or not getattr(self, "_is_async", True):
+            return Queue.enqueue_job(self, job, pipeline=pipeline, at_front=at_front)
+
+        pipe = pipeline if pipeline is not None else self.connection.pipeline()
+
+        pipe.execute_command("ZADD", self.deadline_key, deadline, job.id)
+        job = Queue.enqueue_job(self, job, pipeline=pipe, at_front=at_front)
+
+        if pipeline is None:
+            pipe.execute()
+
+        return job
+
+    def remove(self, job_or_id, pipeline=None):
+        """
+        Take a job off the queue, and out of the deadline index. Returns the
+        number of entries removed from the queue's list, as Queue.remove
+        does: 0 means a worker already has the job.
+        """
+        job_id = job_or_id.id if isinstance(job_or_id, self.job_class) else job_or_id
+
+        if pipeline is not None:
+            pipeline.zrem(self.deadline_key, job_id)
+            return Queue.remove(self, job_or_id, pipeline=pipeline)
+
+        with self.connection.pipeline() as pipe:
+            pipe.zrem(self.deadline_key, job_id)
+            Queue.remove(self, job_or_id, pipeline=pipe)
+            removed = pipe.execute()[1]
+
+        return removed
+
+    def count_deadlines(self):
+        """
+        Number of waiting jobs that have a deadline.
+        """
+        return self.connection.zcard(self.deadline_key)
+
+    @classmethod
+    def dequeue_earliest(cls, queues, connection, job_class=None, serializer=None):
+        """
+        Take the job with the earliest deadline from the given queues. Returns
+        a (job, queue) tuple, or None if no deadline jobs are waiting.
+        """
+        job_class = job_class or cls.job_class
+
+        while True:
+            with connection.pipeline() as pipe:
+                for queue in queues:
+                    pipe.zrange(queue.deadline_key, 0, 0, withscores=True)
+                heads = pipe.execute()
+
+            earliest = None
+
+            for queue, head in zip(queues, heads):
+                if head and (earliest is None or head[0][1] < earliest[2]):
+                    earliest = (queue, head[0][0], head[0][1])
+
+            if earliest is None:
+                return None
+
+            queue, id_, deadline = earliest
+
+            if isinstance(id_, bytes):
+                id_ = id_.decode("utf-8")
+
+            # another worker got there first, or the job was taken off the
+            # list some other way (e.g. cancelled)
+            if not connection.zrem(queue.deadline_key, id_):
+                continue
+
+            if not connection.lrem(queue.key, 1, id_):
+                continue
+
+            try:
+                if serializer is not None:
+                    job = job_class.fetch(id_, connection=connection, serializer=serializer)
+                else:
+                    job = job_class.fetch(id_, connection=connection)
+            except NoSuchJobError:
+                continue
+
+            return job, queue
+
+    @classmethod
+    def dequeue_any(cls, queues, timeout, connection=None, job_class=None, serializer=None):
+        """
+        Like Queue.dequeue_any, but jobs with a deadline are taken first,
+        earliest deadline first.
+        """
+        if connection is None and queues:
+            connection = queues[0].connection
+
+        result = cls.dequeue_earliest(queues, connection, job_class=job_class, serializer=serializer)
+
+        if result is not None:
+            return result
+
+        result = super(DeadlineQueue, cls).dequeue_any(queues, timeout, connection=connection, job_class=job_class, serializer=serializer)
+
+        if result is not None:
+            job, queue = result
+
+            # a deadline job that came off the list the normal way
+            if job.meta.get('deadline') is not None:
+                connection.zrem(cls.deadline_key_for(queue.name), job.id)
+
+        return result
+
+class DeficitRoundRobin:
+    """
+    Deficit round robin over the tenants of one FairQueue.
+
+    The round robin state is kept by each worker process rather than in
+    redis. Every worker is fair on its own, so together they are too, and
+    the only thing they share is the per-tenant lists that jobs are popped
+    from.
+    """
+    def __init__(self):
+        self.ring = collections.deque()
+        self.deficits = {}
+
+    def sync(self, tenants):
+        """
+        Bring the ring up to date with the set of tenants that have jobs
+        waiting. New tenants go to the back.
+        """
+        for tenant in list(self.ring):
+            if tenant not in tenants:
+                self.ring.remove(tenant)
+                self.deficits.pop(tenant, None)
+
+        for tenant in sorted(tenants):
+            if tenant not in self.deficits:
+                self.ring.append(tenant)
+                self.deficits[tenant] = 0
+
+    def next(self, queue, limit=1000):
+        """
+        Take the next job id from queue, or return None if there are none.
+        """
+        connection = queue.connection
+
+        with connection.pipeline() as pipe:
+            pipe.smembers(queue.tenants_key)
+            pipe.hgetall(queue.weights_key)
+            tenants, weights = pipe.execute()
+
+        self.sync(set(_text(tenant) for tenant in tenants))
+        weights = dict((_text(tenant), float(weight)) for tenant, weight in weights.items())
+
+        for attempt in range(limit):
+            if not self.ring:
+                return None
+
+            tenant = self.ring[0]
+            key = queue.tenant_key(tenant)
+
+            head = connection.lindex(key, 0)
+
+            if head is None:
+                self.ring.popleft()
+                del self.deficits[tenant]
+                queue.retire(tenant)
+                continue
+
+            cost = int(connection.hget(queue.costs_key, head) or 1)
+
+            if self.deficits[tenant] < cost:
+                # end of this tenant's turn; top it up for the next one
+                self.deficits[tenant] += weights.get(tenant, 1.0)
+                self.ring.rotate(-1)
+                continue
+
+            # whoever pops the id gets to try for the job. It may not be the
+            # head we looked at if another worker got there first.
+            id_ = connection.lpop(key)
+
+            if id_ is None:
+                continue
+
+            id_ = _text(id_)
+
+            with connection.pipeline() as pipe:
+                pipe.hget(queue.costs_key, id_)
+                pipe.hdel(queue.costs_key, id_)
+                pipe.lrem(queue.key, 1, id_)
+                cost, deleted, removed = pipe.execute()
+
+            # already taken some other way, e.g. by deadline or cancelled
+            if not removed:
+                continue
+
+            self.deficits[tenant] -= int(cost or 1)
+
+            return id_
+
+        return None
+
+# round robin state for each queue, kept for the life of the process
+_schedulers = {}
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+
+    return value
+
+class FairQueue(DeadlineQueue):
+    fair_prefix = "exif:fair"
+    weights_key = "exif:fair:weights"
+
+    # bytes per unit of cost, and the most a single job can cost
+    unit = 1048576
+    max_units = 16
+
+    @property
+    def tenants_key(self):
+        return "{}:{}:tenants".format(self.fair_prefix, self.name)
+
+    @property
+    def costs_key(self):
+        return "{}:{}:costs".format(self.fair_prefix, self.name)
+
+    def tenant_key(self, tenant):
+        return "{}:{}:tenant:{}".format(self.fair_prefix, self.name, tenant)
+
+    @classmethod
+    def set_weight(cls, connection, tenant, weight):
+        """
+        Give a tenant `weight` times the default share of the workers.
+        """
+        connection.hset(cls.weights_key, tenant, weight)
+
+    def cost(self, size):
+        return min(max(1, int(math.ceil(size / self.unit))), self.max_units)
+
+    def enqueue_job(self, job, pipeline=None, at_front=False):
+        """
+        Enqueue the job as usual, and add it to its tenant's list if it has a
+        tenant.
+        """
+        tenant = job.meta.get('tenant')
+
+        if tenant is None or not getattr(self, "_is_async", True):
+            return DeadlineQueue.enqueue_job(self, job, pipeline=pipeline, at_front=at_front)
+
+        pipe = pipeline if pipeline is not None else self.connection.pipeline()
+
+        size = job.meta.get('route', {}).get('size', 0)
+
+        pipe.hset(self.costs_key, job.id, self.cost(size))
+        pipe.rpush(self.tenant_key(tenant), job.id)
+        pipe.sadd(self.tenants_key, tenant)
+        job = DeadlineQueue.enqueue_job(self, job, pipeline=pipe, at_front=at_front)
+
+        if pipeline is None:
+            pipe.execute()
+
+        return job
+
+    def remove(self, job_or_id, pipeline=None):
+        """
+        Like DeadlineQueue.remove, but also takes the job off its tenant's
+        list, if given a job with a tenant.
+        """
+        tenant = None
+
+        if isinstance(job_or_id, self.job_class):
+            tenant = job_or_id.meta.get('tenant')
+
+        if tenant is None:
+            return DeadlineQueue.remove(self, job_or_id, pipeline=pipeline)
+
+        if pipeline is not None:
+            pipeline.lrem(self.tenant_key(tenant), 1, job_or_id.id)
+            pipeline.hdel(self.costs_key, job_or_id.id)
+            return DeadlineQueue.remove(self, job_or_id, pipeline=pipeline)
+
+        with self.connection.pipeline() as pipe:
+            pipe.lrem(self.tenant_key(tenant), 1, job_or_id.id)
+            pipe.hdel(self.costs_key, job_or_id.id)
+            DeadlineQueue.remove(self, job_or_id, pipeline=pipe)
+            removed = pipe.execute()[-1]
+
+        return removed
+
+    def retire(self, tenant):
+        """
+        Stop looking at a tenant whose list is empty.
+        """
+        self.connection.srem(self.tenants_key, tenant)
+
+        # a job may have arrived in the meantime
+        if self.connection.llen(self.tenant_key(tenant)):
+            self.connection.sadd(self.tenants_key, tenant)
+
+    def tenant_stats(self):
+        """
+        Return a dictionary of tenant: {'depth': jobs waiting, 'wait': seconds 
+        the oldest one has been waiting} for tenants with jobs waiting.
+
+        Depths can include a few jobs that were already taken by deadline.
+        """
+        tenants = sorted(_text(tenant) for tenant in self.connection.smembers(self.tenants_key))
+
+        with self.connection.pipeline() as pipe:
+            for tenant in tenants:
+                pipe.llen(self.tenant_key(tenant))
+                pipe.lindex(self.tenant_key(tenant), 0)
+            results = pipe.execute()
+
+        heads = results[1::2]
+
+        with self.connection.pipeline() as pipe:
+            for head in heads:
+                pipe.hget("rq:job:{}".format(_text(head or "")), "enqueued_at")
+            enqueued = pipe.execute()
+
+        now = datetime.datetime.utcnow()
+        output = {}
+
+        for tenant, depth, value in zip(tenants, results[0::2], enqueued):
+            wait = 0.0
+
+            if value:
+                wait = (now - utcparse(_text(value))).total_seconds()
+
+            output[tenant] = {'depth': depth, 'wait': wait}
+
+        return output
+
+    @classmethod
+    def dequeue_fair(cls, queues, connection, job_class=None, serializer=None):
+        """
+        Take the next job from the tenants of the given queues, in order.
+        Returns a (job, queue) tuple, or None if no tenant has a job waiting.
+        """
+        job_class = job_class or cls.job_class
+
+        for queue in queues:
+            scheduler = _schedulers.setdefault(queue.name, DeficitRoundRobin())
+
+            while True:
+                id_ = scheduler.next(queue)
+
+                if id_ is None:
+                    break
+
+                try:
+                    if serializer is not None:
+                        job = job_class.fetch(id_, connection=connection, serializer=serializer)
+                    else:
+                        job = job_class.fetch(id_, connection=connection)
+                except NoSuchJobError:
+                    continue
+
+                return job, queue
+
+        return None
+
+    @classmethod
+    def dequeue_any(cls, queues, timeout, connection=None, job_class=None, serializer=None):
+        """
+        Like DeadlineQueue.dequeue_any, but once there are no deadline jobs,
+        jobs are taken from each tenant in turn before falling back to FIFO.
+        """
+        if connection is None and queues:
+            connection = queues[0].connection
+
+        result = cls.dequeue_earliest(queues, connection, job_class=job_class, serializer=serializer)
+
+        if result is None:
+            result = cls.dequeue_fair(queues, connection, job_class=job_class, serializer=serializer)
+
+        if result is not None:
+            return result
+
+        return super(FairQueue, cls).dequeue_any(queues, timeout, connection=connection, job_class=job_class, serializer=serializer)
@@ -0,0 +1,95 @@
+"""
+Spreading jobs over several redis servers.
+
+Each job id belongs to one shard, picked by consistent hashing: every shard
+gets a number of points on a ring, and an id goes to the first shard point
+at or after the id's own hash. Adding or removing a shard only moves the ids
+next to its points, roughly 1/n of them, rather than reshuffling everything.
+
+Anything that can be looked up by id (the RQ job, its result) lives on the
+id's shard, so /status/<id> and /cancel/<id> only ever talk to one server.
+Things that aren't tied to one id (the id registry, expiry, space, metrics,
+quarantine) stay on the first, "control", server.
+
+Each shard needs its own workers:
+
+    $ rq worker --url redis://shard1:6379/0 --queue-class exifcleaner.scheduling.FairQueue exifcleaner-fast
+"""
+
+import bisect
+import hashlib
+import redis
+from . import errors
+
+def _hash(value):
+    """
+    Internal function. Position of a string on the ring.
+    """
+    return int(hashlib.md5(value.encode("utf-8")).hexdigest()[:16], 16)
+
+class ShardRing:
+    """
+    urls - list of redis urls, one per shard. The order doesn't matter, but
+           the urls do; changing one moves its ids.
+    replicas - integer, points each shard gets on the ring. More points
+               spread ids more evenly.
+    """
+    def __init__(self, urls, replicas=128):
+        if not urls:
+            raise errors.ExifCleanerConfigError("At least one redis url is required")
+
+        if len(set(urls)) != len(urls):
+            raise errors.ExifCleanerConfigError("Redis urls must be unique")
+
+        self.urls = list(urls)
+        self.replicas = replicas
+        self._connections = {}
+
+        points = []
+
+        for url in self.urls:
+            for replica in range(replicas):
+                points.append((_hash("{}#{}".format(url, replica)), url))
+
+        points.sort()
+
+        self._points = [point for point, url in points]
+        self._owners = [url for point, url in points]
+
+    def __len__(self):
+        return len(self.urls)
+
+    def url_for(self, id_):
+        """
+        Return the url of the shard id_ belongs to.
+        """
+        index = bisect.bisect_left(self._points, _hash(id_))
+
+        # past the last point; wrap around
+        if index == len(self._points):
+            index = 0
+
+        return self._owners[index]
+
+    def connection(self, url):
+        """
+        Return a StrictRedis connection for one of the shard urls, reusing
+        it after the first call.
+        """
+        if url not in self._connections:
+            self._connections[url] = redis.StrictRedis.from_url(url)
+
+        return self._connections[url]
+
+    def connection_for(self, id_):
+        """
+        Return a StrictRedis connection to the shard id_ belongs to.
+        """
+        return self.connection(self.url_for(id_))
+
+    @property
+    def connections(self):
+        """
+        A connection to each shard, in the order the urls were given.
+        """
+        return [self.connection(url) for url in self.urls]
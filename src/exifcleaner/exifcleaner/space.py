@@ -0,0 +1,132 @@
+"""
+Disk space accounting and early eviction.
+
+The bytes used by each id's files, and the last time any of them was
+downloaded, are kept in redis. When the total goes over the high-water mark,
+the least recently downloaded ids are removed early, before the expiry
+sweeper would have got to them, until usage falls below the low-water mark.
+
+Only processed ids can be evicted; an upload that is still waiting for a
+worker is counted, but never removed from under it.
+"""
+
+import time
+from . import util
+
+class SpaceManager:
+    """
+    redis - a StrictRedis connection.
+    layout - a storage layout, used to remove files. Only needed for evict().
+    high_water - integer, bytes; evict once usage goes above this. None
+                 turns eviction off.
+    low_water - integer, bytes; evict down to this. Defaults to 80% of the
+                high-water mark.
+    """
+    sizes = "exif:space:bytes"
+    access = "exif:space:access"
+    total = "exif:space:total"
+
+    def __init__(self, redis, layout=None, high_water=None, low_water=None):
+        self.redis = redis
+        self.layout = layout
+        self.high_water = high_water
+
+        if low_water is None and high_water is not None:
+            low_water = int(high_water * 0.8)
+
+        self.low_water = low_water
+
+    def usage(self):
+        """
+        Return the number of bytes currently used.
+        """
+        return int(self.redis.get(self.total) or 0)
+
+    def track(self, id_, nbytes, evictable=False):
+        """
+        Record that id_ now uses nbytes on disk. If evictable is True, the id
+        becomes a candidate for early eviction; call this with evictable=True
+        once processing is done.
+        """
+        old = int(self.redis.hget(self.sizes, id_) or 0)
+
+        with self.redis.pipeline() as pipe:
+            pipe.hset(self.sizes, id_, nbytes)
+            pipe.incrby(self.total, nbytes - old)
+            if evictable:
+                pipe.execute_command("ZADD", self.access, time.time(), id_)
+            pipe.execute()
+
+    def touch(self, id_):
+        """
+        Mark id_ as just downloaded. Ids that are not evictable are ignored.
+        """
+        self.redis.execute_command("ZADD", self.access, "XX", time.time(), id_)
+
+    def forget(self, ids):
+        """
+        Stop tracking the given ids; call after their files are removed.
+        """
+        if not ids:
+            return
+
+        sizes = self.redis.hmget(self.sizes, ids)
+
+        with self.redis.pipeline() as pipe:
+            pipe.hdel(self.sizes, *ids)
+            pipe.zrem(self.access, *ids)
+            pipe.decrby(self.total, sum(int(size or 0) for size in sizes))
+            pipe.execute()
+
+    def evict(self, target, batch=50):
+        """
+        Remove least recently downloaded ids until usage is at or below target
+        bytes, or there is nothing left to evict.
+
+        Returns the list of ids removed.
+        """
+        evicted = []
+
+        while self.usage() > target:
+            candidates = self.redis.zrange(self.access, 0, batch - 1)
+
+            if not candidates:
+                break
+
+            for id_ in candidates:
+                # only one process gets to evict each id
+                if not self.redis.zrem(self.access, id_):
+                    continue
+
+                if isinstance(id_, bytes):
+                    id_ = id_.decode("utf-8")
+
+                print("Evicting {}".format(id_))
+
+                self.layout.remove(id_)
+                self.forget([id_])
+                evicted.append(id_)
+
+                if self.usage() <= target:
+                    break
+
+        return evicted
+
+    def reserve(self, nbytes):
+        """
+        Make room for an upload of nbytes. Evicts old files if usage would go
+        over the high-water mark.
+
+        Raises util.web.BackEndTrouble (503) if enough space can not be
+        recovered.
+        """
+        if self.high_water is None:
+            return
+
+        if self.usage() + nbytes <= self.high_water:
+            return
+
+        self.evict(max(self.low_water - nbytes, 0))
+
+        if self.usage() + nbytes > self.high_water:
+            raise util.web.BackEndTrouble("Out of space. Please try your request again later", code=503)
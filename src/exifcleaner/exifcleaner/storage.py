@@ -0,0 +1,287 @@
+"""
+Layout of uploaded images and their artifacts on disk.
+
+Each id has up to three files: <id>.jpg, <id>.json and <id>.thumb.jpg. The
+layout classes decide which directory under data_dir those files live in,
+how /data/<name> requests map to them, and how they are removed when they
+expire.
+
+FlatLayout - everything lives directly in data_dir.
+WindowedLayout - files live in a subdirectory per expiry window, e.g.
+                 data_dir/202610161210/, so expiring a window is a single
+                 directory drop.
+ShardedLayout - files live in a two level tree named after a hash of the id,
+                e.g. data_dir/ab/cd/, so no directory gets too big when files
+                are kept for a long time.
+"""
+
+import hashlib
+import os
+import shutil
+import time
+from . import errors
+
+WINDOW_FORMAT = "%Y%m%d%H%M"
+
+def artifact_names(id_):
+    """
+    Return the names of every file that can be created for an id.
+    """
+    return ["{}.jpg".format(id_), "{}.thumb.jpg".format(id_), "{}.json".format(id_)]
+
+def id_from_name(name):
+    """
+    Return the id for an artifact file name (e.g. "abc.thumb.jpg" -> "abc")
+    """
+    return os.path.basename(name).split(".", 1)[0]
+
+def remove_files(ids, directory):
+    """
+    Remove all of the files for the given ids. Missing files are ignored.
+
+    Returns the number of files removed.
+    """
+    count = 0
+
+    for id_ in ids:
+        for name in artifact_names(id_):
+            try:
+                os.remove(os.path.join(directory, name))
+                count += 1
+            except FileNotFoundError:
+                pass
+
+    return count
+
+def file_etag(path, block_size=65536):
+    """
+    Return a strong ETag (quoted, as it goes in the header) for the contents
+    of the file at path.
+    """
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as fp:
+        for block in iter(lambda: fp.read(block_size), b""):
+            digest.update(block)
+
+    return '"{}"'.format(digest.hexdigest()[:32])
+
+def window_name(bucket):
+    """
+    Return the directory name for the window that ends at the unix
+    timestamp `bucket`.
+    """
+    return time.strftime(WINDOW_FORMAT, time.gmtime(bucket))
+
+def shard_name(id_):
+    """
+    Return the relative directory for an id in the sharded layout (e.g. ab/cd)
+    """
+    digest = hashlib.sha1(id_.encode("utf-8")).hexdigest()
+
+    return os.path.join(digest[0:2], digest[2:4])
+
+def directory_for(data_dir, window=None, id_=None, sharded=False):
+    """
+    Return the directory a worker should look in for an upload. `window` and
+    `sharded` are the values the layout's assign() handed to the job, if any.
+    """
+    if window is not None:
+        return os.path.join(data_dir, window_name(window))
+    elif sharded:
+        return os.path.join(data_dir, shard_name(id_))
+    else:
+        return data_dir
+
+class FlatLayout:
+    """
+    All files are stored directly in data_dir.
+    """
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+
+    def assign(self, id_, expires_at):
+        """
+        Pick a location for a new upload that should expire at the unix
+        timestamp `expires_at`.
+
+        Returns a dictionary of extra keyword arguments to pass to
+        jobs.process() so the worker can find the files.
+        """
+        return {}
+
+    def directory(self, id_):
+        """
+        Return the directory holding the files for id_, or None if it is not
+        known.
+        """
+        return self.data_dir
+
+    def resolve(self, path_info):
+        """
+        Map a request path relative to /data (e.g. /abc.jpg) to a path relative
+        to data_dir.
+        """
+        return path_info
+
+    def remove(self, id_):
+        """
+        Remove all of the files for a single id.
+        """
+        directory = self.directory(id_)
+
+        if directory is not None:
+            remove_files([id_], directory)
+
+    def expire(self, bucket, ids):
+        """
+        Remove everything in an expired bucket. Called by the expiry sweeper.
+        """
+        remove_files(ids, self.data_dir)
+
+    def keys(self, ids):
+        """
+        Return any redis keys that should be removed along with the files.
+        """
+        return []
+
+class WindowedLayout(FlatLayout):
+    """
+    Files are stored in one subdirectory per expiry window. The window size
+    must match the bucket size of the expiry sweeper, so each sweeper bucket
+    is exactly one directory.
+
+    The window each id was put in is kept in redis, so requests can be routed
+    to the correct directory without scanning.
+    """
+    prefix = "exif:window"
+
+    def __init__(self, data_dir, redis, window=600):
+        FlatLayout.__init__(self, data_dir)
+        self.redis = redis
+        self.window = window
+
+    def key(self, id_):
+        return "{}:{}".format(self.prefix, id_)
+
+    def bucket_for(self, when):
+        """
+        Return the end of the window that contains the unix timestamp `when`.
+        """
+        return int(-(-when // self.window) * self.window)
+
+    def window_dir(self, bucket):
+        return directory_for(self.data_dir, bucket)
+
+    def assign(self, id_, expires_at):
+        bucket = self.bucket_for(expires_at)
+
+        os.makedirs(self.window_dir(bucket), exist_ok=True)
+
+        # keep the mapping until shortly after the window is removed.
+        self.redis.set(self.key(id_), window_name(bucket), ex=int(bucket - time.time()) + self.window)
+
+        return {'window': bucket}
+
+    def directory(self, id_):
+        name = self.redis.get(self.key(id_))
+
+        if name is None:
+            return None
+
+        if isinstance(name, bytes):
+            name = name.decode("utf-8")
+
+        return os.path.join(self.data_dir, name)
+
+    def resolve(self, path_info):
+        if path_info.count("/") != 1:
+            # already points inside a window, or somewhere else entirely
+            return path_info
+
+        name = self.redis.get(self.key(id_from_name(path_info)))
+
+        if name is None:
+            return path_info
+
+        if isinstance(name, bytes):
+            name = name.decode("utf-8")
+
+        return "/{}{}".format(name, path_info)
+
+    def expire(self, bucket, ids):
+        """
+        Drop the whole window directory. It is renamed first, so it
+        disappears from view in one step even if there are a lot of files
+        in it.
+        """
+        path = self.window_dir(bucket)
+        trash = os.path.join(self.data_dir, ".expired-{}".format(window_name(bucket)))
+
+        try:
+            os.rename(path, trash)
+        except FileNotFoundError:
+            return
+
+        shutil.rmtree(trash, ignore_errors=True)
+
+    def keys(self, ids):
+        return [self.key(id_) for id_ in ids]
+
+class ShardedLayout(FlatLayout):
+    """
+    Files are stored in data_dir/ab/cd/, where abcd are the first four hex
+    digits of the sha1 of the id. 65536 leaf directories keep each one down
+    to a few thousand entries, even with hundreds of millions of files.
+
+    Paths are computed from the id alone, so nothing is kept in redis.
+
+    fallback - if True, files that are not in the sharded tree are looked for
+               directly in data_dir. Turn this on while an existing flat
+               data_dir is being migrated (see exifcleaner.migrate).
+    """
+    def __init__(self, data_dir, fallback=False):
+        FlatLayout.__init__(self, data_dir)
+        self.fallback = fallback
+
+    def assign(self, id_, expires_at):
+        os.makedirs(self.directory(id_), exist_ok=True)
+
+        return {'sharded': True}
+
+    def directory(self, id_):
+        return directory_for(self.data_dir, id_=id_, sharded=True)
+
+    def resolve(self, path_info):
+        if path_info.count("/") != 1:
+            return path_info
+
+        resolved = "/{}{}".format(shard_name(id_from_name(path_info)), path_info)
+
+        if self.fallback and not os.path.exists(self.data_dir + resolved):
+            return path_info
+
+        return resolved
+
+    def remove(self, id_):
+        remove_files([id_], self.directory(id_))
+
+        if self.fallback:
+            remove_files([id_], self.data_dir)
+
+    def expire(self, bucket, ids):
+        for id_ in ids:
+            self.remove(id_)
+
+def make_layout(kind, data_dir, redis=None, window=600, fallback=False):
+    """
+    Factory - create a layout by name ("flat", "windowed" or "sharded").
+    """
+    if kind == "flat":
+        return FlatLayout(data_dir)
+    elif kind == "windowed":
+        return WindowedLayout(data_dir, redis, window=window)
+    elif kind == "sharded":
+        return ShardedLayout(data_dir, fallback=fallback)
+    else:
+        raise errors.ExifCleanerConfigError("Unknown layout '{}'".format(kind))
@@ -0,0 +1,76 @@
+"""
+Tests For Admission Control
+"""
+import pytest
+from exifcleaner import util
+from exifcleaner.admission import AdmissionController
+
+class FixedController(AdmissionController):
+    """
+    Reports fixed queue numbers instead of asking redis, and counts how often
+    it was asked.
+    """
+    def __init__(self, depth, age, **kwargs):
+        AdmissionController.__init__(self, None, [], **kwargs)
+        self.measured = (depth, age)
+        self.calls = 0
+
+    def _measure(self):
+        self.calls += 1
+        return self.measured
+
+def test_disabled():
+    controller = FixedController(1000, 1000)
+
+    controller.check()
+
+    assert controller.calls == 0
+
+def test_under_limits():
+    controller = FixedController(5, 2.0, max_depth=10, max_age=30)
+
+    controller.check()
+
+def test_too_deep():
+    controller = FixedController(40, 20.0, max_depth=20)
+
+    with pytest.raises(util.web.TooBusy) as info:
+        controller.check()
+
+    # 21 jobs to get through before there is room, at half a second each
+    assert info.value.retry_after == 11
+    assert info.value.code == 503
+
+def test_at_the_limit():
+    controller = FixedController(20, 60.0, max_depth=20)
+
+    with pytest.raises(util.web.TooBusy) as info:
+        controller.check()
+
+    # one job to go, at three seconds each
+    assert info.value.retry_after == 3
+
+def test_too_old():
+    controller = FixedController(5, 42.5, max_age=30, code=429)
+
+    with pytest.raises(util.web.TooBusy) as info:
+        controller.check()
+
+    assert info.value.retry_after == 13
+    assert info.value.code == 429
+
+def test_retry_after_is_capped():
+    controller = FixedController(5, 5000, max_age=30, max_retry=120)
+
+    with pytest.raises(util.web.TooBusy) as info:
+        controller.check()
+
+    assert info.value.retry_after == 120
+
+def test_numbers_are_cached():
+    controller = FixedController(5, 2.0, max_depth=10, refresh=60)
+
+    for i in range(10):
+        controller.check()
+
+    assert controller.calls == 1
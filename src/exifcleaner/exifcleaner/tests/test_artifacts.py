@@ -0,0 +1,98 @@
+"""
+Tests For Serving Artifacts
+"""
+import pytest
+from webob import Request
+from exifcleaner import errors
+from exifcleaner.artifacts import ArtifactService
+from exifcleaner.storage import FlatLayout
+
+DATA = bytes(range(256)) * 40
+
+@pytest.fixture()
+def app(tmp_path):
+    (tmp_path / "abc.jpg").write_bytes(DATA)
+    (tmp_path / ".hidden").write_bytes(b"secret")
+
+    return ArtifactService(str(tmp_path), FlatLayout(str(tmp_path)))
+
+def get(app, path="/data/abc.jpg", **kw):
+    return Request.blank(path, **kw).get_response(app)
+
+def test_whole_file(app):
+    response = get(app)
+
+    assert response.status_code == 200
+    assert response.body == DATA
+    assert response.content_type == "image/jpeg"
+    assert response.headers['Accept-Ranges'] == "bytes"
+    assert response.headers['ETag'].startswith('W/"')
+
+def test_not_found(app):
+    assert get(app, "/data/missing.jpg").status_code == 404
+    assert get(app, "/data/.hidden").status_code == 404
+    assert get(app, "/data/../abc.jpg").status_code == 404
+    assert get(app, "/data/").status_code == 404
+
+def test_method(app):
+    assert get(app, method="POST").status_code == 405
+
+def test_head(app):
+    response = get(app, method="HEAD")
+
+    assert response.status_code == 200
+    assert response.headers['Content-Length'] == str(len(DATA))
+    assert response.body == b""
+
+def test_if_none_match(app):
+    etag = get(app).headers['ETag']
+
+    response = get(app, headers={'If-None-Match': '"other", {}'.format(etag)})
+
+    assert response.status_code == 304
+    assert response.body == b""
+
+@pytest.mark.parametrize("header,start,end", [
+    ("bytes=0-99", 0, 100),
+    ("bytes=100-", 100, len(DATA)),
+    ("bytes=-50", len(DATA) - 50, len(DATA)),
+    ("bytes=10000-20000", 10000, len(DATA))
+])
+def test_ranges(app, header, start, end):
+    response = get(app, headers={'Range': header})
+
+    assert response.status_code == 206
+    assert response.body == DATA[start:end]
+    assert response.headers['Content-Range'] == "bytes {}-{}/{}".format(start, end - 1, len(DATA))
+
+def test_unsatisfiable_range(app):
+    response = get(app, headers={'Range': "bytes=20000-"})
+
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == "bytes */{}".format(len(DATA))
+
+def test_multiple_ranges_send_everything(app):
+    response = get(app, headers={'Range': "bytes=0-1,5-6"})
+
+    assert response.status_code == 200
+    assert response.body == DATA
+
+def test_if_range_with_a_weak_etag_sends_everything(app):
+    etag = get(app).headers['ETag']
+
+    response = get(app, headers={'Range': "bytes=0-1", 'If-Range': etag})
+
+    assert response.status_code == 200
+
+def test_accel_redirect(tmp_path, app):
+    app = ArtifactService(str(tmp_path), FlatLayout(str(tmp_path)), sendfile="x-accel-redirect")
+
+    response = get(app)
+
+    assert response.status_code == 200
+    assert response.headers['X-Accel-Redirect'] == "/protected-data/abc.jpg"
+    assert response.body == b""
+
+def test_bad_sendfile(tmp_path):
+    with pytest.raises(errors.ExifCleanerConfigError):
+        ArtifactService(str(tmp_path), FlatLayout(str(tmp_path)), sendfile="magic")
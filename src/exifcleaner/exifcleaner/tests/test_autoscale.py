@@ -0,0 +1,122 @@
+"""
+Tests For The Worker Autoscaler
+"""
+import pytest
+import itertools
+from exifcleaner import autoscale, errors
+from exifcleaner.autoscale import ScalingPolicy, Sample, Simulation, WorkerPool
+
+def busy(t):
+    return Sample(t, depth=100, latency=30.0, cpu=0.2, busy=1)
+
+def idle(t):
+    return Sample(t, depth=0, latency=0.0, cpu=0.1, busy=0)
+
+def test_scales_up_after_consecutive_samples():
+    policy = ScalingPolicy(min_workers=1, max_workers=4, up_after=2, cooldown=0)
+
+    assert policy.decide(busy(0), 1) == 1
+    assert policy.decide(busy(5), 1) == 2
+
+def test_blip_does_not_scale():
+    policy = ScalingPolicy(min_workers=1, max_workers=4, up_after=2, cooldown=0)
+
+    assert policy.decide(busy(0), 1) == 1
+    assert policy.decide(idle(5), 1) == 1
+    assert policy.decide(busy(10), 1) == 1
+
+def test_cooldown():
+    policy = ScalingPolicy(min_workers=1, max_workers=4, up_after=1, cooldown=30)
+
+    assert policy.decide(busy(0), 1) == 2
+    assert policy.decide(busy(10), 2) == 2
+    assert policy.decide(busy(31), 2) == 3
+
+def test_no_scale_up_when_cpu_bound():
+    policy = ScalingPolicy(min_workers=1, max_workers=4, up_after=1, cooldown=0, max_cpu=0.9)
+
+    assert policy.decide(Sample(0, 100, 30.0, 0.95, 2), 2) == 2
+
+def test_scale_down_slowly():
+    policy = ScalingPolicy(min_workers=1, max_workers=4, down_after=3, cooldown=0)
+
+    assert policy.decide(idle(0), 3) == 3
+    assert policy.decide(idle(5), 3) == 3
+    assert policy.decide(idle(10), 3) == 2
+
+def test_busy_workers_are_kept():
+    """
+    An empty queue doesn't mean the workers can go, if they are what is
+    keeping it empty.
+    """
+    policy = ScalingPolicy(min_workers=1, max_workers=4, down_after=1, cooldown=0)
+
+    assert policy.decide(Sample(0, 0, 0.0, 0.5, 3), 3) == 3
+    assert policy.decide(Sample(5, 0, 0.0, 0.5, 1), 3) == 2
+
+def test_bounds():
+    policy = ScalingPolicy(min_workers=2, max_workers=4)
+
+    assert policy.decide(idle(0), 0) == 2
+    assert policy.decide(idle(0), 10) == 4
+
+    with pytest.raises(errors.ExifCleanerConfigError):
+        ScalingPolicy(min_workers=5, max_workers=4)
+
+    with pytest.raises(errors.ExifCleanerConfigError):
+        ScalingPolicy(up_depth=1, down_depth=1)
+
+def test_simulated_spike():
+    """
+    A load spike is met with more workers, which go away again once it has
+    been dealt with, without flapping in between.
+    """
+    policy = ScalingPolicy(min_workers=1, max_workers=4, cooldown=10)
+    spike = lambda t: 6 if 100 <= t < 300 else 0.5
+
+    history = Simulation(policy, spike, service_time=0.5, cores=4).run(1200)
+    workers = [count for sample, count in history]
+
+    assert max(workers) == 4
+    assert workers[0] == 1
+    assert workers[-1] == 1
+
+    changes = sum(1 for a, b in zip(workers, workers[1:]) if a != b)
+    assert changes <= 6
+
+class FakeProcess:
+    pids = itertools.count(100)
+
+    def __init__(self, args):
+        self.args = args
+        self.pid = next(self.pids)
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def send_signal(self, signum):
+        self.returncode = -signum
+
+def test_workers_spread_over_shards(monkeypatch):
+    monkeypatch.setattr(autoscale.subprocess, "Popen", FakeProcess)
+
+    pool = WorkerPool(["fast"], "redis://a", shard_urls=["redis://a", "redis://b"])
+
+    def urls():
+        return sorted(process.args[process.args.index("--url") + 1] for process in pool.processes)
+
+    pool.resize(3)
+    assert urls() == ["redis://a", "redis://a", "redis://b"]
+
+    # the worker on b dies; its replacement goes back to b
+    [process for process in pool.processes if "redis://b" in process.args][0].returncode = 1
+    pool.resize(3)
+    assert urls() == ["redis://a", "redis://a", "redis://b"]
+
+    pool.resize(1)
+    assert urls() == ["redis://a"]
+
+def test_every_shard_needs_a_worker():
+    with pytest.raises(SystemExit):
+        autoscale.main(["--redis-url", "redis://a", "--shard-urls", "redis://b", "--min", "1", "fast"])
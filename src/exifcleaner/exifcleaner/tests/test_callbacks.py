@@ -0,0 +1,199 @@
+"""
+Tests For Completion Callbacks
+
+A local http.server stands in for the client.
+"""
+import pytest
+import os
+import json
+import socket
+import threading
+import urllib.error
+import redis
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from rq import Queue, SimpleWorker
+from rq_scheduler import Scheduler
+from exifcleaner import callbacks
+from exifcleaner import errors
+from . import util as testutil
+
+class Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+
+        self.server.received.append(json.loads(body.decode("utf-8")))
+        self.server.hosts.append(self.headers['Host'])
+        self.send_response(self.server.code)
+
+        if self.server.location:
+            self.send_header("Location", self.server.location)
+
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture()
+def client():
+    server = HTTPServer(("127.0.0.1", 0), Handler)
+    server.received = []
+    server.hosts = []
+    server.code = 200
+    server.location = None
+    server.url = "http://127.0.0.1:{}/done".format(server.server_port)
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+# the test server is on loopback, which callbacks refuse unless told otherwise
+LOCAL = ["127.0.0.0/8"]
+
+def test_valid():
+    assert callbacks.valid("https://93.184.216.34/hook?x=1")
+    assert callbacks.valid("http://[2606:2800:220:1::]:8080/")
+    assert not callbacks.valid("ftp://93.184.216.34/")
+    assert not callbacks.valid("file:///etc/passwd")
+    assert not callbacks.valid("example.com/hook")
+    assert not callbacks.valid("http://93.184.216.34:99999/")
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1:8000/",
+    "http://localhost/",
+    "http://[::1]/",
+    "http://[::ffff:127.0.0.1]/",
+    "http://0.0.0.0/",
+    "http://10.1.2.3/",
+    "http://172.16.0.1/",
+    "http://192.168.1.1/",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://[fe80::1]/",
+    "http://[fd00::1]/",
+    "http://224.0.0.1/",
+])
+def test_non_public_hosts(url):
+    assert not callbacks.valid(url)
+
+def test_allow():
+    assert callbacks.valid("http://127.0.0.1:8000/", LOCAL)
+    assert callbacks.valid("http://10.1.2.3/", ["10.0.0.0/8"])
+    assert not callbacks.valid("http://10.1.2.3/", LOCAL)
+
+def test_post(client):
+    assert callbacks.post(client.url, {'id': "abc"}, allow=LOCAL) == 200
+    assert client.received == [{'id': "abc"}]
+
+def test_post_refuses_non_public_hosts(client):
+    with pytest.raises(errors.ExifCleanerInputError):
+        callbacks.post(client.url, {'id': "abc"})
+
+    assert client.received == []
+
+def test_post_error(client):
+    client.code = 500
+
+    with pytest.raises(urllib.error.HTTPError):
+        callbacks.post(client.url, {'id': "abc"}, allow=LOCAL)
+
+def test_redirects_are_not_followed(client):
+    client.code = 302
+    client.location = client.url + "?again"
+
+    with pytest.raises(urllib.error.HTTPError):
+        callbacks.post(client.url, {'id': "abc"}, allow=LOCAL)
+
+    assert len(client.received) == 1
+
+def test_rebinding_is_refused(client, monkeypatch):
+    """
+    The host is checked when the upload comes in, and switched to loopback
+    by the time the callback connects.
+    """
+    port = client.server_port
+    answers = [
+        [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, "", ("93.184.216.34", port))],
+        [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, "", ("127.0.0.1", port))]
+    ]
+
+    monkeypatch.setattr(socket, "getaddrinfo", lambda *args, **kwargs: answers.pop(0) if len(answers) > 1 else answers[0])
+
+    with pytest.raises(errors.ExifCleanerInputError):
+        callbacks.post("http://hook.example.com:{}/done".format(port), {'id': "abc"})
+
+    assert client.received == []
+
+def test_checked_address_is_used(client, monkeypatch):
+    """
+    The connection goes to the address that was checked, with the name
+    still in the Host header.
+    """
+    hosts = []
+    real = socket.getaddrinfo
+
+    def getaddrinfo(host, *args, **kwargs):
+        hosts.append(host)
+
+        return real("127.0.0.1" if host == "hook.example.com" else host, *args, **kwargs)
+
+    monkeypatch.setattr(socket, "getaddrinfo", getaddrinfo)
+
+    url = "http://hook.example.com:{}/done".format(client.server_port)
+
+    assert callbacks.post(url, {'id': "abc"}, allow=LOCAL) == 200
+    assert client.received == [{'id': "abc"}]
+    assert client.hosts == ["hook.example.com:{}".format(client.server_port)]
+
+    # once for the url, once for the connection; never again for the socket
+    assert hosts == ["hook.example.com", "hook.example.com", "127.0.0.1"]
+
+@pytest.fixture()
+def conn():
+    conn = redis.StrictRedis.from_url(os.environ.get("EXIFCLEANER_REDIS_URL", "redis://127.0.0.1:6379"))
+    conn.flushdb()
+
+    yield conn
+
+    conn.flushdb()
+
+@pytest.mark.skipif(not testutil.check_redis(), reason="Redis must be available. Set EXIFCLEANER_REDIS_URL to change from default local server")
+def test_delivery(client, conn):
+    callback = {'url': client.url, 'queue': "test-callbacks", 'allow': LOCAL}
+
+    callbacks.notify(callback, {'id': "abc", 'status': "finished"}, conn)
+
+    SimpleWorker([Queue("test-callbacks", connection=conn)], connection=conn).work(burst=True)
+
+    assert client.received == [{'id': "abc", 'status': "finished"}]
+
+@pytest.mark.skipif(not testutil.check_redis(), reason="Redis must be available. Set EXIFCLEANER_REDIS_URL to change from default local server")
+def test_failed_delivery_is_retried(client, conn):
+    client.code = 503
+    callback = {'url': client.url, 'queue': "test-callbacks", 'allow': LOCAL}
+
+    callbacks.notify(callback, {'id': "abc"}, conn)
+
+    SimpleWorker([Queue("test-callbacks", connection=conn)], connection=conn).work(burst=True)
+
+    assert len(client.received) == 1
+
+    retries = list(Scheduler(queue_name="test-callbacks", connection=conn).get_jobs())
+
+    assert len(retries) == 1
+    assert retries[0].args[2] == 2
+    assert list(retries[0].args[5]) == LOCAL
+
+@pytest.mark.skipif(not testutil.check_redis(), reason="Redis must be available. Set EXIFCLEANER_REDIS_URL to change from default local server")
+def test_refused_delivery_is_not_retried(client, conn):
+    callback = {'url': client.url, 'queue': "test-callbacks"}
+
+    callbacks.notify(callback, {'id': "abc"}, conn)
+
+    SimpleWorker([Queue("test-callbacks", connection=conn)], connection=conn).work(burst=True)
+
+    assert client.received == []
+    assert list(Scheduler(queue_name="test-callbacks", connection=conn).get_jobs()) == []
@@ -0,0 +1,127 @@
+"""
+Tests For The Local Cleaning Command
+"""
+import pytest
+import io
+import os
+import shutil
+import piexif
+from exifcleaner import cli
+from exifcleaner import errors
+
+MEDIA = os.path.join(os.path.dirname(__file__), "..", "..", "..", "..", "functional_tests", "media", "shadows.jpg")
+# has exif data, but no thumbnail
+NO_THUMB = os.path.join(os.path.dirname(__file__), "..", "..", "..", "..", "functional_tests", "test-file.jpg")
+
+@pytest.fixture()
+def tree(tmp_path):
+    (tmp_path / "a" / "b").mkdir(parents=True)
+
+    for name in ["one.jpg", "a/two.JPG", "a/b/three.jpeg"]:
+        shutil.copyfile(MEDIA, str(tmp_path / name))
+
+    (tmp_path / "a" / "notes.txt").write_text("not an image")
+    (tmp_path / "a" / "old.thumb.jpg").write_bytes(b"")
+
+    return tmp_path
+
+def test_walk(tree):
+    found = sorted(relative for path, relative in cli.walk(str(tree)))
+
+    assert found == ["a/b/three.jpeg", "a/two.JPG", "one.jpg"]
+
+def test_discover_stdin(tree):
+    stdin = io.StringIO("{}\n\n".format(tree / "one.jpg"))
+
+    assert list(cli.discover(["-"], stdin=stdin)) == [(str(tree / "one.jpg"), str(tree / "one.jpg").lstrip(os.sep))]
+
+def test_in_place(tree):
+    stats = cli.run([str(tree)], processes=2)
+
+    assert stats['files'] == 3
+    assert stats['failed'] == 0
+    assert stats['bytes'] == 3 * os.path.getsize(MEDIA)
+    assert (tree / "a" / "b" / "three.json").exists()
+    assert not piexif.load(str(tree / "one.jpg"))['Exif']
+
+def test_mirror(tree, tmp_path_factory):
+    output = tmp_path_factory.mktemp("output")
+    before = (tree / "a" / "two.JPG").read_bytes()
+
+    stats = cli.run([str(tree)], output=str(output), processes=2)
+
+    assert stats['files'] == 3
+    assert (tree / "a" / "two.JPG").read_bytes() == before
+    # under the name of the directory given
+    assert (output / tree.name / "a" / "two.json").exists()
+    assert not piexif.load(str(output / tree.name / "a" / "two.JPG"))['Exif']
+
+def test_failures_are_counted(tree):
+    (tree / "broken.jpg").write_bytes(b"not really a jpeg")
+
+    stats = cli.run([str(tree)], processes=1)
+
+    assert stats['files'] == 3
+    assert stats['failed'] == 1
+
+def test_no_thumbnail(tmp_path):
+    shutil.copyfile(NO_THUMB, str(tmp_path / "plain.jpg"))
+
+    stats = cli.run([str(tmp_path)], processes=1)
+
+    assert stats['failed'] == 0
+    assert sorted(os.listdir(str(tmp_path))) == ["plain.jpg", "plain.json"]
+
+def test_failures_name_the_original(tmp_path_factory):
+    source = tmp_path_factory.mktemp("source")
+    output = tmp_path_factory.mktemp("output")
+    (source / "broken.jpg").write_bytes(b"not really a jpeg")
+
+    path, size, error = cli.clean_one((str(source / "broken.jpg"), "broken.jpg", str(output)))
+
+    assert path == str(source / "broken.jpg")
+    assert error
+
+def test_mirror_keeps_sources_apart(tmp_path_factory):
+    first = tmp_path_factory.mktemp("first")
+    second = tmp_path_factory.mktemp("second")
+    output = tmp_path_factory.mktemp("output")
+
+    for root in (first, second):
+        (root / "named").mkdir()
+        shutil.copyfile(MEDIA, str(root / "a.jpg"))
+        shutil.copyfile(MEDIA, str(root / "named" / "b.jpg"))
+
+    named = [str(first / "named" / "b.jpg"), str(second / "named" / "b.jpg")]
+
+    stats = cli.run([str(first), str(second)] + named, output=str(output), processes=2)
+
+    assert stats['files'] == 6
+    assert stats['failed'] == 0
+
+    for root in (first, second):
+        assert (output / root.name / "a.jpg").exists()
+        assert (output / root.name / "a.json").exists()
+
+    for path in named:
+        assert os.path.exists(os.path.join(str(output), path.lstrip(os.sep)))
+
+def test_mirror_refuses_clashes(tmp_path_factory):
+    output = tmp_path_factory.mktemp("output")
+    first = tmp_path_factory.mktemp("first") / "photos"
+    second = tmp_path_factory.mktemp("second") / "photos"
+
+    for root in (first, second):
+        root.mkdir()
+        shutil.copyfile(MEDIA, str(root / "a.jpg"))
+
+    with pytest.raises(errors.ExifCleanerConfigError):
+        cli.run([str(first), str(second)], output=str(output), processes=1)
+
+    assert os.listdir(str(output)) == []
+
+    # the same file twice (or a file inside a directory that is also given)
+    stats = cli.run([str(first), str(first / "a.jpg"), str(first / "a.jpg")], output=str(output), processes=1)
+
+    assert stats['files'] == 2
+    assert stats['failed'] == 1
@@ -0,0 +1,117 @@
+"""
+Tests For The Code And User Services
+"""
+import pytest
+import os
+import base64
+import redis
+from webob import Request
+from . import util as testutil
+
+pytestmark = pytest.mark.skipif(not testutil.check_redis(), reason="Redis must be available. Set EXIFCLEANER_REDIS_URL to change from default local server")
+
+REDIS_URL = os.environ.get("EXIFCLEANER_REDIS_URL", "redis://127.0.0.1:6379")
+
+# the services are imported in the tests, like in test_codemanager: the code
+# schema picks up udatetime.now when it is imported, and test_code_class 
+# patches that first
+
+@pytest.fixture()
+def users():
+    from exifcleaner.user.manager import UserManager
+
+    conn = redis.StrictRedis.from_url(REDIS_URL)
+    conn.flushdb()
+
+    manager = UserManager(redis_url=REDIS_URL)
+    manager.add(username="admin", password="sekrit", email="admin@example.com", admin=True, activated=True)
+    manager.add(username="alice", password="wonderland", email="alice@example.com")
+    manager.add(username="bob", password="builder", email="bob@example.com")
+
+    yield manager
+
+    conn.flushdb()
+
+def call(app, path, method="GET", user=None, **kwargs):
+    headers = {}
+
+    if user is not None:
+        headers['Authorization'] = "Basic " + base64.b64encode(":".join(user).encode("utf-8")).decode("ascii")
+
+    return Request.blank(path, method=method, headers=headers, **kwargs).get_response(app)
+
+ADMIN = ("admin", "sekrit")
+ALICE = ("alice", "wonderland")
+BOB = ("bob", "builder")
+
+def test_codes(users):
+    from exifcleaner.codes.wsgi import CodeService
+
+    service = CodeService(redis_url=REDIS_URL)
+
+    assert call(service, "/codes", "POST", POST={'username': "alice"}).status_int == 401
+    assert call(service, "/codes", "POST", user=ALICE, POST={'username': "alice"}).status_int == 401
+
+    response = call(service, "/codes", "POST", user=ADMIN, POST={'username': "alice"})
+
+    assert response.status_int == 200
+
+    code = response.json_body['code']
+
+    assert call(service, "/code/{}".format(code), user=ADMIN).json_body['user'] == users.get("alice").id
+
+    listing = call(service, "/codes", user=ADMIN).json_body
+
+    assert [item['code'] for item in listing['codes']] == [code]
+
+    # only the user the code was made for can use it
+    assert call(service, "/use/{}".format(code), user=BOB).json_body == {'errno': 1101}
+    assert call(service, "/use/{}".format(code), user=("alice", "guess")).status_int == 401
+
+    response = call(service, "/use/{}".format(code), user=ALICE)
+
+    assert response.status_int == 200
+    assert response.json_body is True
+
+    # single use
+    assert call(service, "/use/{}".format(code), user=ALICE).status_int == 404
+    assert call(service, "/code/{}".format(code), user=ADMIN).status_int == 404
+
+def test_delete_code(users):
+    from exifcleaner.codes.wsgi import CodeService
+
+    service = CodeService(redis_url=REDIS_URL)
+
+    code = call(service, "/codes", "POST", user=ADMIN, POST={'username': "bob"}).json_body['code']
+
+    assert call(service, "/code/{}".format(code), "DELETE", user=BOB).status_int == 401
+    assert call(service, "/code/{}".format(code), "DELETE", user=ADMIN).status_int == 200
+    assert call(service, "/code/{}".format(code), "DELETE", user=ADMIN).status_int == 404
+    assert call(service, "/codes", "POST", user=ADMIN, POST={'username': "nobody"}).json_body == {'errno': 1002}
+
+@pytest.mark.parametrize("method, path", [
+    ("GET", "/users"),
+    ("POST", "/users"),
+    ("GET", "/user/alice"),
+    ("PUT", "/user/alice"),
+    ("DELETE", "/user/alice"),
+])
+def test_unfinished_user_routes(users, method, path):
+    from exifcleaner.user.wsgi import UserService
+
+    service = UserService(redis_url=REDIS_URL)
+
+    assert call(service, path, method).status_int == 401
+    assert call(service, path, method, user=ALICE).status_int == 401
+    assert call(service, path, method, user=ADMIN).status_int == 501
+    assert users.exists("alice")
+
+def test_user_routes(users):
+    from exifcleaner.user.wsgi import UserService
+
+    service = UserService(redis_url=REDIS_URL)
+
+    assert call(service, "/login", "POST", user=ADMIN).json_body is True
+    assert call(service, "/login", "POST", user=("admin", "guess")).status_int == 401
+    assert call(service, "/reset").status_int == 501
+    assert call(service, "/reset/abc", "POST").status_int == 501
@@ -0,0 +1,125 @@
+"""
+Tests For Request Routing
+"""
+import pytest
+import re
+from webob import Request, Response
+from exifcleaner import errors
+from exifcleaner import util
+from exifcleaner.common.dispatch import Dispatcher, PathTree, segments
+
+class Service:
+    def __init__(self):
+        self.handled = []
+        self.path_map = {
+            re.compile("/items/?$"): {
+                "GET": self.listing,
+                "POST": self.add
+            },
+            re.compile("/item/(?P<id>[^/]+)$"): {
+                "GET": self.get
+            },
+            re.compile("/item/new$"): {
+                "PUT": self.new
+            },
+            re.compile(r"/old/\d+$"): {
+                "GET": self.listing
+            }
+        }
+
+    def handle(self, request, method, params, environ, start_response):
+        self.handled.append(params)
+
+        try:
+            return method(request, **params)(environ, start_response)
+        except util.web.BadRequest as r:
+            return r(environ, start_response)
+
+    def listing(self, request):
+        return Response("listing")
+
+    def add(self, request):
+        raise util.web.BadRequest("nope")
+
+    def get(self, request, id):
+        return Response("item {}".format(id))
+
+    def new(self, request):
+        return Response("new")
+
+def app(environ, start_response):
+    return Response("mounted {}".format(environ['PATH_INFO']))(environ, start_response)
+
+def static(environ, start_response):
+    return Response("static")(environ, start_response)
+
+def call(dispatcher, path, method="GET"):
+    response = Request.blank(path, method=method).get_response(dispatcher)
+
+    return response.status_int, response.text
+
+def test_segments():
+    assert segments("/items/?$") == (["items"], True)
+    assert segments(re.compile("^/item/(?P<id>[^/]+)$")) == (["item", ("id",)], False)
+    assert segments("/items") is None
+    assert segments(r"/old/\d+$") is None
+
+def test_routes():
+    service = Service()
+    dispatcher = Dispatcher([service])
+
+    assert call(dispatcher, "/items") == (200, "listing")
+    assert call(dispatcher, "/items/") == (200, "listing")
+    assert call(dispatcher, "/item/abc") == (200, "item abc")
+    assert call(dispatcher, "/item/new", "PUT") == (200, "new")
+    assert call(dispatcher, "/old/12") == (200, "listing")
+    assert call(dispatcher, "/items", "POST") == (400, "nope")
+    assert service.handled[1:3] == [{}, {'id': "abc"}]
+
+def test_literal_falls_back_to_parameter():
+    dispatcher = Dispatcher([Service()])
+
+    # /item/new only takes PUT, but the path is found through /item/<id>
+    # when the literal route doesn't fit all the way
+    assert call(dispatcher, "/item/new", "GET") == (405, "Method not supported")
+    assert call(dispatcher, "/item/new/") == (404, "Not Found")
+
+def test_misses():
+    dispatcher = Dispatcher([Service()])
+
+    assert call(dispatcher, "/item/") == (404, "Not Found")
+    assert call(dispatcher, "/item/a/b") == (404, "Not Found")
+    assert call(dispatcher, "/items", "DELETE") == (405, "Method not supported")
+    assert call(dispatcher, "/old/x") == (404, "Not Found")
+
+def test_head_uses_get():
+    dispatcher = Dispatcher([Service()])
+
+    response = Request.blank("/item/abc", method="HEAD").get_response(dispatcher)
+
+    assert response.status_int == 200
+    assert response.body == b""
+
+def test_mounts_and_default():
+    dispatcher = Dispatcher([Service()], mounts={"/data/": app}, default=static)
+
+    assert call(dispatcher, "/data/a/b.jpg") == (200, "mounted /data/a/b.jpg")
+    assert call(dispatcher, "/data/") == (200, "mounted /data/")
+    assert call(dispatcher, "/data") == (200, "static")
+    assert call(dispatcher, "/item/abc") == (200, "item abc")
+    assert call(dispatcher, "/elsewhere") == (200, "static")
+
+def test_conflicts():
+    tree = PathTree()
+    tree.add_service(Service())
+
+    assert len(tree.fallback) == 1
+
+    with pytest.raises(errors.ExifCleanerConfigError):
+        tree.add("/items$", {"GET": None}, None)
+
+    with pytest.raises(errors.ExifCleanerConfigError):
+        tree.add("/item/(?P<code>[^/]+)/x$", {"GET": None}, None)
+
+    with pytest.raises(errors.ExifCleanerConfigError):
+        tree.mount("/data", app)
@@ -0,0 +1,41 @@
+"""
+Tests For Status Notifications
+"""
+import pytest
+import os
+import redis
+from exifcleaner import events
+from exifcleaner.events import EventHub
+from . import util as testutil
+
+pytestmark = pytest.mark.skipif(not testutil.check_redis(), reason="Redis must be available. Set EXIFCLEANER_REDIS_URL to change from default local server")
+
+@pytest.fixture()
+def conn():
+    conn = redis.StrictRedis.from_url(os.environ.get("EXIFCLEANER_REDIS_URL", "redis://127.0.0.1:6379"))
+
+    yield conn
+
+def test_fan_out(conn):
+    hub = EventHub(conn)
+
+    first = hub.subscribe("a")
+    second = hub.subscribe("a")
+    other = hub.subscribe("b")
+
+    events.publish(conn, "a", "finished")
+
+    assert hub.wait(first, 5) == {'id': "a", 'status': "finished"}
+    assert hub.wait(second, 5) == {'id': "a", 'status': "finished"}
+    assert hub.wait(other, 0.1) is None
+
+def test_unsubscribe(conn):
+    hub = EventHub(conn)
+
+    inbox = hub.subscribe("a")
+    hub.unsubscribe("a", inbox)
+
+    events.publish(conn, "a", "started")
+
+    assert hub.wait(inbox, 0.2) is None
+    assert hub._waiting == {}
@@ -0,0 +1,63 @@
+"""
+Tests For The Expiry Sweeper
+"""
+import pytest
+import os
+import time
+import redis
+from exifcleaner import expiry
+from . import util as testutil
+
+needs_redis = pytest.mark.skipif(not testutil.check_redis(), reason="Redis must be available. Set EXIFCLEANER_REDIS_URL to change from default local server")
+
+def test_bucket_rounds_up():
+    """
+    Ids are never put in a bucket that ends before they expire.
+    """
+    index = expiry.ExpiryIndex(None, bucket_size=60)
+
+    assert index.bucket_for(120) == 120
+    assert index.bucket_for(121) == 180
+    assert index.bucket_for(179.5) == 180
+
+@needs_redis
+def test_sweep():
+    conn = redis.StrictRedis.from_url(os.environ.get("EXIFCLEANER_REDIS_URL", "redis://127.0.0.1:6379"))
+    conn.flushdb()
+
+    index = expiry.ExpiryIndex(conn, bucket_size=60)
+
+    # bucket keys are given an EXPIREAT, so use times in the future
+    base = index.bucket_for(time.time()) + 3600
+
+    index.add("early", base + 40)
+    index.add("early2", base + 50)
+    index.add("late", base + 500)
+
+    removed = []
+
+    count = index.sweep(lambda bucket, ids: removed.extend(ids), now=base + 200)
+
+    assert count == 2
+    assert sorted(removed) == ["early", "early2"]
+    assert index.due(now=base + 200) == []
+    assert index.due(now=base + 600) == [base + 540]
+    assert not conn.exists(index.key(base + 60))
+
+    conn.flushdb()
+
+@needs_redis
+def test_remove():
+    conn = redis.StrictRedis.from_url(os.environ.get("EXIFCLEANER_REDIS_URL", "redis://127.0.0.1:6379"))
+    conn.flushdb()
+
+    index = expiry.ExpiryIndex(conn, bucket_size=60)
+    when = time.time() + 3600
+
+    index.add("cancelled", when)
+    index.add("kept", when)
+    index.remove("cancelled", when)
+
+    assert index.members(index.bucket_for(when)) == ["kept"]
+
+    conn.flushdb()
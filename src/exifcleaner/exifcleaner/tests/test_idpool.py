@@ -0,0 +1,59 @@
+"""
+Tests For The Reserved Id Pool
+"""
+import pytest
+import os
+import itertools
+import redis
+from exifcleaner import idpool
+from . import util as testutil
+
+pytestmark = pytest.mark.skipif(not testutil.check_redis(), reason="Redis must be available. Set EXIFCLEANER_REDIS_URL to change from default local server")
+
+@pytest.fixture()
+def conn():
+    conn = redis.StrictRedis.from_url(os.environ.get("EXIFCLEANER_REDIS_URL", "redis://127.0.0.1:6379"))
+    conn.flushdb()
+
+    yield conn
+
+    conn.flushdb()
+
+def counter():
+    numbers = itertools.count()
+
+    return lambda: "id{}".format(next(numbers))
+
+def test_reserve(conn):
+    assert idpool.reserve(conn, "abc", lifespan=100)
+    assert not idpool.reserve(conn, "abc", lifespan=100)
+    assert 0 < conn.ttl(idpool.reservation_key("abc")) <= 100
+
+def test_fill_and_take(conn):
+    pool = idpool.IdPool(conn, counter(), size=5)
+
+    assert pool.fill(batch=2) == 5
+    assert len(pool) == 5
+    assert pool.fill() == 0
+
+    assert pool.take() == "id0"
+    assert conn.exists(idpool.reservation_key("id0"))
+
+    assert pool.fill() == 1
+    assert [pool.take() for _ in range(6)] == ["id1", "id2", "id3", "id4", "id5", None]
+
+def test_fill_skips_reserved_ids(conn):
+    idpool.reserve(conn, "id1")
+
+    pool = idpool.IdPool(conn, counter(), size=3)
+
+    assert pool.fill() == 3
+    assert [pool.take() for _ in range(3)] == ["id0", "id2", "id3"]
+
+def test_fill_gives_up_when_ids_run_out(conn):
+    idpool.reserve(conn, "same")
+
+    pool = idpool.IdPool(conn, lambda: "same", size=3)
+
+    assert pool.fill() == 0
+    assert len(pool) == 0
@@ -0,0 +1,96 @@
+"""
+Tests For The Rolling Job Metrics
+"""
+import pytest
+import os
+import redis
+from exifcleaner.metrics import JobMetrics
+from . import util as testutil
+
+pytestmark = pytest.mark.skipif(not testutil.check_redis(), reason="Redis must be available. Set EXIFCLEANER_REDIS_URL to change from default local server")
+
+def meta(wait, total, size):
+    return {
+        'enqueued_at': 100.0,
+        'started_at': 100.0 + wait,
+        'finished_at': 100.0 + wait + total,
+        'timings': {'parse': total / 2, 'total': total},
+        'bytes_in': size,
+        'bytes_out': size - 10
+    }
+
+@pytest.fixture()
+def metrics():
+    conn = redis.StrictRedis.from_url(os.environ.get("EXIFCLEANER_REDIS_URL", "redis://127.0.0.1:6379"))
+    conn.flushdb()
+
+    yield JobMetrics(conn, bucket_size=60)
+
+    conn.flushdb()
+
+def test_summary(metrics):
+    metrics.record(meta(1.0, 0.5, 1000), now=6000)
+    metrics.record(meta(3.0, 1.5, 3000), now=6030)
+
+    # too old to be included
+    metrics.record(meta(100.0, 100.0, 100), now=5000)
+
+    summary = metrics.summary(window=300, now=6059)
+
+    assert summary['count'] == 2
+    assert summary['averages']['queue_wait'] == 2.0
+    assert summary['averages']['total'] == 1.0
+    assert summary['totals']['bytes_in'] == 4000
+    assert summary['totals']['bytes_out'] == 3980
+
+def test_deadlines(metrics):
+    met = meta(1.0, 1.0, 100)
+    met['deadline'] = met['finished_at'] + 1
+    metrics.record(met, now=6000)
+
+    missed = meta(1.0, 1.0, 100)
+    missed['deadline'] = missed['finished_at'] - 1
+    metrics.record(missed, now=6000)
+
+    # no deadline
+    metrics.record(meta(1.0, 1.0, 100), now=6000)
+
+    summary = metrics.summary(window=300, now=6000)
+
+    assert summary['count'] == 3
+    assert summary['deadlines'] == {'jobs': 2, 'missed': 1}
+    assert 'deadline_jobs' not in summary['totals']
+
+def test_failed_deadlines(metrics):
+    met = meta(1.0, 1.0, 100)
+    met['deadline'] = met['finished_at'] + 1
+    metrics.record(met, now=6000)
+
+    metrics.record_failure({'deadline': 6100.0}, now=6000)
+
+    # no deadline, nothing to count
+    metrics.record_failure({}, now=6000)
+
+    summary = metrics.summary(window=300, now=6000)
+
+    assert summary['count'] == 1
+    assert summary['deadlines'] == {'jobs': 2, 'missed': 1}
+
+def test_tenants(metrics):
+    for wait, tenant in [(1.0, "user:alice"), (3.0, "user:alice"), (5.0, "key:bulk")]:
+        met = meta(wait, 1.0, 100)
+        met['tenant'] = tenant
+        metrics.record(met, now=6000)
+
+    tenants = metrics.tenants(window=300, now=6000)
+
+    assert tenants == {
+        'user:alice': {'count': 2, 'queue_wait': 2.0},
+        'key:bulk': {'count': 1, 'queue_wait': 5.0}
+    }
+
+def test_empty_summary(metrics):
+    summary = metrics.summary(window=300, now=6000)
+
+    assert summary['count'] == 0
+    assert summary['averages'] == {}
@@ -0,0 +1,157 @@
+"""
+Tests For The Stage Pipeline
+"""
+import pytest
+import signal
+import threading
+import time
+from exifcleaner import errors
+from exifcleaner import pipeline as stages
+from exifcleaner.pipeline import Pipeline, Stage
+
+def test_dependencies_run_first():
+    """
+    A stage only starts once everything it requires has finished.
+    """
+    order = []
+
+    pipeline = Pipeline([
+        Stage("second", lambda: order.append("second"), requires=["first"]),
+        Stage("first", lambda: order.append("first"))
+    ])
+
+    pipeline.run()
+
+    assert order == ["first", "second"]
+
+def test_independent_stages_run_concurrently():
+    """
+    Stages that share a dependency run at the same time. Each one waits for
+    the other, so this would deadlock if they ran one after another.
+    """
+    barrier = threading.Barrier(2, timeout=5)
+
+    pipeline = Pipeline([
+        Stage("parse", lambda: "parsed"),
+        Stage("a", barrier.wait, requires=["parse"]),
+        Stage("b", barrier.wait, requires=["parse"])
+    ])
+
+    results = pipeline.run()
+
+    assert results['parse'] == "parsed"
+    assert sorted([results['a'], results['b']]) == [0, 1]
+
+def test_timings_recorded():
+    pipeline = Pipeline([
+        Stage("one", lambda: 1),
+        Stage("two", lambda: 2, requires=["one"])
+    ])
+
+    pipeline.run()
+
+    assert set(pipeline.timings) == {"one", "two", "total"}
+    assert pipeline.timings['total'] >= pipeline.timings['one']
+
+def test_failure_stops_dependants():
+    ran = []
+
+    def boom():
+        raise ValueError("boom")
+
+    pipeline = Pipeline([
+        Stage("boom", boom),
+        Stage("after", lambda: ran.append(True), requires=["boom"])
+    ])
+
+    with pytest.raises(ValueError):
+        pipeline.run()
+
+    assert ran == []
+
+class Timeout(Exception):
+    pass
+
+def test_timeout_does_not_wait_for_a_hung_stage():
+    """
+    An exception raised in the calling thread, like RQ's job timeout, gets
+    out straight away even though a stage is still running.
+    """
+    release = threading.Event()
+
+    def alarm(signum, frame):
+        raise Timeout()
+
+    pipeline = Pipeline([Stage("hang", lambda: release.wait(10))])
+
+    previous = signal.signal(signal.SIGALRM, alarm)
+    signal.setitimer(signal.ITIMER_REAL, 0.2)
+    start = time.monotonic()
+
+    try:
+        with pytest.raises(Timeout):
+            pipeline.run()
+
+        assert time.monotonic() - start < 2
+
+        # the hung stage is counted until it finishes
+        assert stages.abandoned() == 1
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+        release.set()
+
+    deadline = time.monotonic() + 5
+
+    while stages.abandoned() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert stages.abandoned() == 0
+
+def test_queued_stages_are_dropped():
+    """
+    Stages that were waiting for a thread when the pipeline gave up are
+    never started.
+    """
+    release = threading.Event()
+    ran = []
+
+    def alarm(signum, frame):
+        raise Timeout()
+
+    pipeline = Pipeline([
+        Stage("hang", lambda: release.wait(10)),
+        Stage("queued", lambda: ran.append(True))
+    ], max_workers=1)
+
+    previous = signal.signal(signal.SIGALRM, alarm)
+    signal.setitimer(signal.ITIMER_REAL, 0.2)
+
+    try:
+        with pytest.raises(Timeout):
+            pipeline.run()
+
+        assert stages.abandoned() == 1
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+        release.set()
+
+    time.sleep(0.1)
+
+    assert ran == []
+
+def test_bad_graphs():
+    with pytest.raises(errors.ExifCleanerConfigError):
+        Pipeline([Stage("a", None, requires=["missing"])])
+
+    with pytest.raises(errors.ExifCleanerConfigError):
+        Pipeline([Stage("a", None), Stage("a", None)])
+
+    pipeline = Pipeline([
+        Stage("a", None, requires=["b"]),
+        Stage("b", None, requires=["a"])
+    ])
+
+    with pytest.raises(errors.ExifCleanerConfigError):
+        pipeline.run()
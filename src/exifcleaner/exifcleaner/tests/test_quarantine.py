@@ -0,0 +1,44 @@
+"""
+Tests For The Poison File Quarantine
+"""
+import pytest
+import os
+import redis
+from exifcleaner import util
+from exifcleaner.quarantine import Quarantine
+from . import util as testutil
+
+pytestmark = pytest.mark.skipif(not testutil.check_redis(), reason="Redis must be available. Set EXIFCLEANER_REDIS_URL to change from default local server")
+
+@pytest.fixture()
+def quarantine():
+    conn = redis.StrictRedis.from_url(os.environ.get("EXIFCLEANER_REDIS_URL", "redis://127.0.0.1:6379"))
+    conn.flushdb()
+
+    yield Quarantine(conn, max_failures=2)
+
+    conn.flushdb()
+
+def test_quarantined_after_max_failures(quarantine):
+    assert not quarantine.failed("abc", "Boom: first")
+    quarantine.check("abc")
+
+    assert quarantine.failed("abc", "Boom: second")
+    assert quarantine.reason("abc") == "Boom: second"
+
+    with pytest.raises(util.web.BadRequest) as info:
+        quarantine.check("abc")
+
+    assert info.value.code == 422
+
+    # other files are unaffected
+    quarantine.check("def")
+
+def test_release(quarantine):
+    quarantine.failed("abc", "Boom")
+    quarantine.failed("abc", "Boom")
+
+    quarantine.release("abc")
+
+    assert quarantine.reason("abc") is None
+    assert not quarantine.failed("abc", "Boom")
@@ -0,0 +1,56 @@
+"""
+Tests For Result Storage
+"""
+import pytest
+import os
+import time
+import redis
+from exifcleaner.results import ResultStore, compact
+from . import util as testutil
+
+pytestmark = pytest.mark.skipif(not testutil.check_redis(), reason="Redis must be available. Set EXIFCLEANER_REDIS_URL to change from default local server")
+
+@pytest.fixture()
+def conn():
+    conn = redis.StrictRedis.from_url(os.environ.get("EXIFCLEANER_REDIS_URL", "redis://127.0.0.1:6379"))
+    conn.flushdb()
+
+    yield conn
+
+    conn.flushdb()
+
+def test_save_and_get(conn):
+    store = ResultStore(conn)
+
+    store.save("a", {'thumb': "a.thumb.jpg", 'json': "a.json", 'junk': "dropped", 'finished_at': None}, time.time() + 60)
+
+    assert store.get("a") == {'thumb': "a.thumb.jpg", 'json': "a.json"}
+    assert 0 < conn.ttl(store.key("a")) <= 60
+    assert store.get("missing") is None
+
+def test_status_updates_are_merged(conn):
+    store = ResultStore(conn)
+    expire_at = time.time() + 60
+
+    store.save("a", {'status': "queued", 'enqueued_at': 1.5, 'ttl': 600}, expire_at)
+    store.save("a", {'status': "started", 'started_at': 2.5}, expire_at)
+    store.save("a", {}, expire_at)
+
+    assert store.get("a") == {'status': "started", 'enqueued_at': "1.5", 'started_at': "2.5", 'ttl': "600"}
+
+def test_compact_removes_old_records(conn):
+    from rq.registry import FinishedJobRegistry
+
+    registry = FinishedJobRegistry("q", connection=conn)
+
+    conn.hset("rq:job:old", "ended_at", "2000-01-01T00:00:00Z")
+    conn.hset("rq:job:new", "ended_at", "2100-01-01T00:00:00Z")
+
+    for id_ in ["old", "new", "gone"]:
+        conn.execute_command("ZADD", registry.key, time.time() + 600, id_)
+
+    assert compact(conn, ["q"], 600) == 2
+
+    assert conn.exists("rq:job:new")
+    assert not conn.exists("rq:job:old")
+    assert registry.get_job_ids() == ["new"]
@@ -0,0 +1,38 @@
+"""
+Tests For Queue Routing
+"""
+import pytest
+from exifcleaner import errors
+from exifcleaner.routing import Router, default_routes
+
+def test_default_routes():
+    router = Router(default_routes("exifcleaner"))
+
+    assert router.queues == ["exifcleaner-fast", "exifcleaner-bulk"]
+    assert router.route(200 * 1024)['queue'] == "exifcleaner-fast"
+    assert router.route(2 * 1024 * 1024)['queue'] == "exifcleaner-fast"
+    assert router.route(40 * 1024 * 1024)['queue'] == "exifcleaner-bulk"
+
+def test_profile_routes():
+    router = Router([
+        {'queue': 'archive', 'profile': 'archive'},
+        {'queue': 'fast', 'max_size': 1000},
+        {'queue': 'bulk'}
+    ])
+
+    assert router.route(10, profile="archive") == {'queue': 'archive', 'rule': 0, 'size': 10, 'profile': 'archive'}
+    assert router.route(10)['queue'] == "fast"
+    assert router.route(10, profile="other")['rule'] == 1
+    assert router.route(5000)['queue'] == "bulk"
+
+def test_last_route_is_the_fallback():
+    router = Router([{'queue': 'fast', 'max_size': 1000}])
+
+    assert router.route(5000)['queue'] == "fast"
+
+def test_bad_routes():
+    with pytest.raises(errors.ExifCleanerConfigError):
+        Router([])
+
+    with pytest.raises(errors.ExifCleanerConfigError):
+        Router([{'max_size': 10}])
@@ -0,0 +1,87 @@
+"""
+Tests For The Resource-Limited Sandbox
+"""
+import pytest
+import os
+import threading
+import time
+from exifcleaner import errors
+from exifcleaner.sandbox import Sandbox
+
+def spin():
+    while True:
+        pass
+
+def hog():
+    return len(bytearray(1024 * 1024 * 1024))
+
+def fail():
+    raise ValueError("nope")
+
+@pytest.fixture()
+def sandbox():
+    sandbox = Sandbox(memory=512 * 1024 * 1024, cpu=1, max_tasks=3)
+
+    yield sandbox
+
+    sandbox.stop()
+
+def test_run(sandbox):
+    assert sandbox.run(sum, [1, 2, 3]) == 6
+
+def test_child_is_reused(sandbox):
+    pids = set(sandbox.run(os.getpid) for i in range(3))
+
+    assert len(pids) == 1
+    assert os.getpid() not in pids
+
+    # replaced after max_tasks
+    assert sandbox.run(os.getpid) not in pids
+
+def test_exceptions(sandbox):
+    with pytest.raises(ValueError):
+        sandbox.run(fail)
+
+    assert sandbox.run(sum, [1]) == 1
+
+def test_cpu_limit(sandbox):
+    with pytest.raises(errors.ExifCleanerLimitExceeded) as info:
+        sandbox.run(spin)
+
+    assert info.value.limit == "cpu"
+
+    # a new child takes over
+    assert sandbox.run(sum, [1]) == 1
+
+def test_memory_limit(sandbox):
+    with pytest.raises(errors.ExifCleanerLimitExceeded) as info:
+        sandbox.run(hog)
+
+    assert info.value.limit == "memory"
+    assert sandbox.run(sum, [1]) == 1
+
+def test_kill(sandbox):
+    sandbox.run(os.getpid)
+
+    # spin uses up its second of CPU well after this
+    threading.Timer(0.2, sandbox.kill).start()
+    start = time.monotonic()
+
+    with pytest.raises(errors.ExifCleanerSandboxError) as e:
+        sandbox.run(spin)
+
+    assert not isinstance(e.value, errors.ExifCleanerLimitExceeded)
+    assert time.monotonic() - start < 0.9
+    assert sandbox.run(sum, [1, 2]) == 3
+
+def leave_a_thread():
+    thread = threading.Thread(target=time.sleep, args=(10,))
+    thread.daemon = True
+    thread.start()
+
+    return os.getpid()
+
+def test_child_with_threads_left_is_replaced(sandbox):
+    pid = sandbox.run(leave_a_thread)
+
+    assert sandbox.run(os.getpid) != pid
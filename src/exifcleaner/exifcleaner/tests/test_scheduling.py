@@ -0,0 +1,122 @@
+"""
+Tests For Deadline Scheduling
+"""
+import pytest
+import os
+import time
+import redis
+from exifcleaner.scheduling import DeadlineQueue
+from . import util as testutil
+
+pytestmark = pytest.mark.skipif(not testutil.check_redis(), reason="Redis must be available. Set EXIFCLEANER_REDIS_URL to change from default local server")
+
+@pytest.fixture()
+def conn():
+    conn = redis.StrictRedis.from_url(os.environ.get("EXIFCLEANER_REDIS_URL", "redis://127.0.0.1:6379"))
+    conn.flushdb()
+
+    yield conn
+
+    conn.flushdb()
+
+def enqueue(queue, id_, deadline=None):
+    return queue.enqueue("exifcleaner.jobs.process", id_, "/tmp", job_id=id_, meta={'deadline': deadline})
+
+def dequeue(queues):
+    job, queue = DeadlineQueue.dequeue_any(queues, None, connection=queues[0].connection)
+
+    return job.id, queue.name
+
+def test_earliest_deadline_first(conn):
+    fast = DeadlineQueue("fast", connection=conn)
+    bulk = DeadlineQueue("bulk", connection=conn)
+    now = time.time()
+
+    enqueue(fast, "fifo1")
+    enqueue(bulk, "late", now + 60)
+    enqueue(fast, "fifo2")
+    enqueue(fast, "soon", now + 2)
+
+    assert fast.count_deadlines() == 1
+    assert len(fast) == 3
+
+    assert dequeue([fast, bulk]) == ("soon", "fast")
+    assert dequeue([fast, bulk]) == ("late", "bulk")
+    assert dequeue([fast, bulk]) == ("fifo1", "fast")
+    assert dequeue([fast, bulk]) == ("fifo2", "fast")
+
+    assert DeadlineQueue.dequeue_any([fast, bulk], None, connection=conn) is None
+
+def test_deadline_job_taken_fifo(conn):
+    queue = DeadlineQueue("fast", connection=conn)
+
+    enqueue(queue, "soon", time.time() + 2)
+
+    # e.g. a plain rq worker took it
+    conn.lpop(queue.key)
+
+    assert DeadlineQueue.dequeue_any([queue], None, connection=conn) is None
+    assert queue.count_deadlines() == 0
+
+def test_tenants_share_fairly(conn):
+    from exifcleaner.scheduling import FairQueue, _schedulers
+
+    _schedulers.clear()
+    queue = FairQueue("fast", connection=conn)
+
+    def add(id_, tenant, size=1000):
+        queue.enqueue("exifcleaner.jobs.process", id_, "/tmp", job_id=id_, meta={'tenant': tenant, 'route': {'size': size}})
+
+    for i in range(4):
+        add("bulk{}".format(i), "key:bulk")
+
+    add("alice0", "user:alice")
+    add("alice1", "user:alice")
+
+    order = [FairQueue.dequeue_any([queue], None, connection=conn)[0].id for i in range(6)]
+
+    # one each in turn, rather than all of the bulk uploads first
+    assert order[:4] in (["bulk0", "alice0", "bulk1", "alice1"], ["alice0", "bulk0", "alice1", "bulk1"])
+    assert order[4:] == ["bulk2", "bulk3"]
+
+    assert FairQueue.dequeue_any([queue], None, connection=conn) is None
+    assert queue.tenant_stats() == {}
+
+def test_tenant_weights_and_costs(conn):
+    from exifcleaner.scheduling import FairQueue, _schedulers
+
+    _schedulers.clear()
+    queue = FairQueue("fast", connection=conn)
+    FairQueue.set_weight(conn, "heavy", 2)
+
+    for i in range(4):
+        queue.enqueue("exifcleaner.jobs.process", "h{}".format(i), "/tmp", job_id="h{}".format(i), meta={'tenant': "heavy", 'route': {'size': 10}})
+        queue.enqueue("exifcleaner.jobs.process", "l{}".format(i), "/tmp", job_id="l{}".format(i), meta={'tenant': "light", 'route': {'size': 10}})
+
+    stats = queue.tenant_stats()
+    assert stats['heavy']['depth'] == 4
+
+    order = [FairQueue.dequeue_any([queue], None, connection=conn)[0].id for i in range(6)]
+
+    # two for one
+    assert order == ["h0", "h1", "l0", "h2", "h3", "l1"]
+
+def test_remove_cleans_up_hints(conn):
+    from exifcleaner.scheduling import FairQueue, _schedulers
+
+    _schedulers.clear()
+    queue = FairQueue("fast", connection=conn)
+
+    job = queue.enqueue("exifcleaner.jobs.process", "gone", "/tmp", job_id="gone", meta={'tenant': "t", 'deadline': time.time() + 5})
+    queue.enqueue("exifcleaner.jobs.process", "kept", "/tmp", job_id="kept", meta={'tenant': "t"})
+
+    assert queue.remove(job) == 1
+    # already gone
+    assert queue.remove(job) == 0
+
+    assert len(queue) == 1
+    assert queue.count_deadlines() == 0
+    assert queue.tenant_stats()['t']['depth'] == 1
+    assert not conn.hexists(queue.costs_key, "gone")
+
+    assert FairQueue.dequeue_any([queue], None, connection=conn)[0].id == "kept"
@@ -0,0 +1,342 @@
+"""
+Tests For The Cleaning Service
+"""
+import pytest
+import os
+import base64
+import json
+import datetime
+import threading
+import time
+import redis
+from rq.registry import DeferredJobRegistry, ScheduledJobRegistry
+from webob import Request
+from exifcleaner import ExifCleanerService
+from exifcleaner import jobs
+from exifcleaner import pipeline
+from exifcleaner.scheduling import FairQueue
+from exifcleaner.worker import SandboxWorker
+from . import util as testutil
+
+pytestmark = pytest.mark.skipif(not testutil.check_redis(), reason="Redis must be available. Set EXIFCLEANER_REDIS_URL to change from default local server")
+
+MEDIA = os.path.join(os.path.dirname(__file__), "..", "..", "..", "..", "functional_tests", "media")
+REDIS_URL = os.environ.get("EXIFCLEANER_REDIS_URL", "redis://127.0.0.1:6379")
+
+@pytest.fixture()
+def conn():
+    conn = redis.StrictRedis.from_url(REDIS_URL)
+    conn.flushdb()
+
+    yield conn
+
+    conn.flushdb()
+
+@pytest.fixture()
+def service(conn, tmp_path):
+    return ExifCleanerService(data_dir=str(tmp_path), redis_url=REDIS_URL)
+
+def upload(service, name):
+    with open(os.path.join(MEDIA, name), "rb") as fp:
+        request = Request.blank("/clean", POST={'input': (name, fp.read())})
+
+    return request.get_response(service)
+
+def work(service):
+    """
+    Run every queued job.
+    """
+    queues = list(service.queues[REDIS_URL].values())
+
+    # not rq.SimpleWorker, which kills its own process group when told to 
+    # stop a job
+    SandboxWorker(queues, connection=service.redis).work(burst=True)
+
+def status(service, id_):
+    return Request.blank("/status/{}".format(id_)).get_response(service).json_body
+
+def test_rejected_upload_leaves_nothing_behind(service, conn, tmp_path):
+    response = upload(service, "shadows.png")
+
+    assert response.status_int == 400
+    assert os.listdir(str(tmp_path)) == []
+    assert conn.keys("exif:window:*") == []
+
+def test_route_and_timings_outlive_the_job(service, conn):
+    id_ = upload(service, "shadows.jpg").json_body
+
+    assert status(service, id_)['route']['queue'] == "exifcleaner-bulk"
+
+    work(service)
+
+    body = status(service, id_)
+
+    assert body['status'] == "finished"
+    assert not conn.exists("rq:job:{}".format(id_))
+    assert body['route']['queue'] == "exifcleaner-bulk"
+    assert set(body['timings']) >= {"thumb", "clean"}
+
+def test_no_thumbnail(service):
+    # has exif data, but no thumbnail
+    id_ = upload(service, os.path.join("..", "test-file.jpg")).json_body
+
+    work(service)
+
+    body = status(service, id_)
+
+    assert body['status'] == "finished"
+    assert "thumb" not in body['result']
+    assert body['result']['json'] == "{}.json".format(id_)
+
+def test_statuses_are_revalidated(service):
+    id_ = upload(service, "shadows.jpg").json_body
+
+    work(service)
+
+    response = Request.blank("/status/{}".format(id_)).get_response(service)
+
+    assert response.json_body['status'] == "finished"
+    assert response.cache_control.private
+    assert response.cache_control.no_cache
+    assert response.etag
+
+    again = Request.blank("/status/{}".format(id_), headers={'If-None-Match': '"{}"'.format(response.etag)}).get_response(service)
+
+    assert again.status_int == 304
+
+    service.cancel_one(id_)
+
+    again = Request.blank("/status/{}".format(id_), headers={'If-None-Match': '"{}"'.format(response.etag)}).get_response(service)
+
+    assert again.status_int == 200
+    assert again.json_body['status'] == "canceled"
+
+@pytest.mark.parametrize("deadline", ["nan", "inf", "-inf", "0", "-5", "soon"])
+def test_bad_deadlines(service, deadline):
+    with open(os.path.join(MEDIA, "shadows.jpg"), "rb") as fp:
+        request = Request.blank("/clean", POST={'input': ("shadows.jpg", fp.read()), 'deadline': deadline})
+
+    assert request.get_response(service).status_int == 400
+
+def batch(service, **kwargs):
+    response = Request.blank("/status", **kwargs).get_response(service)
+
+    return response.status_int, response.json_body if response.status_int == 200 else None
+
+def test_batch_status(service):
+    finished = upload(service, "shadows.jpg").json_body
+
+    work(service)
+
+    queued = upload(service, "shadows.jpg").json_body
+    expected = {finished: "finished", queued: "queued"}
+
+    def statuses(body):
+        return dict((id_, info['status']) for id_, info in body['jobs'].items())
+
+    # repeated, comma separated, duplicated, with blanks
+    code, body = batch(service, query_string="ids={},nope&ids={}&ids={}&ids=".format(finished, queued, finished))
+
+    assert code == 200
+    assert statuses(body) == expected
+    assert body['unknown'] == ["nope"]
+    assert body['jobs'][finished]['result'] == status(service, finished)['result']
+
+    code, body = batch(service, POST={'ids': "{},{},gone".format(queued, finished)})
+
+    assert code == 200
+    assert statuses(body) == expected
+    assert body['unknown'] == ["gone"]
+
+    code, body = batch(service, method="POST", content_type="application/json", body=json.dumps([finished, "nope", queued]).encode("utf-8"))
+
+    assert code == 200
+    assert statuses(body) == expected
+    assert body['unknown'] == ["nope"]
+
+    code, body = batch(service, query_string="ids=nope")
+
+    assert code == 200
+    assert body == {'jobs': {}, 'unknown': ["nope"]}
+
+@pytest.mark.parametrize("kwargs", [
+    {},
+    {'query_string': "ids=,"},
+    {'query_string': "ids=" + ",".join(str(i) for i in range(501))},
+    {'method': "POST", 'content_type': "application/json", 'body': b"{\"ids\": [\"a\"]}"},
+    {'method': "POST", 'content_type': "application/json", 'body': b"[1, 2]"},
+    {'method': "POST", 'content_type': "application/json", 'body': b"not json"},
+])
+def test_bad_batches(service, kwargs):
+    assert batch(service, **kwargs)[0] == 400
+
+def tenant(service, headers):
+    return service.tenant(Request.blank("/clean", headers=headers, remote_addr="10.1.2.3"))
+
+def basic(username, password):
+    return "Basic " + base64.b64encode("{}:{}".format(username, password).encode("utf-8")).decode("ascii")
+
+def test_tenants_need_credentials_that_check_out(conn, tmp_path):
+    service = ExifCleanerService(data_dir=str(tmp_path), redis_url=REDIS_URL, api_keys={"s3cret": "bulk"})
+    checked = []
+
+    def authenticate(username, password):
+        checked.append(username)
+        return (username, password) == ("alice", "wonderland")
+
+    service.users.authenticate = authenticate
+
+    assert tenant(service, {'X-API-Key': "s3cret"}) == "key:bulk"
+    assert tenant(service, {'X-API-Key': "made-up"}) == "ip:10.1.2.3"
+
+    assert tenant(service, {'Authorization': basic("alice", "wonderland")}) == "user:alice"
+    assert tenant(service, {'Authorization': basic("alice", "guess")}) == "ip:10.1.2.3"
+    assert tenant(service, {'Authorization': basic("nobody", "guess")}) == "ip:10.1.2.3"
+    assert tenant(service, {}) == "ip:10.1.2.3"
+
+    # the right password is only checked once in a while
+    assert tenant(service, {'Authorization': basic("alice", "wonderland")}) == "user:alice"
+    assert checked == ["alice", "alice", "nobody"]
+
+def cancel(service, path):
+    response = Request.blank(path, method="PUT").get_response(service)
+
+    return response.status_int, response.json_body if response.status_int == 200 else None
+
+def test_cancel_queued(service, conn, tmp_path):
+    id_ = upload(service, "shadows.jpg").json_body
+
+    assert cancel(service, "/cancel/{}".format(id_)) == (200, {id_: "removed"})
+    assert status(service, id_)['status'] == "canceled"
+    assert not conn.exists("rq:job:{}".format(id_))
+    assert not any(files for path, directories, files in os.walk(str(tmp_path)))
+
+    work(service)
+
+    assert status(service, id_)['status'] == "canceled"
+
+@pytest.mark.parametrize("registry", [DeferredJobRegistry, ScheduledJobRegistry])
+def test_cancel_waiting_in_a_registry(service, conn, registry):
+    id_ = upload(service, "shadows.jpg").json_body
+    job = service.job(id_)
+
+    # as if it had been enqueued with depends_on or enqueue_at
+    FairQueue(job.origin, connection=conn).remove(job)
+
+    if registry is DeferredJobRegistry:
+        registry(job.origin, connection=conn).add(job)
+        job.set_status("deferred")
+    else:
+        registry(job.origin, connection=conn).schedule(job, datetime.datetime.now() + datetime.timedelta(hours=1))
+        job.set_status("scheduled")
+
+    assert cancel(service, "/cancel/{}".format(id_)) == (200, {id_: "removed"})
+    assert registry(job.origin, connection=conn).count == 0
+    assert not conn.exists("rq:job:{}".format(id_))
+    assert status(service, id_)['status'] == "canceled"
+
+def test_cancel_running(service, conn):
+    id_ = upload(service, "shadows.jpg").json_body
+    job = service.job(id_)
+
+    # as if a worker had taken it
+    FairQueue(job.origin, connection=conn).remove(job)
+    job.worker_name = "elsewhere"
+    job.set_status("started")
+    job.save()
+
+    assert cancel(service, "/cancel/{}".format(id_)) == (200, {id_: "stopped"})
+
+    # final, so nobody is kept waiting
+    start = time.monotonic()
+
+    assert Request.blank("/status/{}?wait=5".format(id_)).get_response(service).json_body['status'] == "canceled"
+    assert time.monotonic() - start < 1
+
+def test_cancel_finished(service, conn, tmp_path):
+    id_ = upload(service, "shadows.jpg").json_body
+
+    work(service)
+
+    assert cancel(service, "/cancel/{}".format(id_)) == (200, {id_: "deleted"})
+    assert status(service, id_)['status'] == "canceled"
+    assert not any(files for path, directories, files in os.walk(str(tmp_path)))
+
+def test_cancel_listed(service):
+    first = upload(service, "shadows.jpg").json_body
+    second = upload(service, "shadows.jpg").json_body
+
+    work(service)
+
+    third = upload(service, "shadows.jpg").json_body
+
+    assert cancel(service, "/cancel?ids={},{},{},nope".format(first, second, third)) == (200, {first: "deleted", second: "deleted", third: "removed", "nope": "unknown"})
+    assert cancel(service, "/cancel/nope") == (404, None)
+    assert cancel(service, "/cancel?ids=nope") == (404, None)
+
+def test_cancelled_while_processing(service, conn, tmp_path, monkeypatch):
+    id_ = upload(service, "shadows.jpg").json_body
+    run_stages = jobs.run_stages
+
+    def cancelled_at_the_end(path):
+        timings = run_stages(path)
+        assert service.cancel_one(id_) == "stopped"
+        return timings
+
+    monkeypatch.setattr(jobs, "run_stages", cancelled_at_the_end)
+
+    work(service)
+
+    assert status(service, id_)['status'] == "canceled"
+    # the files written after cancel_one removed the upload are gone too
+    assert not any(files for path, directories, files in os.walk(str(tmp_path)))
+
+def test_cancelled_while_failing(service, conn, tmp_path, monkeypatch):
+    id_ = upload(service, "shadows.jpg").json_body
+    run_stages = jobs.run_stages
+
+    def cancelled_at_the_start(path):
+        assert service.cancel_one(id_) == "stopped"
+        # the upload is gone now
+        return run_stages(path)
+
+    monkeypatch.setattr(jobs, "run_stages", cancelled_at_the_start)
+
+    work(service)
+
+    assert status(service, id_)['status'] == "canceled"
+    # not the upload's fault
+    assert not conn.keys("exif:quarantine:*")
+
+def test_worker_stops_after_abandoning_a_stage(service, conn, monkeypatch):
+    """
+    Without the sandbox, a failed job can leave a stage running in the
+    worker; SandboxWorker exits rather than take the next job.
+    """
+    release = threading.Event()
+
+    def boom():
+        raise ValueError("boom")
+
+    def stuck(path):
+        return pipeline.Pipeline([
+            pipeline.Stage("hang", lambda: release.wait(10)),
+            pipeline.Stage("boom", boom)
+        ]).run()
+
+    monkeypatch.setattr(jobs, "run_stages", stuck)
+
+    first = upload(service, "shadows.jpg").json_body
+    second = upload(service, "shadows.jpg").json_body
+
+    try:
+        work(service)
+
+        assert status(service, first)['status'] == "failed"
+        assert status(service, second)['status'] == "queued"
+    finally:
+        release.set()
+
+    # don't leave it counted for the next test's worker
+    while pipeline.abandoned():
+        time.sleep(0.01)
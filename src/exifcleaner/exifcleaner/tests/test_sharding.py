@@ -0,0 +1,118 @@
+"""
+Tests For Sharding Jobs Across Redis Servers
+
+The tests that talk to redis need several servers; list them in
+EXIFCLEANER_SHARD_URLS, separated by commas, e.g.
+
+    $ redis-server --port 6380 & redis-server --port 6381 &
+    $ EXIFCLEANER_SHARD_URLS=redis://127.0.0.1:6380,redis://127.0.0.1:6381 pytest
+"""
+import pytest
+import os
+import base64
+from rq.job import Job
+from webob import Request
+from exifcleaner import errors
+from exifcleaner.admin.wsgi import AdminService
+from exifcleaner.autoscale import ScalingPolicy, Supervisor, WorkerPool
+from exifcleaner.sharding import ShardRing
+from exifcleaner.scheduling import FairQueue
+
+URLS = ["redis://a:6379/0", "redis://b:6379/0", "redis://c:6379/0"]
+
+IDS = ["id{}".format(i) for i in range(3000)]
+
+def test_needs_urls():
+    with pytest.raises(errors.ExifCleanerConfigError):
+        ShardRing([])
+
+    with pytest.raises(errors.ExifCleanerConfigError):
+        ShardRing(["redis://a", "redis://a"])
+
+def test_stable():
+    ring = ShardRing(URLS)
+
+    assert [ring.url_for(id_) for id_ in IDS] == [ShardRing(list(reversed(URLS))).url_for(id_) for id_ in IDS]
+
+def test_spread():
+    ring = ShardRing(URLS)
+    counts = dict((url, 0) for url in URLS)
+
+    for id_ in IDS:
+        counts[ring.url_for(id_)] += 1
+
+    for count in counts.values():
+        assert 700 < count < 1300
+
+def test_adding_a_shard_moves_few_ids():
+    before = ShardRing(URLS)
+    after = ShardRing(URLS + ["redis://d:6379/0"])
+
+    moved = [id_ for id_ in IDS if before.url_for(id_) != after.url_for(id_)]
+
+    # about a quarter, all of them to the new shard
+    assert len(moved) < len(IDS) / 3
+    assert set(after.url_for(id_) for id_ in moved) == {"redis://d:6379/0"}
+
+def shard_urls():
+    value = os.environ.get("EXIFCLEANER_SHARD_URLS", "")
+
+    return [url for url in value.split(",") if url]
+
+@pytest.mark.skipif(len(shard_urls()) < 2, reason="Set EXIFCLEANER_SHARD_URLS to two or more redis servers")
+def test_jobs_found_on_their_shard():
+    ring = ShardRing(shard_urls())
+
+    for connection in ring.connections:
+        connection.flushdb()
+
+    for id_ in IDS[:20]:
+        queue = FairQueue("fast", connection=ring.connection_for(id_))
+        queue.enqueue("exifcleaner.jobs.process", id_, "/tmp", job_id=id_)
+
+    for id_ in IDS[:20]:
+        assert Job.fetch(id_, connection=ring.connection_for(id_)).id == id_
+
+    assert sum(len(FairQueue("fast", connection=connection)) for connection in ring.connections) == 20
+    assert all(len(FairQueue("fast", connection=connection)) for connection in ring.connections)
+
+    for connection in ring.connections:
+        connection.flushdb()
+
+@pytest.mark.skipif(len(shard_urls()) < 2, reason="Set EXIFCLEANER_SHARD_URLS to two or more redis servers")
+def test_counts_added_up_over_shards():
+    from exifcleaner.user.manager import UserManager
+
+    ring = ShardRing(shard_urls())
+
+    for connection in ring.connections:
+        connection.flushdb()
+
+    UserManager(redis_url=ring.urls[0]).add(username="admin", password="sekrit", email="admin@example.com", admin=True, activated=True)
+
+    # two jobs for alice and one for bob on each shard
+    for index, connection in enumerate(ring.connections):
+        queue = FairQueue("fast", connection=connection)
+
+        for id_, tenant in [("a1", "alice"), ("a2", "alice"), ("b1", "bob")]:
+            id_ = "{}-{}".format(id_, index)
+            queue.enqueue("exifcleaner.jobs.process", id_, "/tmp", job_id=id_, meta={'tenant': tenant})
+
+    admin = AdminService(redis_url=ring.urls, queue_names=["fast"])
+    headers = {'Authorization': "Basic " + base64.b64encode(b"admin:sekrit").decode("ascii")}
+    response = Request.blank("/admin/tenants", headers=headers).get_response(admin)
+
+    assert response.status_int == 200
+
+    waiting = response.json_body['waiting']['fast']
+
+    assert waiting['alice']['depth'] == 2 * len(ring)
+    assert waiting['bob']['depth'] == len(ring)
+
+    pool = WorkerPool(["fast"], ring.urls[0], shard_urls=ring.urls[1:])
+    supervisor = Supervisor(ScalingPolicy(), pool, ring.urls[0], shard_urls=ring.urls[1:])
+
+    assert supervisor.sample().depth == 3 * len(ring)
+
+    for connection in ring.connections:
+        connection.flushdb()
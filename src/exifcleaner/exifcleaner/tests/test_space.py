@@ -0,0 +1,59 @@
+"""
+Tests For The Space Manager
+"""
+import pytest
+import os
+import redis
+from exifcleaner import util
+from exifcleaner.space import SpaceManager
+from . import util as testutil
+
+pytestmark = pytest.mark.skipif(not testutil.check_redis(), reason="Redis must be available. Set EXIFCLEANER_REDIS_URL to change from default local server")
+
+class FakeLayout:
+    def __init__(self):
+        self.removed = []
+
+    def remove(self, id_):
+        self.removed.append(id_)
+
+@pytest.fixture()
+def space():
+    conn = redis.StrictRedis.from_url(os.environ.get("EXIFCLEANER_REDIS_URL", "redis://127.0.0.1:6379"))
+    conn.flushdb()
+
+    yield SpaceManager(conn, FakeLayout(), high_water=1000, low_water=600)
+
+    conn.flushdb()
+
+def test_tracking(space):
+    space.track("a", 100)
+    space.track("a", 300, evictable=True)
+    space.track("b", 200)
+
+    assert space.usage() == 500
+
+    space.forget(["a", "missing"])
+
+    assert space.usage() == 200
+
+def test_evicts_least_recently_used(space):
+    for id_ in ["a", "b", "c"]:
+        space.track(id_, 300, evictable=True)
+
+    space.touch("a")
+
+    # 900 used; 300 more goes over the high-water mark, so evict down to
+    # 600 - 300
+    space.reserve(300)
+
+    assert space.layout.removed == ["b", "c"]
+    assert space.usage() == 300
+
+def test_unprocessed_uploads_are_not_evicted(space):
+    space.track("queued", 900)
+
+    with pytest.raises(util.web.BackEndTrouble):
+        space.reserve(300)
+
+    assert space.layout.removed == []
@@ -0,0 +1,109 @@
+"""
+Tests For The Data Directory Layouts
+"""
+import pytest
+import os
+import calendar
+from exifcleaner import storage, errors
+
+def test_remove_files(tmpdir):
+    for name in ["a.jpg", "a.json", "a.thumb.jpg", "b.jpg", "c.jpg"]:
+        tmpdir.join(name).write("x")
+
+    # b only has the image, nothing at all exists for d
+    count = storage.remove_files(["a", "b", "d"], str(tmpdir))
+
+    assert count == 4
+    assert os.listdir(str(tmpdir)) == ["c.jpg"]
+
+def test_id_from_name():
+    assert storage.id_from_name("/abc.jpg") == "abc"
+    assert storage.id_from_name("abc.thumb.jpg") == "abc"
+    assert storage.id_from_name("abc.json") == "abc"
+
+def test_window_directories():
+    bucket = calendar.timegm((2026, 10, 16, 12, 10, 0))
+
+    assert storage.window_name(bucket) == "202610161210"
+    assert storage.directory_for("/data") == "/data"
+    assert storage.directory_for("/data", bucket) == "/data/202610161210"
+
+def test_window_bucket_rounds_up():
+    layout = storage.WindowedLayout("/data", None, window=600)
+
+    assert layout.bucket_for(1200) == 1200
+    assert layout.bucket_for(1201) == 1800
+
+def test_window_expire(tmpdir):
+    """
+    Expiring a window removes its directory and leaves the others alone.
+    """
+    layout = storage.WindowedLayout(str(tmpdir), None, window=600)
+
+    for bucket in [1200, 1800]:
+        directory = tmpdir.mkdir(storage.window_name(bucket))
+        directory.join("a.jpg").write("x")
+
+    layout.expire(1200, ["a"])
+
+    assert os.listdir(str(tmpdir)) == [storage.window_name(1800)]
+
+    # already gone
+    layout.expire(1200, ["a"])
+
+def test_make_layout():
+    assert isinstance(storage.make_layout("flat", "/data"), storage.FlatLayout)
+    assert isinstance(storage.make_layout("windowed", "/data"), storage.WindowedLayout)
+
+    with pytest.raises(errors.ExifCleanerConfigError):
+        storage.make_layout("sideways", "/data")
+
+def test_shard_name():
+    # sha1("abc") == a9993e36...
+    assert storage.shard_name("abc") == os.path.join("a9", "99")
+    assert storage.directory_for("/data", id_="abc", sharded=True) == "/data/a9/99"
+
+def test_sharded_resolve(tmpdir):
+    layout = storage.ShardedLayout(str(tmpdir))
+
+    assert layout.resolve("/abc.thumb.jpg") == "/a9/99/abc.thumb.jpg"
+    assert layout.resolve("/a9/99/abc.jpg") == "/a9/99/abc.jpg"
+
+def test_sharded_fallback(tmpdir):
+    """
+    While migrating, files that haven't been moved yet are served from the
+    flat layout.
+    """
+    layout = storage.ShardedLayout(str(tmpdir), fallback=True)
+
+    tmpdir.join("abc.jpg").write("x")
+
+    assert layout.resolve("/abc.jpg") == "/abc.jpg"
+
+    layout.assign("abc", 0)
+    tmpdir.join("a9", "99", "abc.jpg").write("x")
+
+    assert layout.resolve("/abc.jpg") == "/a9/99/abc.jpg"
+
+    layout.remove("abc")
+
+    assert not tmpdir.join("abc.jpg").exists()
+    assert not tmpdir.join("a9", "99", "abc.jpg").exists()
+
+def test_migrate(tmpdir):
+    from exifcleaner import migrate
+
+    for name in ["abc.jpg", "abc.json", "new.jpg"]:
+        tmpdir.join(name).write("x")
+
+    tmpdir.mkdir("202610161210")
+
+    old = os.path.getmtime(str(tmpdir.join("abc.jpg"))) - 120
+    os.utime(str(tmpdir.join("abc.jpg")), (old, old))
+    os.utime(str(tmpdir.join("abc.json")), (old, old))
+
+    moved, skipped = migrate.migrate(str(tmpdir), min_age=60)
+
+    assert (moved, skipped) == (2, 1)
+    assert sorted(os.listdir(str(tmpdir.join("a9", "99")))) == ["abc.jpg", "abc.json"]
+    assert tmpdir.join("new.jpg").exists()
@@ -0,0 +1,44 @@
+"""
+Tests For Adaptive Job Timeouts
+"""
+import pytest
+from exifcleaner.timeouts import TimeoutPolicy
+
+class FixedMetrics:
+    """
+    Stands in for JobMetrics, returning fixed totals.
+    """
+    def __init__(self, count, seconds, nbytes):
+        self.totals = {'total': seconds, 'bytes_in': nbytes}
+        self.count = count
+        self.calls = 0
+
+    def summary(self, window=900):
+        self.calls += 1
+        return {'window': window, 'count': self.count, 'totals': self.totals, 'averages': {}}
+
+def test_default_rate_until_measured():
+    policy = TimeoutPolicy(FixedMetrics(2, 1.0, 100), base=0, factor=1, minimum=1, default_rate=1000)
+
+    assert policy.timeout(10000) == 10
+
+def test_measured_rate():
+    # 100 jobs, 1MB in 10s, so 100KB/s
+    policy = TimeoutPolicy(FixedMetrics(100, 10.0, 1000000), base=5, factor=4, minimum=1)
+
+    assert policy.timeout(500000) == 25
+
+def test_bounds():
+    policy = TimeoutPolicy(FixedMetrics(100, 10.0, 1000000), minimum=15, maximum=60)
+
+    assert policy.timeout(0) == 15
+    assert policy.timeout(100000000) == 60
+
+def test_rate_is_cached():
+    metrics = FixedMetrics(100, 10.0, 1000000)
+    policy = TimeoutPolicy(metrics, refresh=60)
+
+    policy.timeout(1)
+    policy.timeout(2)
+
+    assert metrics.calls == 1
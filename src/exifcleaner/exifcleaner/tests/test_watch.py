@@ -0,0 +1,165 @@
+"""
+Tests For The Watch Folder Daemon
+"""
+import pytest
+import os
+import shutil
+import time
+import piexif
+from exifcleaner import errors
+from exifcleaner.watch import Watcher
+
+MEDIA = os.path.join(os.path.dirname(__file__), "..", "..", "..", "..", "functional_tests", "media", "shadows.jpg")
+NO_THUMB = os.path.join(os.path.dirname(__file__), "..", "..", "..", "..", "functional_tests", "test-file.jpg")
+
+pytestmark = pytest.mark.skipif(not hasattr(os, "sched_getaffinity"), reason="inotify is only available on Linux")
+
+@pytest.fixture()
+def watcher(tmp_path):
+    (tmp_path / "in").mkdir()
+
+    watcher = Watcher([str(tmp_path / "in")], str(tmp_path / "out"), workers=1, settle=0.1)
+
+    yield watcher
+
+    watcher.close()
+
+def wait(watcher, seconds=10):
+    """
+    Poll until the watcher has nothing left to do.
+    """
+    end = time.monotonic() + seconds
+
+    # pick up the events first
+    watcher.poll(0.1)
+
+    while not watcher.idle and time.monotonic() < end:
+        watcher.poll(0.1)
+
+def test_new_file_is_published(watcher, tmp_path):
+    shutil.copyfile(MEDIA, str(tmp_path / "in" / "photo.jpg"))
+
+    wait(watcher)
+
+    assert watcher.stats['files'] == 1
+    assert sorted(os.listdir(str(tmp_path / "out" / "in"))) == ["photo.jpg", "photo.json", "photo.thumb.jpg"]
+    assert not piexif.load(str(tmp_path / "out" / "in" / "photo.jpg"))['Exif']
+    # the original is left alone
+    assert piexif.load(str(tmp_path / "in" / "photo.jpg"))['Exif']
+
+def test_waits_for_the_file_to_settle(watcher, tmp_path):
+    with open(str(tmp_path / "in" / "photo.jpg"), "wb") as fp:
+        fp.write(b"partial")
+
+    watcher.poll(0.05)
+
+    assert watcher.pending
+    assert not watcher.running
+
+    shutil.copyfile(MEDIA, str(tmp_path / "in" / "photo.jpg"))
+
+    wait(watcher)
+
+    assert watcher.stats == {'files': 1, 'failed': 0, 'bytes': os.path.getsize(MEDIA)}
+
+def test_subdirectories_and_renames(watcher, tmp_path):
+    (tmp_path / "staging").mkdir()
+    (tmp_path / "staging" / "batch").mkdir()
+    shutil.copyfile(MEDIA, str(tmp_path / "staging" / "batch" / "a.jpg"))
+    shutil.copyfile(MEDIA, str(tmp_path / "staging" / "b.jpg"))
+    (tmp_path / "staging" / "notes.txt").write_text("ignored")
+
+    os.rename(str(tmp_path / "staging" / "batch"), str(tmp_path / "in" / "batch"))
+    os.rename(str(tmp_path / "staging" / "b.jpg"), str(tmp_path / "in" / "b.jpg"))
+    os.rename(str(tmp_path / "staging" / "notes.txt"), str(tmp_path / "in" / "notes.txt"))
+
+    wait(watcher)
+
+    assert watcher.stats['files'] == 2
+    assert (tmp_path / "out" / "in" / "batch" / "a.jpg").exists()
+    assert (tmp_path / "out" / "in" / "b.jpg").exists()
+    assert not (tmp_path / "out" / "in" / "notes.txt").exists()
+
+def test_rename_within_the_tree(watcher, tmp_path):
+    (tmp_path / "in" / "a" / "b").mkdir(parents=True)
+
+    wait(watcher)
+
+    os.rename(str(tmp_path / "in" / "a"), str(tmp_path / "in" / "c"))
+
+    wait(watcher)
+
+    shutil.copyfile(MEDIA, str(tmp_path / "in" / "c" / "one.jpg"))
+    shutil.copyfile(MEDIA, str(tmp_path / "in" / "c" / "b" / "two.jpg"))
+
+    wait(watcher)
+
+    assert watcher.stats['files'] == 2
+    assert (tmp_path / "out" / "in" / "c" / "one.jpg").exists()
+    assert (tmp_path / "out" / "in" / "c" / "b" / "two.jpg").exists()
+
+def test_moved_out_of_the_tree(watcher, tmp_path):
+    (tmp_path / "in" / "a" / "b").mkdir(parents=True)
+
+    wait(watcher)
+
+    os.rename(str(tmp_path / "in" / "a"), str(tmp_path / "elsewhere"))
+
+    wait(watcher)
+
+    shutil.copyfile(MEDIA, str(tmp_path / "elsewhere" / "one.jpg"))
+    shutil.copyfile(MEDIA, str(tmp_path / "elsewhere" / "b" / "two.jpg"))
+
+    wait(watcher)
+
+    assert watcher.stats['files'] == 0
+    # only "in" itself is still watched
+    assert list(watcher.inotify.paths.values()) == [str(tmp_path / "in")]
+    assert len(watcher.roots) == 1
+
+def test_no_thumbnail(watcher, tmp_path):
+    shutil.copyfile(NO_THUMB, str(tmp_path / "in" / "plain.jpg"))
+
+    wait(watcher)
+
+    assert watcher.stats['failed'] == 0
+    assert sorted(os.listdir(str(tmp_path / "out" / "in"))) == ["plain.jpg", "plain.json"]
+
+def test_failures_are_counted(watcher, tmp_path):
+    (tmp_path / "in" / "broken.jpg").write_bytes(b"not really a jpeg")
+
+    wait(watcher)
+
+    assert watcher.stats['failed'] == 1
+    assert [name for name in os.listdir(str(tmp_path / "out" / "in"))] == []
+
+def test_output_not_watched(tmp_path):
+    with pytest.raises(errors.ExifCleanerConfigError):
+        Watcher([str(tmp_path / "out")], str(tmp_path / "out"))
+
+def test_roots_are_kept_apart(tmp_path):
+    for root in ("first", "second"):
+        (tmp_path / root).mkdir()
+
+    watcher = Watcher([str(tmp_path / "first"), str(tmp_path / "second")], str(tmp_path / "out"), workers=1, settle=0.1)
+
+    try:
+        shutil.copyfile(MEDIA, str(tmp_path / "first" / "a.jpg"))
+        shutil.copyfile(NO_THUMB, str(tmp_path / "second" / "a.jpg"))
+
+        wait(watcher)
+    finally:
+        watcher.close()
+
+    assert watcher.stats['files'] == 2
+    assert sorted(os.listdir(str(tmp_path / "out" / "first"))) == ["a.jpg", "a.json", "a.thumb.jpg"]
+    assert sorted(os.listdir(str(tmp_path / "out" / "second"))) == ["a.jpg", "a.json"]
+
+def test_roots_with_the_same_name(tmp_path):
+    (tmp_path / "one" / "dropbox").mkdir(parents=True)
+    (tmp_path / "two" / "dropbox").mkdir(parents=True)
+
+    with pytest.raises(errors.ExifCleanerConfigError):
+        Watcher([str(tmp_path / "one" / "dropbox"), str(tmp_path / "two" / "dropbox")], str(tmp_path / "out"))
+
+    assert not (tmp_path / "out").exists()
@@ -0,0 +1,73 @@
+"""
+Job timeouts sized to the upload.
+
+A single timeout is either too short for big files or far too long for small
+ones, which lets a file that makes piexif spin hold a worker for minutes. The
+TimeoutPolicy works out how long a job should take from the size of its input
+and the throughput recent jobs have managed (from metrics.JobMetrics), and
+allows a multiple of that.
+"""
+
+import time
+
+class TimeoutPolicy:
+    """
+    metrics - a metrics.JobMetrics object.
+    base - number, seconds allowed on top of the estimate, for startup etc.
+    factor - number, multiple of the estimated time to allow.
+    minimum, maximum - integers, bounds on the timeout in seconds.
+    default_rate - number, bytes per second to assume until enough jobs have
+                   been measured.
+    min_jobs - integer, jobs that have to be measured before their
+               throughput is trusted.
+    window - integer, seconds of metrics to measure throughput over.
+    refresh - number, seconds to cache the measured throughput for.
+    """
+    def __init__(self, metrics, base=5.0, factor=4.0, minimum=15, maximum=600,
+                 default_rate=1048576, min_jobs=10, window=900, refresh=30.0):
+        self.metrics = metrics
+        self.base = base
+        self.factor = factor
+        self.minimum = minimum
+        self.maximum = maximum
+        self.default_rate = default_rate
+        self.min_jobs = min_jobs
+        self.window = window
+        self.refresh = refresh
+
+        self._checked = None
+        self._rate = default_rate
+
+    def _measure(self):
+        """
+        Internal function. Return the bytes per second recent jobs have
+        processed, or the default if there aren't enough of them.
+        """
+        summary = self.metrics.summary(self.window)
+        seconds = summary['totals'].get("total", 0)
+
+        if summary['count'] < self.min_jobs or not seconds:
+            return self.default_rate
+
+        return summary['totals'].get("bytes_in", 0) / seconds or self.default_rate
+
+    def rate(self):
+        """
+        Return the measured throughput in bytes per second, refreshing it if
+        it is older than self.refresh seconds.
+        """
+        now = time.monotonic()
+
+        if self._checked is None or now - self._checked >= self.refresh:
+            self._rate = self._measure()
+            self._checked = now
+
+        return self._rate
+
+    def timeout(self, size):
+        """
+        Return the timeout in seconds for a job with `size` bytes of input.
+        """
+        estimate = self.base + self.factor * size / self.rate()
+
+        return int(min(max(estimate, self.minimum), self.maximum))
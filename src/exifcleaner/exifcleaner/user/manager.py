@@ -236,7 +236,9 @@ class UserManager(BaseManager):
             delta = udatetime.now()-BEGINNING_OF_TIME
             score = delta.seconds
             
-            pipe.zadd(USERS_BY_USERNAME, score, user.sortby)
+            # raw ZADD; the argument order of zadd() differs between
+            # redis-py releases
+            pipe.execute_command("ZADD", USERS_BY_USERNAME, score, user.sortby)
             pipe.hset(USER_INDEX_KEY, user.username, user.key)
             pipe.execute()
         
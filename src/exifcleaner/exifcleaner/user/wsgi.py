@@ -4,6 +4,9 @@ WSGI Applications That Provide a REST-ish API for the UserManager.
 from . import manager, errors
 from webob import Request, Response
 from .. import common
+from .. import util
+from ..common import wsgi
+import re
 
 class UserAuthMiddleware:
     def __init__(self, application, redis_url="redis://127.0.0.1:6379", admin=False):
@@ -24,6 +27,9 @@ class UserService(common.wsgi.BaseService):
     /user/username, GET - get a single user
     /user/username, DELETE - remove a user
     /login, POST - authenticate a user
+    
+    Only /login is done so far. The rest need an admin's credentials, and
+    then answer 501 Not Implemented.
     """
     
     def __init__(self, redis_url="redis://127.0.0.1:6379"):
@@ -50,25 +56,43 @@ class UserService(common.wsgi.BaseService):
             }
         }
         
+    def not_implemented(self, request, admin=True):
+        """
+        Answer for the routes that aren't done yet, once the request is
+        authorized.
+        """
+        if admin:
+            self.authorize(request, admin=True)
+        
+        raise util.web.BadRequest("Not Implemented", code=501)
+        
     def add(self, request):
-         return Response("Adding a new user.")
+        return self.not_implemented(request)
     
     def delete(self, request, username):
-        return Response("Deleting {}".format(username))
+        return self.not_implemented(request)
     
     def modify(self, request, username):
-        return Response("Modifying {}".format(username))
+        return self.not_implemented(request)
         
-    def listing(self):
-        return Response("Listing users")
+    def listing(self, request):
+        return self.not_implemented(request)
         
     def get(self, request, username):
-        return Response("Getting user {}".format(username))
+        return self.not_implemented(request)
+    
+    def authenticate(self, request):
+        self.authorize(request)
+        
+        response = Response()
+        response.json_body = True
+        
+        return response
     
     def reset_request(self, request):
-        pass
+        return self.not_implemented(request, admin=False)
     
-    def password_reset(self, request, code):
-        pass
+    def reset_password(self, request, code):
+        return self.not_implemented(request, admin=False)
     
     
\ No newline at end of file
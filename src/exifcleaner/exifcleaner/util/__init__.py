@@ -162,3 +162,5 @@ def string_to_score(string, ignore_case=False):
         score = score * 257 + piece + 1
     
     return score * 2 + (len(string) > 6)
+
+from . import web, pagination
@@ -60,6 +60,20 @@ class BackEndTrouble(BadRequest):
     def __init__(self, msg="Some trouble with the back-end. Please try your request again later", code=400):
         BadRequest.__init__(self, msg, code)
         
+class TooBusy(BadRequest):
+    """
+    Raised when the service is overloaded. Tells the client when to try again.
+    """
+    def __init__(self, retry_after, msg="Too busy. Please try your request again later", code=503):
+        BadRequest.__init__(self, msg, code)
+        self.retry_after = retry_after
+        
+    def __call__(self, environ, start_response):
+        res = Response(self.msg, status=self.code)
+        res.headers['retry-after'] = str(self.retry_after)
+        
+        return res(environ, start_response)
+        
 class Unauthorized(BadRequest):
     """
     Raised when a bad content type is specified by the client.
@@ -0,0 +1,416 @@
+"""
+Watch directories for new images and clean them as they arrive.
+
+For systems that drop photos onto a shared volume: rather than uploading
+each one to /clean, run this next to the volume. New images are noticed
+through Linux inotify, cleaned by a small pool of processes, and published
+into the output directory (mirroring the watched tree, under the watched
+directory's name) along with their thumbnail and json. Nothing goes through
+the web service or redis.
+
+A file is only picked up once a writer has closed it (or it has been renamed
+into a watched directory), and then only after no more events have been seen
+for it for --settle seconds, so files written in several goes aren't cleaned
+half way through. Images already in the directories when the watcher starts
+are left alone; use the exifcleaner command for those.
+
+Results appear in the output directory all at once: each image is cleaned in
+a staging directory under it and then renamed into place, the image itself
+last.
+
+    $ python -m exifcleaner.watch --output /srv/clean /srv/dropbox
+"""
+
+import argparse
+import concurrent.futures
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import shutil
+import signal
+import struct
+import sys
+import tempfile
+import time
+from . import cli
+from . import errors
+
+# from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+_EVENT = struct.Struct("iIII")
+
+class Inotify:
+    """
+    A minimal wrapper around the inotify system calls, through ctypes.
+
+    Raises OSError if inotify isn't available.
+    """
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.paths = {}
+
+    def fileno(self):
+        return self.fd
+
+    def add(self, path, mask=WATCH_MASK):
+        """
+        Start watching the directory at path. Returns the watch descriptor.
+        """
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, "Can't watch {}: {}".format(path, os.strerror(error)))
+
+        self.paths[wd] = path
+
+        return wd
+
+    def remove(self, wd):
+        """
+        Stop watching the directory with watch descriptor wd.
+        """
+        self.paths.pop(wd, None)
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self):
+        """
+        Generator of (wd, directory, name, mask) for each event waiting to be
+        read. name is "" for events about the directory itself.
+        """
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+
+        offset = 0
+
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+
+            directory = self.paths.get(wd)
+
+            if mask & IN_IGNORED:
+                # the watch is gone (directory removed or unmounted)
+                self.paths.pop(wd, None)
+
+            yield wd, directory, name, mask
+
+    def close(self):
+        os.close(self.fd)
+
+def publish(path, relative, output, remove=False):
+    """
+    Pool function. Clean a copy of the image at path and move it, with its
+    thumbnail and json, to relative under output.
+
+    Returns a tuple of (path, bytes processed, error message or None).
+    """
+    staging = None
+
+    try:
+        size = os.path.getsize(path)
+        target = os.path.join(output, os.path.dirname(relative))
+        name = os.path.basename(relative)
+
+        os.makedirs(target, exist_ok=True)
+
+        # under output, so the results can be renamed into place
+        staging = tempfile.mkdtemp(prefix=".staging-", dir=output)
+
+        shutil.copyfile(path, os.path.join(staging, name))
+        cli.strip(os.path.join(staging, name))
+
+        for result in sorted(os.listdir(staging), key=lambda result: result == name):
+            os.replace(os.path.join(staging, result), os.path.join(target, result))
+
+        if remove:
+            os.remove(path)
+    except Exception as e:
+        return path, 0, "{}: {}".format(type(e).__name__, e)
+    finally:
+        if staging:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    return path, size, None
+
+class Watcher:
+    """
+    directories - list of directories to watch, along with everything below
+                  them. Each is published under its own name, so no two
+                  can have the same name.
+    output - directory to publish cleaned images to.
+    workers - integer, number of processes cleaning images.
+    settle - float, seconds without any events for a file before it is
+             cleaned.
+    extensions - file extensions to clean; anything else is ignored.
+    remove - boolean, if True, delete each original once it is published.
+    """
+    def __init__(self, directories, output, workers=None, settle=1.0, extensions=cli.EXTENSIONS, remove=False):
+        # before anything is started, so a bad configuration leaves nothing
+        # running
+        cli.check_sources(directories)
+
+        self.output = os.path.abspath(output)
+        self.workers = workers or cli.cpu_count()
+        self.settle = settle
+        self.extensions = extensions
+        self.remove = remove
+
+        # files seen, waiting to settle or for a free worker: path -> (due, relative)
+        self.pending = {}
+        # futures of files being cleaned: future -> path
+        self.running = {}
+        # watch descriptor of each directory being watched -> watched root
+        # it is under. A directory renamed within the tree keeps its watch
+        # descriptor, so this is keyed by that rather than by path
+        self.roots = {}
+        # watch descriptors of directories just renamed within the tree,
+        # whose IN_MOVE_SELF is still to come
+        self.moved = set()
+
+        self.stats = {'files': 0, 'failed': 0, 'bytes': 0}
+
+        os.makedirs(self.output, exist_ok=True)
+
+        self.inotify = Inotify()
+        self.pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+
+        for directory in directories:
+            directory = os.path.abspath(directory)
+
+            if self._is_output(directory):
+                raise errors.ExifCleanerConfigError("Can't watch the output directory: {}".format(directory))
+
+            self._watch_tree(directory, directory)
+
+    def _is_output(self, directory):
+        """
+        Internal method. Return True if directory is the output directory or
+        inside it.
+        """
+        return directory == self.output or directory.startswith(self.output + os.sep)
+
+    def _watch_tree(self, directory, root, now=None):
+        """
+        Internal method. Watch directory and every directory below it, except
+        the output directory and hidden ones.
+
+        If now is given, the directory has just appeared (e.g. moved in
+        whole), and the images already in it are queued up too, since their
+        events happened before there was a watch to see them.
+        """
+        for path, subdirectories, files in os.walk(directory):
+            subdirectories[:] = [name for name in subdirectories if not name.startswith(".") and not self._is_output(os.path.join(path, name))]
+
+            try:
+                wd = self.inotify.add(path)
+            except OSError as e:
+                print(e, file=sys.stderr)
+                continue
+
+            if path == directory and wd in self.roots:
+                # renamed within the tree: the watch is the same one, now
+                # under the new path (the directories below are remapped as
+                # the walk goes on)
+                self.moved.add(wd)
+
+            self.roots[wd] = root
+
+            if now is not None:
+                for name in files:
+                    if cli.wanted(name, self.extensions):
+                        self._seen(os.path.join(path, name), root, now)
+
+    def _unwatch_tree(self, directory):
+        """
+        Internal method. Stop watching directory and every directory below
+        it, by the paths they were watched under.
+        """
+        for wd, path in list(self.inotify.paths.items()):
+            if path == directory or path.startswith(directory + os.sep):
+                self.roots.pop(wd, None)
+                self.inotify.remove(wd)
+
+    def _seen(self, path, root, now):
+        """
+        Internal method. Queue up path to be cleaned once it has settled;
+        another event for a file already waiting pushes it back.
+        """
+        self.pending[path] = (now + self.settle, os.path.join(cli.root_name(root), os.path.relpath(path, root)))
+
+    def _event(self, wd, directory, name, mask, now):
+        """
+        Internal method. Handle one inotify event.
+        """
+        if mask & IN_Q_OVERFLOW:
+            print("Missed some events: the inotify queue overflowed. Raise fs.inotify.max_queued_events", file=sys.stderr)
+            return
+
+        if directory is None or wd not in self.roots:
+            return
+
+        if mask & IN_MOVE_SELF:
+            if wd in self.moved:
+                # moved within the tree; IN_MOVED_TO has already seen to it
+                self.moved.discard(wd)
+            else:
+                # moved out of the tree, along with everything below it
+                self._unwatch_tree(directory)
+            return
+
+        if mask & IN_DELETE_SELF:
+            self.roots.pop(wd, None)
+            return
+
+        if not name:
+            return
+
+        path = os.path.join(directory, name)
+
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO) and not name.startswith(".") and not self._is_output(path):
+                self._watch_tree(path, self.roots[wd], now)
+            return
+
+        if mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and cli.wanted(name, self.extensions):
+            self._seen(path, self.roots[wd], now)
+
+    def _dispatch(self, now):
+        """
+        Internal method. Hand settled files to the pool, keeping no more than
+        two per worker queued up, so a burst of files waits here rather than
+        piling up in the pool.
+        """
+        for path, (due, relative) in sorted(self.pending.items(), key=lambda item: item[1][0]):
+            if due > now or len(self.running) >= self.workers * 2:
+                break
+
+            del self.pending[path]
+
+            future = self.pool.submit(publish, path, relative, self.output, self.remove)
+            self.running[future] = path
+
+    def _collect(self):
+        """
+        Internal method. Record the results of finished files.
+        """
+        for future in [future for future in self.running if future.done()]:
+            del self.running[future]
+
+            path, size, error = future.result()
+
+            if error:
+                self.stats['failed'] += 1
+                print("Failed {}: {}".format(path, error), file=sys.stderr)
+            else:
+                self.stats['files'] += 1
+                self.stats['bytes'] += size
+                print("Cleaned {}".format(path))
+
+    def poll(self, timeout=1.0):
+        """
+        Wait up to timeout seconds for events, then start and collect any
+        work that is due.
+        """
+        now = time.monotonic()
+
+        if self.pending:
+            timeout = min(timeout, max(0, min(due for due, relative in self.pending.values()) - now))
+
+        if self.running:
+            # check back soon for results
+            timeout = min(timeout, 0.05)
+
+        readable, _, _ = select.select([self.inotify], [], [], timeout)
+
+        now = time.monotonic()
+
+        if readable:
+            for wd, directory, name, mask in self.inotify.read():
+                self._event(wd, directory, name, mask, now)
+
+        self._dispatch(now)
+        self._collect()
+
+    @property
+    def idle(self):
+        """
+        True if there is nothing waiting or being cleaned.
+        """
+        return not self.pending and not self.running
+
+    def run(self, stop):
+        """
+        Watch until stop() returns True, then finish the files already being
+        cleaned.
+        """
+        while not stop():
+            self.poll()
+
+        self.close()
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+        self._collect()
+        self.inotify.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Clean images as they are written to a directory.")
+    parser.add_argument("directories", nargs="+", help="directories to watch, including everything below them")
+    parser.add_argument("--output", "-o", required=True, help="directory to publish cleaned images to")
+    parser.add_argument("--workers", "-j", type=int, default=None, help="number of worker processes (default: one per available core)")
+    parser.add_argument("--settle", type=float, default=1.0, help="seconds a file must be left alone before it is cleaned")
+    parser.add_argument("--ext", action="append", default=None, help="file extension to clean, may be repeated (default: .jpg, .jpeg)")
+    parser.add_argument("--remove", action="store_true", help="delete each original once it has been published")
+
+    args = parser.parse_args(argv)
+
+    extensions = cli.extensions(args.ext)
+
+    stopping = []
+
+    def handler(signum, frame):
+        stopping.append(signum)
+
+    signal.signal(signal.SIGTERM, handler)
+    signal.signal(signal.SIGINT, handler)
+
+    watcher = Watcher(args.directories, args.output, args.workers, args.settle, extensions, args.remove)
+
+    print("Watching {} directories".format(len(watcher.roots)))
+
+    watcher.run(lambda: bool(stopping))
+
+    print("Cleaned {} files, {} failed".format(watcher.stats['files'], watcher.stats['failed']))
+
+if __name__ == "__main__":
+    main()
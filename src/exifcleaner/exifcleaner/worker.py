@@ -0,0 +1,49 @@
+"""
+RQ worker for running jobs with the sandbox on.
+
+rq.SimpleWorker runs every job in the worker's own process, so the sandbox's
+child process is reused from one job to the next (see exifcleaner.sandbox).
+But it has no work horse to kill when told to stop a job (/cancel does, with
+rq.command.send_stop_job_command): RQ's kill_horse signals the process group
+of pid 0, which is the worker's own, taking the worker down along with
+whatever else shares its group. SandboxWorker kills the sandbox children
+instead, so the job fails straight away and the worker carries on.
+
+Without the sandbox, jobs also run their stages on threads in the worker's
+own process, and a stage still running when its job fails or times out
+can't be stopped (see exifcleaner.pipeline). Once max_abandoned of those
+are left, SandboxWorker finishes its current job and exits, for circus or
+the autoscaler to start a new one.
+
+    $ rq worker -w exifcleaner.worker.SandboxWorker exifcleaner-fast
+"""
+
+from rq import SimpleWorker
+from . import pipeline
+from . import sandbox
+
+class SandboxWorker(SimpleWorker):
+    # abandoned pipeline stages to put up with before restarting
+    max_abandoned = 1
+
+    def execute_job(self, job, queue):
+        """
+        Run the job, then stop the worker if too many stages have been left
+        running (see exifcleaner.pipeline.abandoned).
+        """
+        try:
+            return SimpleWorker.execute_job(self, job, queue)
+        finally:
+            stuck = pipeline.abandoned()
+
+            if stuck >= self.max_abandoned:
+                print("{} abandoned stage(s) still running; stopping worker {} to get rid of them".format(stuck, self.name))
+                self._stop_requested = True
+
+    def kill_horse(self, sig=None):
+        """
+        Stop the job being worked on by killing the sandbox's child. Without
+        the sandbox on, the job runs to the end, and jobs.process sees that
+        it was cancelled.
+        """
+        sandbox.kill_all()
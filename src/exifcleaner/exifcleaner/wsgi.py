@@ -11,7 +11,12 @@ import piexif
 import tempfile
 import os
 import redis
-from rq import Queue, get_current_job
+from rq import get_current_job
+from rq.job import Job
+from rq.exceptions import NoSuchJobError, InvalidJobOperation
+from rq.command import send_stop_job_command
+from rq.registry import DeferredJobRegistry, ScheduledJobRegistry
+from rq.serializers import resolve_serializer
 from rq.connections import get_current_connection
 from rq_scheduler import Scheduler
 import englids
@@ -19,6 +24,30 @@ import json
 import datetime
 from datetime import timedelta
 from .image import ExifImage, tempexif
+from . import storage
+from .expiry import ExpiryIndex
+from .space import SpaceManager
+from .routing import Router, default_routes
+from .admission import AdmissionController
+from .results import ResultStore, RESULT_FIELDS
+from .quarantine import Quarantine
+from .timeouts import TimeoutPolicy
+from .scheduling import FairQueue
+from .sharding import ShardRing
+from . import callbacks
+from .events import EventHub
+from . import idpool
+from .common.dispatch import Dispatcher
+from . import events
+import hashlib
+import base64
+import collections
+from .metrics import JobMetrics
+from .user.manager import UserManager
+import time
+import re
+import math
+import ipaddress
 
 
 class ExifCleanerService:
@@ -32,9 +61,19 @@ class ExifCleanerService:
     /clean           POST             submit image for     application/json    id of the image
                                       processing
     /status/[id]     GET              processing status    application/json    dictiornay of status info
-    /cancel/[id]     PUT              cancel processing    application/json    true
+    /status?ids=     GET, POST        status of many jobs  application/json    dictionary of id: status
+                                      at once                                  info, and unknown ids
+    /events/[id]     GET              status changes       text/event-stream   a status event for
+                                                                               each change
+    /cancel/[id]     PUT              cancel processing    application/json    dictionary of id:
+                                      and remove files                         what was done
+    /cancel?ids=     PUT              cancel many jobs     application/json    dictionary of id:
+                                      at once                                  what was done
     """                              
     
+    # statuses that never change again
+    final = ('finished', 'failed', 'canceled')
+    
     def _check_config(self, config):
         """
         Internal function, used to validate configuration passed to the constructor.
@@ -44,24 +83,91 @@ class ExifCleanerService:
         
         if config['ttl'] > config['id_lifespan']:
             raise errors.ExifCleanerError("TTL for images can not be longer than the lifespan of an id")
+        
+        if config['admission_code'] not in (429, 503):
+            raise errors.ExifCleanerConfigError("admission_code must be 429 or 503")
+        
+        for network in config['callback_allow']:
+            try:
+                ipaddress.ip_network(network)
+            except ValueError:
+                raise errors.ExifCleanerConfigError("Bad network in callback_allow: {}".format(network))
+        
+        if config['window'] % config['expiry_bucket']:
+            raise errors.ExifCleanerConfigError("Window size must be a multiple of {} seconds".format(config['expiry_bucket']))
     
-    def __init__(self, data_dir="./tmp", redis_url="redis://localhost:6379/0", queue_name="exifcleaner", ttl=600):
+    def __init__(self, data_dir="./tmp", redis_url="redis://localhost:6379/0", queue_name="exifcleaner", ttl=600, layout="windowed", window=600, fallback=False, space_limit=None, routes=None, max_queue_depth=None, max_queue_age=None, admission_refresh=0.5, admission_code=503, max_failures=3, max_timeout=600, sandbox_memory=None, sandbox_cpu=None, tenant_weights=None, api_keys=None, id_pool=False, callback_allow=None):
         """
         Configure the service.
         
         data_dir - string, path where files will be stored once they are uploaded.
-        redis_url - string, connection details for the redis server.
-        queue_name - string, name of the RQ queue
-        ttl - integer, number of seconds to keep images around after they are processed.
+        redis_url - string, connection details for the redis server. Or a list of
+                    them, to spread jobs over several servers by id; the first
+                    one also keeps everything that isn't tied to one job. See
+                    exifcleaner.sharding.
+        queue_name - string, base name of the RQ queues
+        ttl - integer, number of seconds to keep images around after they are uploaded.
+        layout - string, how files are arranged in data_dir; "windowed" puts them in 
+                 a subdirectory per expiry window, "sharded" puts them in a
+                 two-level tree named after a hash of the id, "flat" puts them 
+                 all in data_dir.
+        window - integer, size of each expiry window in seconds.
+        fallback - boolean, for the sharded layout; also look for files directly in
+                   data_dir. Use while migrating from the flat layout.
+        space_limit - integer, number of bytes uploads may use in data_dir before
+                      the least recently downloaded ones are removed early. 
+                      None for no limit.
+        routes - list of dictionaries, rules for picking a queue for each upload
+                 based on its size and profile. See exifcleaner.routing. The 
+                 default sends uploads of up to 2MB to <queue_name>-fast, and 
+                 everything else to <queue_name>-bulk.
+        max_queue_depth - integer, uploads are refused with a 503 and a Retry-After
+                          header while this many jobs are waiting. None for no limit.
+        max_queue_age - number, uploads are refused while the oldest waiting job has
+                        been queued for longer than this many seconds. None for no 
+                        limit.
+        admission_refresh - number, seconds to cache the queue numbers used for the
+                            two limits above.
+        admission_code - integer, HTTP status uploads are refused with when over 
+                         those limits: 503, or 429 to tell clients they 
+                         should slow down.
+        max_failures - integer, number of times the same file can fail or time out
+                       before further uploads of it are refused.
+        max_timeout - integer, longest a job may run for, in seconds. Each job's
+                      timeout is worked out from its size and recent throughput.
+        sandbox_memory - integer, if set, images are processed in a child process 
+                         that can use at most this many bytes of memory.
+        sandbox_cpu - integer, if set, images are processed in a child process
+                      that can use at most this many seconds of CPU per image.
+        tenant_weights - dictionary of tenant: weight. Workers share their time 
+                         between tenants (see ExifCleanerService.tenant) in 
+                         proportion to their weights; the default is 1.
+        api_keys - dictionary of API key: tenant name. Uploads with one of these 
+                   keys in their X-API-Key header are scheduled as 
+                   "key:<name>". Other keys are ignored.
+        id_pool - boolean, if True, take ids from the pool kept topped up by
+                  exifcleaner.idpool, and only reserve them one at a time 
+                  when it is empty.
+        callback_allow - list of networks (e.g. "10.0.0.0/8") callbacks may be
+                         sent to as well as public addresses; see 
+                         exifcleaner.callbacks.
         """
+        if isinstance(redis_url, str):
+            shard_urls = [redis_url]
+        else:
+            shard_urls = list(redis_url)
+        
         config = {
             # location where files are stored
             'data_dir': os.path.abspath(data_dir),
             
-            # url for connecting to the redis server
-            'redis_url': redis_url,
+            # url for connecting to the main redis server
+            'redis_url': shard_urls[0],
+            
+            # urls of the redis servers jobs are spread over
+            'shard_urls': shard_urls,
             
-            # a name for the RQ job queue
+            # base name for the RQ job queues
             'queue_name': queue_name,
             
             # the number of seconds an image will exist after its processed.
@@ -69,140 +175,781 @@ class ExifCleanerService:
             
             # how long to keep ids around before they expire, in seconds
             # default is ~ 1 year
-            'id_lifespan': 31536000
+            'id_lifespan': idpool.LIFESPAN,
+            
+            # known API keys, and the tenants they belong to
+            'api_keys': dict(api_keys or {}),
+            
+            # seconds to remember a checked Basic auth header for
+            'auth_cache': 300,
+            
+            # take ids from the pre-reserved pool
+            'id_pool': id_pool,
+            
+            # non-public networks callbacks may be sent to
+            'callback_allow': list(callback_allow or []),
+            
+            # arrangement of files in data_dir
+            'layout': layout,
+            
+            # size of expiry windows, in seconds
+            'window': window,
+            
+            # look for files in the flat layout too (sharded layout only)
+            'fallback': fallback,
+            
+            # bytes that can be used before evicting early, None to disable
+            'space_limit': space_limit,
+            
+            # rules for picking a queue for each upload
+            'routes': routes or default_routes(queue_name),
+            
+            # limits on queue depth and age, before uploads are refused
+            'max_queue_depth': max_queue_depth,
+            'max_queue_age': max_queue_age,
+            'admission_refresh': admission_refresh,
+            'admission_code': admission_code,
+            
+            # failures before a file is quarantined
+            'max_failures': max_failures,
+            
+            # upper bound on job timeouts, in seconds
+            'max_timeout': max_timeout,
+            
+            # limits for processing images in a sandbox, None for no sandbox
+            'sandbox': None,
+            
+            # longest a /status request can wait for a change, in seconds
+            'max_wait': 60,
+            
+            # longest an /events stream is kept open, and how often a 
+            # keepalive is sent on it, in seconds
+            'max_stream': 300,
+            'keepalive': 15,
+            
+            # most ids that can be cancelled or looked up in one request
+            'max_cancel': 1000,
+            'max_status': 500,
+            
+            # granularity of the expiry sweeper, in seconds
+            'expiry_bucket': 60
         }
         
+        if sandbox_memory is not None or sandbox_cpu is not None:
+            config['sandbox'] = {'memory': sandbox_memory, 'cpu': sandbox_cpu}
+        
         self._check_config(config)
         
         self.config = config
         
-        self.redis = redis.StrictRedis.from_url(redis_url)
+        self.redis = redis.StrictRedis.from_url(self.config['redis_url'])
+        self.shards = ShardRing(shard_urls)
         self.queue_name = queue_name
-        self.queue = Queue(self.config['queue_name'], connection=self.redis)
+        self.router = Router(self.config['routes'])
+        
+        # shard url: {queue name: queue}
+        self.queues = {}
+        
+        for url in shard_urls:
+            self.queues[url] = {}
+            
+            for name in self.router.queues:
+                self.queues[url][name] = FairQueue(name, connection=self.shards.connection(url))
+        
+        self.admission = AdmissionController(self.redis, [queue for url in shard_urls for queue in self.queues[url].values()], 
+                                             max_depth=max_queue_depth, 
+                                             max_age=max_queue_age, 
+                                             refresh=admission_refresh,
+                                             code=admission_code)
+        
         self.data_dir = self.config['data_dir']
         
+        self.layout = storage.make_layout(layout, self.data_dir, self.redis, window=window, fallback=fallback)
+        self.expiry = ExpiryIndex(self.redis, bucket_size=self.config['expiry_bucket'])
+        self.space = SpaceManager(self.redis, self.layout, high_water=space_limit)
+        self.quarantine = Quarantine(self.redis, max_failures=max_failures)
+        self.timeouts = TimeoutPolicy(JobMetrics(self.redis), maximum=max_timeout)
+        
+        for tenant, weight in (tenant_weights or {}).items():
+            for connection in self.shards.connections:
+                FairQueue.set_weight(connection, tenant, weight)
+        
+        self.events = EventHub(self.redis)
+        
+        # for telling tenants apart; see tenant()
+        self.users = UserManager(redis_url=self.config['redis_url'])
+        self._verified = {}
+        
+        # for reading job meta without loading the whole job
+        self.serializer = resolve_serializer(None)
+        
         self.id_generator = englids.Englids()
+        self.ids = idpool.IdPool(self.redis, self.id_generator, lifespan=self.config['id_lifespan']) if id_pool else None
+        
+        self.path_map = {
+            re.compile("/clean/?$"): {
+                "POST": self.clean
+            },
+            re.compile("/status/?$"): {
+                "GET": self.statuses,
+                "POST": self.statuses
+            },
+            re.compile("/status/(?P<id_>[^/]+)$"): {
+                "GET": self.status
+            },
+            re.compile("/events/(?P<id_>[^/]+)$"): {
+                "GET": self.events_stream
+            },
+            re.compile("/cancel/?$"): {
+                "PUT": self.cancel_listed
+            },
+            re.compile("/cancel/(?P<id_>[^/]+)$"): {
+                "PUT": self.cancel_id
+            }
+        }
+        
+        self.dispatcher = Dispatcher([self])
     
     def __call__(self, environ, start_response):
         """
-        Main - handles routing to other methods.
+        Main - routes requests to the methods in self.path_map.
+        """
+        return self.dispatcher(environ, start_response)
+    
+    def handle(self, request, method, params, environ, start_response):
+        """
+        Run the method a request was routed to, and answer with its response.
         """
-        request = Request(environ)
-        
-        response = None
-        
-        parts = request.path.split("/")[1:]
-        
         try:
-            if parts[0] == 'clean':
-                response = self.clean(request)
-            elif parts[0] == 'status':
-                if len(parts) != 2:
-                    raise util.BadRequest()
-                else:
-                    response = self.status(request, parts[1])
-            elif parts[0] == 'cancel':
-                if request.method != 'PUT':
-                    raise util.BadRequest()
-                
-                if len(parts) != 2:
-                    raise util.BadRequest()
-                else:
-                    response = self.status(request, parts[1])
-            else:
-                raise util.NotFound()
-        except util.BadRequest as e:
+            response = method(request, **params)
+        except util.web.BadRequest as e:
             return e(environ, start_response)
         
         return response(environ, start_response)
     
     def id(self):
         """
-        Generate a random unique id. Checks the database to ensure it hasn't been
-        used already.
+        Generate a random unique id, reserved in the database so it isn't 
+        handed out again.
         
-        Logs the new id in the database. Ids expire after self.config['id_lifespan']
-        seconds, using redis' EXPIRE mechanism.
+        With an id pool, an id reserved ahead of time is taken from it. Otherwise,
+        or if the pool is empty, a new id is reserved with SET NX EX, in one
+        round trip; ids expire after self.config['id_lifespan'] seconds.
         
         Retries 5 times. Raises TooManyRetriesError if the same id is generated 
         over and over.
         """
+        if self.ids is not None:
+            id_ = self.ids.take()
+            
+            if id_ is not None:
+                return id_
         
-        id_ = self.id_generator()
+        for _ in range(5):
+            id_ = self.id_generator()
+            
+            if idpool.reserve(self.redis, id_, self.config['id_lifespan']):
+                return id_
         
-        max_tries = 5
-        tries = 0
+        raise errors.ExifCleanerTooManyRetries()
+    
+    def job(self, id_):
+        """
+        Return the RQ job for the given image id, whichever queue it went to.
+        Returns None if there is no such job.
+        """
+        try:
+            return Job.fetch(id_, connection=self.shards.connection_for(id_))
+        except NoSuchJobError:
+            return None
+    
+    def request_ids(self, request, limit):
+        """
+        Return the list of ids given to a request for many jobs at once, 
+        without duplicates. They can be given as 'ids' parameters in the 
+        query string or a form body (repeated, or separated by commas), or as 
+        a json list. No more than limit ids are allowed.
+        """
+        if request.content_type == "application/json":
+            try:
+                ids = request.json_body
+            except ValueError:
+                raise util.web.BadRequest("Body must be a json list of ids")
+            
+            if not isinstance(ids, list) or not all(isinstance(id_, str) for id_ in ids):
+                raise util.web.BadRequest("Body must be a json list of ids")
+        else:
+            ids = []
+            
+            for value in request.GET.getall('ids') + request.POST.getall('ids'):
+                ids.extend(id_.strip() for id_ in value.split(","))
+        
+        ids = list(collections.OrderedDict((id_, True) for id_ in ids if id_))
+        
+        if not ids:
+            raise util.web.BadRequest("No ids given")
         
-        while tries < max_tries:
-            exists = self.redis.exists("exif:{}".format(id_))
-            if not exists:
-                break
-            else:
-                id_ = self.id_generator()
+        if len(ids) > limit:
+            raise util.web.BadRequest("No more than {} ids can be given at once".format(limit))
+        
+        return ids
+    
+    def cancel_one(self, id_):
+        """
+        Cancel the job for an image id, and remove its files now rather than
+        when they expire.
+        
+        Returns what was done:
+        
+        "removed" - the job was waiting (queued, deferred or scheduled), and 
+                    has been taken off its queue or registry.
+        "stopped" - the job was running; its worker has been told to stop.
+        "deleted" - the job was already done; only its files were removed.
+        "unknown" - there is no such id (or it has already expired).
+        
+        Unless it is unknown, the id's status is "canceled" from then on, 
+        until the ttl runs out.
+        """
+        connection = self.shards.connection_for(id_)
+        job = self.job(id_)
+        result = ResultStore(connection).get(id_)
+        
+        if job is None and result is None:
+            return "unknown"
+        
+        outcome = "deleted"
+        
+        if job is not None:
+            # when the sweeper would have removed the files
+            when = job.kwargs.get('window') or job.kwargs.get('expires_at')
+            
+            # in case the job is running, or starts in the meantime
+            connection.set(jobs.cancelled_key(id_), 1, ex=self.config['ttl'])
+            
+            status = job.get_status()
+            
+            if status in ('deferred', 'scheduled'):
+                # not on the queue yet, but in a registry until it is due (or
+                # its dependencies are done); the same goes for the registry
+                registry = {'deferred': DeferredJobRegistry, 'scheduled': ScheduledJobRegistry}[status]
                 
-            tries += 1
+                if registry(job.origin, connection=connection).remove(job):
+                    job.delete()
+                    outcome = "removed"
+                else:
+                    # moved to the queue in the meantime
+                    status = 'queued'
+            
+            if status == 'queued':
+                # whoever takes the id off the list owns the job; if a worker
+                # beat us to it, it is running now
+                if FairQueue(job.origin, connection=connection).remove(job):
+                    job.delete()
+                    outcome = "removed"
+                else:
+                    status = 'started'
+            
+            if status == 'started':
+                try:
+                    send_stop_job_command(connection, id_)
+                    outcome = "stopped"
+                except (InvalidJobOperation, NoSuchJobError):
+                    # finished in the meantime
+                    pass
         else:
-            raise errors.ExifCleanerTooManyRetries()
+            when = None
+            
+            if result.get('removed_around'):
+                when = datetime.datetime.fromisoformat(result['removed_around']).timestamp()
+        
+        self.layout.remove(id_)
+        self.space.forget([id_])
+        
+        if when is not None:
+            self.expiry.remove(id_, when)
         
-        key = "exif:{}".format(id_)
-        with self.redis.pipeline() as pipe:
-            pipe.set(key, 1)
-            pipe.expire(key, self.config['id_lifespan'])
+        # a fresh record, so the status is final (and says so) rather than 
+        # falling back to whatever RQ makes of the stopped job
+        store = ResultStore(connection)
+        now = time.time()
+        
+        with connection.pipeline() as pipe:
+            pipe.delete(store.key(id_))
+            store.save(id_, {'status': 'canceled', 'finished_at': now}, now + self.config['ttl'], pipe=pipe)
             pipe.execute()
-            
-        return id_
+        
+        events.publish(self.redis, id_, 'canceled')
+        
+        return outcome
     
-    def cancel(self, request, id_):
+    def cancel(self, request, ids):
         """
-        Cancel a job for the given image id.
+        Cancel the jobs for the given image ids, removing their files, and
+        return a json dictionary of id: what was done (see cancel_one).
+        
+        A single id that isn't known is a 404.
         """
-        job = self.queue.fetch_job(id_)
+        outcomes = dict((id_, self.cancel_one(id_)) for id_ in ids)
+        
+        if len(ids) == 1 and outcomes[ids[0]] == "unknown":
+            raise util.web.NotFound()
         
         response = Response()
+        response.json_body = outcomes
+        
+        return response
+    
+    def cancel_listed(self, request):
+        """
+        Cancel the jobs for the ids given with the request (see request_ids).
+        """
+        return self.cancel(request, self.request_ids(request, self.config['max_cancel']))
+    
+    def cancel_id(self, request, id_):
+        return self.cancel(request, [id_])
+    
+    def status_bodies(self, ids):
+        """
+        Return a dictionary of id: status info for each of the given image
+        ids, or id: None if there is no such job. 
+        
+        The info comes from each job's status record (see 
+        results.ResultStore). The few fields of the RQ job hash that show a 
+        worker was killed (or a job from before the records) are read in the
+        same pipeline, so everything is fetched in one round trip per redis 
+        server, however many ids there are.
+        """
+        by_shard = collections.OrderedDict()
+        
+        for id_ in ids:
+            by_shard.setdefault(self.shards.url_for(id_), []).append(id_)
         
-        response.json_body = "true"
+        bodies = {}
+        
+        for url, shard_ids in by_shard.items():
+            connection = self.shards.connection(url)
+            store = ResultStore(connection)
+            
+            with connection.pipeline(transaction=False) as pipe:
+                for id_ in shard_ids:
+                    pipe.hgetall(store.key(id_))
+                    pipe.hmget(Job.key_for(id_), "status", "ttl", "timeout", "meta")
+                    pipe.exists(jobs.cancelled_key(id_))
+                replies = pipe.execute()
+            
+            for index, id_ in enumerate(shard_ids):
+                record, fields, cancelled = replies[index * 3:index * 3 + 3]
+                bodies[id_] = self._status_body(ResultStore.decode(record), fields, cancelled)
         
-        job.cancel()
+        return bodies
+    
+    def _status_body(self, record, fields, cancelled):
+        """
+        Internal function. Build the status info for one id from what 
+        status_bodies fetched.
+        """
+        job_status, ttl, timeout, meta = fields
+        
+        if job_status is not None:
+            job_status = job_status.decode("utf-8")
+        
+        if record is None:
+            # queued before there were status records; it is all in the job
+            if job_status is None:
+                return None
+            
+            record = {'status': job_status, 'ttl': ttl, 'timeout': timeout}
+        
+        # records from before they had a status only held results
+        status = record.get('status', 'finished')
+        error = None
+        
+        if status in ('queued', 'started'):
+            if cancelled:
+                # its worker has been told to stop
+                status = 'canceled'
+            elif job_status is None:
+                # RQ has dropped it, e.g. its ttl ran out before it started
+                return None
+            elif job_status == 'failed':
+                # the worker was killed before it could say so itself
+                status = 'failed'
+        
+        if status == 'failed':
+            if 'error_type' in record:
+                error = {'type': record['error_type'], 'message': record.get('error_message')}
+                
+                if 'error_limit' in record:
+                    error['limit'] = record['error_limit']
+            elif meta:
+                # only unpickled when there is nothing better
+                error = self.serializer.loads(meta).get('error')
+        
+        def number(field, kind=float):
+            return kind(record[field]) if record.get(field) else None
+        
+        body = {
+            'ttl': number('ttl', int),
+            'status': status,
+            "is_failed": status == 'failed',
+            "is_finished": status == 'finished',
+            "is_queued": status == 'queued',
+            "is_started": status == 'started',
+            "timeout": number('timeout', int),
+            "enqueued_at": number('enqueued_at'),
+            "started_at": number('started_at'),
+            "finished_at": number('finished_at'),
+            "route": json.loads(record['route']) if record.get('route') else None,
+            "timings": json.loads(record['timings']) if record.get('timings') else None,
+            "result": None
+        }
+        
+        if status == 'finished':
+            body['result'] = dict((field, record[field]) for field in RESULT_FIELDS if field in record)
+        
+        if status == 'failed':
+            body['error'] = error
+        
+        return body
+    
+    def status_body(self, id_):
+        """
+        Return a dictionary of status info for an image id, or None if there
+        is no such job.
+        """
+        return self.status_bodies([id_])[id_]
+    
+    def statuses(self, request):
+        """
+        Return the status info for many image ids at once, given as for 
+        request_ids (GET or POST), up to self.config['max_status'] of them:
+        
+        {"jobs": {id: status info, ...}, "unknown": [ids with no job]}
+        """
+        ids = self.request_ids(request, self.config['max_status'])
+        bodies = self.status_bodies(ids)
+        
+        response = Response()
+        response.json_body = {
+            'jobs': dict((id_, body) for id_, body in bodies.items() if body is not None),
+            'unknown': [id_ for id_ in ids if bodies[id_] is None]
+        }
         
         return response
+    
+    def wait_time(self, request):
+        """
+        Return the number of seconds a /status request asked to wait for a
+        change, with ?wait=<seconds>, up to self.config['max_wait']. 0 if it
+        didn't ask.
+        """
+        value = request.GET.get('wait')
+        
+        if value in (None, ""):
+            return 0
+        
+        try:
+            seconds = float(value)
+        except ValueError:
+            raise util.web.BadRequest("Wait must be a number of seconds")
         
+        if seconds < 0:
+            raise util.web.BadRequest("Wait must be a number of seconds")
+        
+        return min(seconds, self.config['max_wait'])
     
     def status(self, request, id_):
         """
         Return a json string with status info.
         
-        Data is just proxied from the RQ job
+        With ?wait=<seconds>, a job that isn't done yet is given that long to 
+        change (start, finish or fail) before answering, so clients don't 
+        have to poll.
         """
-        job = self.queue.fetch_job(id_)
+        wait = self.wait_time(request)
+        inbox = None
+        
+        if wait:
+            # before looking, so a change in between isn't missed
+            inbox = self.events.subscribe(id_)
+        
+        try:
+            body = self.status_body(id_)
+            
+            if inbox is not None and body is not None and body['status'] not in self.final:
+                if self.events.wait(inbox, wait) is not None:
+                    body = self.status_body(id_)
+        finally:
+            if inbox is not None:
+                self.events.unsubscribe(id_, inbox)
+        
+        if body is None:
+            raise util.web.NotFound()
         
         response = Response()
+        response.json_body = body
         
-        response.json_body = {
-            'ttl': job.ttl,
-            'status': job.status,
-            "is_failed": job.is_failed,
-            "is_finished": job.is_finished,
-            "is_queued": job.is_queued,
-            "is_started": job.is_started,
-            "timeout": job.timeout,
-            "result": job.result
-        }
+        # even a finished status changes when it is canceled (and its files 
+        # go), so caches have to check every time; the ETag makes that cheap
+        response.cache_control = "private, no-cache"
+        response.md5_etag()
+        response.conditional_response = True
+        
+        return response
+    
+    def events_stream(self, request, id_):
+        """
+        Return a stream of server-sent events for an image id: a "status" 
+        event with the same info as /status/<id> straight away, then another
+        each time it changes, until the job is done, or for 
+        self.config['max_stream'] seconds, after which clients reconnect. 
+        
+        If the job goes away (e.g. it is cancelled), a "gone" event is sent
+        and the stream ends.
+        """
+        inbox = self.events.subscribe(id_)
+        body = self.status_body(id_)
+        
+        if body is None:
+            self.events.unsubscribe(id_, inbox)
+            raise util.web.NotFound()
+        
+        keepalive = self.config['keepalive']
+        end = time.time() + self.config['max_stream']
+        
+        def event(name, data):
+            return "event: {}\ndata: {}\n\n".format(name, json.dumps(data)).encode("utf-8")
+        
+        def stream(body):
+            try:
+                yield event("status", body)
+                
+                while body['status'] not in self.final and time.time() < end:
+                    if self.events.wait(inbox, min(keepalive, end - time.time())) is None:
+                        # keeps proxies from closing an idle connection
+                        yield b": keepalive\n\n"
+                        continue
+                    
+                    latest = self.status_body(id_)
+                    
+                    if latest is None:
+                        yield event("gone", {'id': id_})
+                        break
+                    
+                    if latest['status'] != body['status']:
+                        yield event("status", latest)
+                    
+                    body = latest
+            finally:
+                self.events.unsubscribe(id_, inbox)
+        
+        response = Response(content_type="text/event-stream", charset=None)
+        response.cache_control = "no-cache"
+        # stop nginx from holding the events back
+        response.headers['X-Accel-Buffering'] = "no"
+        response.app_iter = stream(body)
         
         return response
         
+    def tenant(self, request):
+        """
+        Return the name of the tenant the request is from, for sharing the 
+        workers fairly:
+        
+        "key:<name>" for an X-API-Key header holding one of the keys in 
+        self.config['api_keys'], then "user:<username>" for Basic auth 
+        credentials that check out, then "ip:<address>".
+        
+        Anything that doesn't check out falls through to the address, so a 
+        client can't get a new share by making up keys, or use someone 
+        else's by giving their username.
+        """
+        key = request.headers.get('X-API-Key')
+        
+        if key and key in self.config['api_keys']:
+            return "key:{}".format(self.config['api_keys'][key])
+        
+        username = self.verified_user(request)
+        
+        if username is not None:
+            return "user:{}".format(username)
+        
+        return "ip:{}".format(request.remote_addr)
+    
+    def verified_user(self, request):
+        """
+        Return the username from the request's Basic auth credentials if the
+        password is right, or None.
+        
+        Passwords are slow to check on purpose, so credentials that check 
+        out are remembered for self.config['auth_cache'] seconds, by a hash of
+        the header.
+        """
+        if not request.authorization or request.authorization[0].lower() != "basic":
+            return None
+        
+        header = request.headers.get('Authorization', "")
+        digest = hashlib.sha256(header.encode("utf-8")).hexdigest()
+        now = time.time()
+        
+        cached = self._verified.get(digest)
+        
+        if cached is not None and cached[1] > now:
+            return cached[0]
+        
+        try:
+            decoded = base64.b64decode(request.authorization[1]).decode("utf-8")
+            username, password = decoded.split(":", 1)
+        except (ValueError, TypeError):
+            return None
+        
+        if not self.users.authenticate(username, password):
+            return None
+        
+        if len(self._verified) > 10000:
+            self._verified.clear()
+        
+        self._verified[digest] = (username, now + self.config['auth_cache'])
+        
+        return username
+    
+    def callback(self, request):
+        """
+        Return the callback details for the upload in request, or None if it
+        didn't ask for one.
+        """
+        url = request.POST.get('callback')
+        
+        if not url:
+            return None
+        
+        if not callbacks.valid(url, self.config['callback_allow']):
+            raise util.web.BadRequest("Callback must be an http or https url on a public host")
+        
+        return {
+            'url': url,
+            'queue': callbacks.queue_name(self.queue_name),
+            'allow': self.config['callback_allow']
+        }
+    
+    def deadline(self, request):
+        """
+        Return the unix timestamp the upload in request should be done by, or
+        None if it didn't give a deadline.
+        
+        The deadline is given in the 'deadline' field, in seconds from now.
+        """
+        value = request.POST.get('deadline')
+        
+        if value in (None, ""):
+            return None
+        
+        try:
+            seconds = float(value)
+        except ValueError:
+            raise util.web.BadRequest("Deadline must be a number of seconds")
+        
+        # nan and inf parse as floats too
+        if not math.isfinite(seconds) or seconds <= 0:
+            raise util.web.BadRequest("Deadline must be a number of seconds")
+        
+        return time.time() + seconds
+    
     def clean(self, request):
         """
         Submit a file to be cleaned. Only supports JPEG images.
+        
+        Takes an optional 'deadline' field, the number of seconds the client
+        wants the result within. Jobs with a deadline are processed earliest 
+        deadline first, ahead of jobs without one.
+        
+        Takes an optional 'callback' field, an http(s) url the result is
+        POSTed to when the job is done (see exifcleaner.callbacks).
         """
+        # turn the upload away before it is read if the workers are behind,
+        # or if there is no room for it
+        self.admission.check()
+        self.space.reserve(request.content_length or 0)
+        
         source = request.POST['input'].file
+        
+        # check the upload is a jpeg before anything is made for it
+        if source.read(2) != b"\xff\xd8":
+            raise util.web.BadRequest("File is not a JPEG")
+        
+        source.seek(0)
+        
+        deadline = self.deadline(request)
+        callback = self.callback(request)
         id_ = self.id()
         
+        expires_at = time.time() + self.config['ttl']
+        location = self.layout.assign(id_, expires_at)
+        
         try:
-            exif = tempexif(source, id_, self.data_dir)
+            exif = tempexif(source, id_, storage.directory_for(self.data_dir, id_=id_, **location))
         except errors.ExifCleanerNotAJPEG:
-            raise util.BadRequest("File is not a JPEG")
+            raise util.web.BadRequest("File is not a JPEG")
+        
+        directory = os.path.dirname(exif.path)
+        
+        try:
+            self.quarantine.check(exif.digest)
+        except util.web.BadRequest:
+            storage.remove_files([id_], directory)
+            
+            keys = self.layout.keys([id_])
+            
+            if keys:
+                self.redis.delete(*keys)
+            
+            raise
+        
+        size = os.path.getsize(exif.path)
+        self.space.track(id_, size)
+        
+        # windowed layouts expire a whole window at once
+        self.expiry.add(id_, location.get('window', expires_at))
+        
+        route = self.router.route(size, request.POST.get('profile'))
+        meta = {
+            'enqueued_at': time.time(),
+            'route': route,
+            'deadline': deadline,
+            'tenant': self.tenant(request)
+        }
+        
+        # the result is kept by jobs.process, so the job can go as soon as it
+        # is done; and there is no point starting it after its files are gone.
+        queue = self.queues[self.shards.url_for(id_)][route['queue']]
+        
+        # jobs on other shards need to be told where everything else is
+        control_url = self.config['redis_url'] if len(self.shards) > 1 else None
+        
+        timeout = self.timeouts.timeout(size)
+        
+        ResultStore(queue.connection).save(id_, {
+            'status': 'queued',
+            'enqueued_at': meta['enqueued_at'],
+            'ttl': self.config['ttl'],
+            'timeout': timeout,
+            'route': json.dumps(route)
+        }, location.get('window', expires_at))
         
-        job = self.queue.enqueue(jobs.process, id_=id_, data_dir=self.data_dir, job_id=id_)
+        job = queue.enqueue(jobs.process,
+                            id_=id_,
+                            data_dir=self.data_dir,
+                            expires_at=expires_at,
+                            job_id=id_,
+                            meta=meta,
+                            result_ttl=0,
+                            ttl=self.config['ttl'],
+                            job_timeout=timeout,
+                            digest=exif.digest,
+                            limits=self.config['sandbox'],
+                            control_url=control_url,
+                            callback=callback,
+                            **location)
         
         response = Response()
         response.json_body = id_
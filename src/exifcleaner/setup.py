@@ -3,5 +3,11 @@ setup(
     name="exifcleaner",
     version="0.1",
     packages=["exifcleaner"],
-    install_requires=['webob', 'rq', 'englids', 'rq-scheduler', 'passlib', 'udatetime']
+    install_requires=['webob', 'rq', 'englids', 'rq-scheduler', 'passlib', 'udatetime'],
+    entry_points={
+        'console_scripts': [
+            'exifcleaner=exifcleaner.cli:main',
+            'exifcleaner-watch=exifcleaner.watch:main'
+        ]
+    }
 )
\ No newline at end of file
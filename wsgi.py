@@ -1,21 +1,27 @@
 from exifcleaner import ExifCleanerService, ActivationService
+from exifcleaner.admin.wsgi import AdminService
+from exifcleaner.artifacts import ArtifactService
+from exifcleaner.codes.wsgi import CodeService
+from exifcleaner.user.wsgi import UserService
+from exifcleaner.common.dispatch import Dispatcher
 from webob.static import DirectoryApp
-import re
 
 static = DirectoryApp("./static")
-data = DirectoryApp("./tmp")
+# images are processed in a child process that can use at most 512MB and 30s
+# of CPU; the workers in circus.ini keep it between jobs. Ids come from the
+# pool that circus.ini's id-pool watcher keeps topped up
+cleaner = ExifCleanerService(sandbox_memory=512 * 1024 * 1024, sandbox_cpu=30, id_pool=True)
 
-cleaner = ExifCleanerService()
+data = ArtifactService(cleaner.data_dir, cleaner.layout, cleaner.shards, cleaner.space)
 
 activation = ActivationService()
 
-def app(environ, start_response):
-    print("FIRST", environ['PATH_INFO'])
-    if re.search("/(clean)|(status/[^/]+)|(cancel/[^/]+)$", environ['PATH_INFO']):
-        return cleaner(environ, start_response)
-    elif re.search("^/data", environ['PATH_INFO']):
-        environ['PATH_INFO'] = environ['PATH_INFO'].replace("/data", "", 1)
-        return data(environ, start_response)
-    else:
-        return static(environ, start_response)
+codes = CodeService()
 
+users = UserService()
+
+# same servers as the cleaner, so queue counts cover every shard
+admin = AdminService(redis_url=cleaner.config['shard_urls'])
+
+# every service's routes, compiled once into one tree (see exifcleaner/common/dispatch.py)
+app = Dispatcher([cleaner, activation, codes, users, admin], mounts={"/data/": data}, default=static)